@@ -0,0 +1,87 @@
+"""
+Verified account identity for client-supplied credentials.
+
+Per-account state (stored OAuth tokens, snapshots, rate-limit buckets, sync
+state, search segments) is keyed by the account the provider reports for the
+caller's access token, never by ids the client puts in its credentials.
+Providers plug in by registering a verifier with ``register_account_verifier``;
+its answers are cached in Redis per token hash for ACCOUNT_VERIFICATION_TTL
+seconds. A caller whose access token has expired is still matched to its
+account through a refresh token the token manager stored for that account.
+"""
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from config import config
+
+from redis_client import (
+    add_key_value_redis,
+    get_value_redis,
+)
+
+_verifiers: dict[str, Callable[[str], Awaitable[Optional[str]]]] = {}
+
+
+class AccountVerificationError(Exception):
+    """The provider's token info lookup failed (as opposed to rejecting the token)."""
+
+
+def register_account_verifier(provider: str, verifier: Callable[[str], Awaitable[Optional[str]]]):
+    """Register ``verifier(access_token) -> account id``, or ``None`` if the provider rejects the token."""
+    _verifiers[provider] = verifier
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _verified_key(provider: str, access_token: str) -> str:
+    return f'verified_accounts:{provider}:{_token_hash(access_token)}'
+
+
+def _refresh_key(provider: str, refresh_token: str) -> str:
+    return f'verified_accounts:{provider}:refresh:{_token_hash(refresh_token)}'
+
+
+def parse_credentials(credentials: str) -> dict:
+    """The JSON credentials a client sends; HTTPException 400 if malformed or without an access token."""
+    try:
+        parsed = json.loads(credentials)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Invalid credentials.')
+    if not isinstance(parsed, dict) or not parsed.get('access_token'):
+        raise HTTPException(status_code=400, detail='Missing access token.')
+    return parsed
+
+
+async def bind_refresh_token(provider: str, refresh_token: str, account: str):
+    """Remember that ``refresh_token`` belongs to ``account`` (for callers whose access token expired)."""
+    await add_key_value_redis(_refresh_key(provider, refresh_token), account, expire=config.TOKEN_STORE_TTL)
+
+
+async def verified_account(provider: str, credentials: str) -> str:
+    """The provider's id for the account ``credentials`` belong to.
+
+    Raises HTTPException 400 for malformed credentials, 401 if the provider
+    rejects the access token and no known refresh token accompanies it, and
+    502 if the lookup itself fails.
+    """
+    tokens = parse_credentials(credentials)
+    key = _verified_key(provider, tokens['access_token'])
+    cached = await get_value_redis(key)
+    if cached is not None:
+        account = cached.decode('utf-8')
+    else:
+        try:
+            account = await _verifiers[provider](tokens['access_token']) or ''
+        except AccountVerificationError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        # Rejected tokens are cached too, so an expired token costs one upstream lookup per TTL
+        await add_key_value_redis(key, account, expire=config.ACCOUNT_VERIFICATION_TTL)
+    if not account and tokens.get('refresh_token'):
+        bound = await get_value_redis(_refresh_key(provider, tokens['refresh_token']))
+        account = bound.decode('utf-8') if bound else ''
+    if not account:
+        raise HTTPException(status_code=401, detail=f'The {provider} access token was rejected.')
+    return account
@@ -0,0 +1,149 @@
+"""
+Batch ``/load`` for many accounts across providers in one request.
+
+``POST /integrations/load/batch`` takes a list of credential sets, loads each
+account through the same snapshot cache as the single-account routes and
+streams one NDJSON line per account as soon as it finishes, successes and
+errors alike. Loads run concurrently, capped by ``BATCH_LOAD_CONCURRENCY``
+overall and by ``<PROVIDER>_BATCH_LOAD_CONCURRENCY`` per provider. The caps
+are per worker and shared by all batch requests it serves.
+"""
+import asyncio
+import json
+import time
+from typing import Optional, Union
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from config import config
+from accounts import parse_credentials
+from metrics import Counter
+from providers import Provider
+from streaming import NDJSON_MEDIA_TYPE
+
+BATCH_LOAD_ACCOUNTS = Counter(
+    'batch_load_accounts_total', 'Accounts loaded through /integrations/load/batch, by provider and status code.',
+    ('provider', 'status'),
+)
+
+_global_slots: Optional[asyncio.Semaphore] = None
+_provider_slots: dict[str, asyncio.Semaphore] = {}
+
+
+class BatchLoadAccount(BaseModel):
+    provider: str
+    # The same JSON credentials the single-account routes take as a form field
+    credentials: Union[str, dict]
+    max_items: Optional[int] = None
+    hierarchy: bool = False
+    records: bool = False
+    fields: Optional[list[str]] = None
+    page_size: Optional[int] = Field(None, ge=1, le=100)
+    depth: Optional[int] = None
+    # Adds the account's items to its /search index
+    index: bool = False
+    # Echoed back on the result line, e.g. "org_id/user_id"
+    key: Optional[str] = None
+
+
+class BatchLoadRequest(BaseModel):
+    accounts: list[BatchLoadAccount]
+    no_cache: bool = False
+    include_items: bool = True
+
+
+def _slots(provider: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+    global _global_slots
+    if _global_slots is None:
+        _global_slots = asyncio.Semaphore(max(1, config.BATCH_LOAD_CONCURRENCY))
+    if provider not in _provider_slots:
+        limit = getattr(config, f'{provider.upper()}_BATCH_LOAD_CONCURRENCY', config.BATCH_LOAD_CONCURRENCY)
+        _provider_slots[provider] = asyncio.Semaphore(max(1, limit))
+    return _global_slots, _provider_slots[provider]
+
+
+def validate_batch(batch: BatchLoadRequest, providers: dict[str, Provider]):
+    """Reject the whole batch up front for problems that are not specific to one account's data."""
+    if not batch.accounts:
+        raise HTTPException(status_code=400, detail='accounts must not be empty.')
+    if len(batch.accounts) > config.BATCH_LOAD_MAX_ACCOUNTS:
+        raise HTTPException(
+            status_code=400, detail=f'At most {config.BATCH_LOAD_MAX_ACCOUNTS} accounts per batch.',
+        )
+    for index, account in enumerate(batch.accounts):
+        provider = providers.get(account.provider)
+        if provider is None:
+            raise HTTPException(status_code=400, detail=f'accounts[{index}]: {account.provider} is not enabled.')
+        try:
+            _account_options(account, provider)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f'accounts[{index}]: {e}')
+
+
+def _account_options(account: BatchLoadAccount, provider: Provider) -> dict:
+    return provider.load_options(
+        max_items=account.max_items, hierarchy=account.hierarchy,
+        records=account.records, fields=account.fields, page_size=account.page_size, depth=account.depth,
+    )
+
+
+def _result_line(result: dict, items: Optional[bytes] = None) -> bytes:
+    line = json.dumps(result, separators=(',', ':')).encode('utf-8')
+    if items is not None:
+        # Splice the cached JSON array in as-is instead of decoding and re-encoding it
+        line = line[:-1] + b',"items":' + items + b'}'
+    return line + b'\n'
+
+
+async def _load_account(index: int, account: BatchLoadAccount, provider: Provider, batch: BatchLoadRequest) -> bytes:
+    result = {'index': index, 'key': account.key, 'provider': provider.name}
+    credentials = account.credentials if isinstance(account.credentials, str) else json.dumps(account.credentials)
+    options = _account_options(account, provider)
+    global_slots, provider_slots = _slots(provider.name)
+    started = None
+    try:
+        # Malformed credentials fail here with a 400 instead of taking a slot
+        parse_credentials(credentials)
+        # Wait for the provider's slot first so a backlog for one provider does not hold global slots
+        async with provider_slots, global_slots:
+            started = time.perf_counter()
+            result['account'] = await provider.verified_account(credentials)
+            response = await provider.load_cached(credentials, options, bypass=batch.no_cache, index=account.index)
+    except HTTPException as e:
+        result.update(status=e.status_code, error=e.detail)
+    except Exception as e:
+        print(f'Batch load of {provider.name} account {result.get("account")} failed: {e!r}')
+        result.update(status=502, error=str(e) or type(e).__name__)
+    else:
+        result.update(
+            status=200,
+            cache=response.headers.get('x-cache'),
+            item_count=int(response.headers['x-item-count']) if 'x-item-count' in response.headers else None,
+        )
+    if started is not None:
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    BATCH_LOAD_ACCOUNTS.inc(provider=provider.name, status=result['status'])
+    if result['status'] == 200 and batch.include_items:
+        return _result_line(result, response.body)
+    return _result_line(result)
+
+
+def batch_load_response(batch: BatchLoadRequest, providers: dict[str, Provider]) -> StreamingResponse:
+    """Stream one result line per account, in completion order; ``index`` refers back to the request."""
+    validate_batch(batch, providers)
+
+    async def body():
+        tasks = [
+            asyncio.create_task(_load_account(index, account, providers[account.provider], batch))
+            for index, account in enumerate(batch.accounts)
+        ]
+        try:
+            for next_completed in asyncio.as_completed(tasks):
+                yield await next_completed
+        finally:
+            # The client went away: stop loading accounts nobody will read
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, headers={'X-Account-Count': str(len(batch.accounts))})
@@ -0,0 +1,111 @@
+"""
+Airtable record loading throughput against the local mock upstream.
+
+Starts ``benchmarks.mock_servers`` as a subprocess, points the Airtable
+integration at it and runs ``iter_items_airtable(records=True)`` in this
+process with different projections and page sizes. Reports records, upstream
+requests and bytes received, and records/s overall and per base (Airtable's
+rate limit is per base). Needs Redis like the app itself. Run from backend/:
+
+    python -m benchmarks.bench_airtable_records [--items 4] [--records-per-table 2000] [--latency-ms 50]
+
+``--items`` is the number of bases. Rate limits are lifted unless
+``--respect-rate-limits`` is given, which shows the 5 requests/s per base cap.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.bench_load import _backend_env, _start, _wait_until_up
+from benchmarks.mock_servers import MOCK_SETTINGS, add_arguments as add_mock_arguments
+
+# (label, fields projection, page size); None projects the primary field only
+SCENARIOS = [
+    ('all fields, pageSize 100', 'all', 100),
+    ('primary field, pageSize 100', None, 100),
+    ('primary field, pageSize 20', None, 20),
+]
+
+
+async def _run_scenario(iter_items_airtable, upstream: dict, fields, page_size: int, run_id: str):
+    credentials = json.dumps({'access_token': f'benchmark-{run_id}-{page_size}-{fields is None}'})
+    upstream.update(requests=0, bytes=0)
+    records = 0
+    started = time.perf_counter()
+    async for item in iter_items_airtable(credentials, records=True, fields=fields, page_size=page_size):
+        records += item.type == 'Record'
+    elapsed = time.perf_counter() - started
+    return {
+        'records': records,
+        'requests': upstream['requests'],
+        'mib': upstream['bytes'] / 2 ** 20,
+        'seconds': elapsed,
+        'records_per_second': records / elapsed if elapsed else float('nan'),
+    }
+
+
+async def run(args) -> list[dict]:
+    mock_url = f'http://127.0.0.1:{args.mock_port}'
+    mock_args = ['-m', 'benchmarks.mock_servers', '--port', str(args.mock_port)]
+    for name in MOCK_SETTINGS:
+        mock_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    mock = _start(mock_args)
+    try:
+        await _wait_until_up(f'{mock_url}/docs', mock)
+        # Settings are read at import time, so configure before importing the integration
+        os.environ.update(_backend_env(mock_url, args.respect_rate_limits))
+        os.environ.setdefault('AIRTABLE_CLIENT_ID', 'benchmark')
+        os.environ.setdefault('AIRTABLE_CLIENT_SECRET', 'benchmark')
+        from http_client import init_http_client, close_http_client
+        from integrations.airtable import iter_items_airtable
+
+        upstream = {'requests': 0, 'bytes': 0}
+
+        async def count_response(response):
+            await response.aread()
+            upstream['requests'] += 1
+            upstream['bytes'] += len(response.content)
+
+        client = await init_http_client()
+        client.event_hooks['response'].append(count_response)
+        all_fields = ['Name'] + [f'Notes {f}' for f in range(1, args.fields_per_table + 1)]
+        run_id = str(int(time.time()))
+        rows = []
+        try:
+            for label, fields, page_size in SCENARIOS:
+                result = await _run_scenario(
+                    iter_items_airtable, upstream,
+                    all_fields if fields == 'all' else fields, page_size, run_id,
+                )
+                result.update(scenario=label, per_base=result['records_per_second'] / max(args.items, 1))
+                rows.append(result)
+        finally:
+            await close_http_client()
+        return rows
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--respect-rate-limits', action='store_true',
+                        help='keep the default upstream rate limits instead of lifting them')
+    parser.add_argument('--mock-port', type=int, default=8900)
+    add_mock_arguments(parser)
+    parser.set_defaults(items=4, records_per_table=2000)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    print(f'{args.items} bases x {args.tables_per_base} tables x {args.records_per_table:,} records, '
+          f'{args.fields_per_table + 1} fields per table, {args.latency_ms:g} ms latency\n')
+    print(f"{'scenario':<28} {'records':>8} {'requests':>8} {'MiB':>7} {'seconds':>8} {'records/s':>10} {'per base':>9}")
+    for row in rows:
+        print(f"{row['scenario']:<28} {row['records']:>8,} {row['requests']:>8} {row['mib']:>7.1f} "
+              f"{row['seconds']:>8.2f} {row['records_per_second']:>10,.0f} {row['per_base']:>9,.0f}")
+
+
+if __name__ == '__main__':
+    main()
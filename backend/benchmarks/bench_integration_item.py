@@ -0,0 +1,104 @@
+"""
+Micro-benchmark: memory per IntegrationItem and bulk serialization time.
+
+Compares the slotted IntegrationItem + serialize_many (rendered straight to
+JSON, as the /load routes now do) against the previous __dict__-backed class
+serialized with vars() and FastAPI's jsonable_encoder. Run from backend/:
+
+    python -m benchmarks.bench_integration_item [--items 100000]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+
+from integrations.integration_item import IntegrationItem, serialize_many
+
+
+class DictIntegrationItem:
+    """The pre-slots IntegrationItem, kept here only as a baseline."""
+
+    def __init__(self, id=None, type=None, directory=False, parent_path_or_name=None, parent_id=None,
+                 name=None, creation_time=None, last_modified_time=None, url=None, children=None,
+                 mime_type=None, delta=None, drive_id=None, visibility=True):
+        self.id = id
+        self.type = type
+        self.directory = directory
+        self.parent_path_or_name = parent_path_or_name
+        self.parent_id = parent_id
+        self.name = name
+        self.creation_time = creation_time
+        self.last_modified_time = last_modified_time
+        self.url = url
+        self.children = children
+        self.mime_type = mime_type
+        self.delta = delta
+        self.drive_id = drive_id
+        self.visibility = visibility
+
+
+def _legacy_render(items):
+    return json.dumps(jsonable_encoder([vars(item) for item in items]))
+
+
+def _render(items):
+    return json.dumps(serialize_many(items))
+
+
+def _build(cls, count, with_datetimes):
+    now = datetime.now(timezone.utc)
+    created = now if with_datetimes else '2024-01-01T00:00:00Z'
+    return [
+        cls(id=f'contact_{i}', type='contact', name=f'Contact {i}', parent_id=f'company_{i % 100}',
+            creation_time=created, last_modified_time=created)
+        for i in range(count)
+    ]
+
+
+def _measure_memory(cls, count):
+    gc.collect()
+    tracemalloc.start()
+    items = _build(cls, count, with_datetimes=False)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current / count
+
+
+def _measure_render(cls, render, count, with_datetimes, repeat=3):
+    items = _build(cls, count, with_datetimes)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render(items)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f'Items: {args.items:,}\n')
+    legacy_mem = _measure_memory(DictIntegrationItem, args.items)
+    slotted_mem = _measure_memory(IntegrationItem, args.items)
+    print('Memory per item (bytes, includes id/name strings)')
+    print(f'  __dict__ class : {legacy_mem:8.1f}')
+    print(f'  slotted class  : {slotted_mem:8.1f}  ({legacy_mem / slotted_mem:.2f}x smaller)\n')
+
+    for with_datetimes in (False, True):
+        label = 'datetime timestamps' if with_datetimes else 'string timestamps'
+        legacy = _measure_render(DictIntegrationItem, _legacy_render, args.items, with_datetimes)
+        bulk = _measure_render(IntegrationItem, _render, args.items, with_datetimes)
+        print(f'Serialize {args.items:,} items to JSON ({label}), best of 3')
+        print(f'  vars() + jsonable_encoder : {legacy * 1000:8.1f} ms')
+        print(f'  serialize_many()          : {bulk * 1000:8.1f} ms  ({legacy / bulk:.1f}x faster)\n')
+
+
+if __name__ == '__main__':
+    main()
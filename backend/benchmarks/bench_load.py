@@ -0,0 +1,219 @@
+"""
+End-to-end /load benchmark against local stand-ins for HubSpot, Airtable and Notion.
+
+Starts ``benchmarks.mock_servers`` and the backend (uvicorn ``main:app``) as
+subprocesses, points the integrations at the mock through the
+``*_API_BASE_URL`` settings and runs three scenarios per provider:
+
+- cold: sequential loads with ``?no_cache=true`` (full upstream crawl)
+- warm: sequential loads served from the snapshot cache
+- concurrent: ``--users`` distinct accounts loading at the same time
+
+and reports p50/p95/p99 latency, requests per second and the backend's peak
+RSS. The backend needs Redis as usual (REDIS_HOST/REDIS_PORT). Run from backend/:
+
+    python -m benchmarks.bench_load [--items 1000] [--latency-ms 20] [--rate-429 0.02] [--users 20]
+
+Pass ``--app-url`` to benchmark an already running backend instead (it must be
+configured to use the mock server; peak RSS is then not reported).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.mock_servers import MOCK_SETTINGS, add_arguments as add_mock_arguments
+
+PROVIDERS = ('hubspot', 'airtable', 'notion')
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float('nan')
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def _peak_rss_mb(pid: int):
+    """Peak resident set size of a process in MiB (Linux ``VmHWM``), or None if unavailable."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _start(args: list[str], env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env)
+
+
+async def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f'{url} exited with code {process.returncode}')
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+def _backend_env(mock_url: str, respect_rate_limits: bool) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'HUBSPOT_API_BASE_URL': mock_url,
+        'AIRTABLE_API_BASE_URL': mock_url,
+        'NOTION_API_BASE_URL': mock_url,
+        # Keep snapshots fresh for the whole run so warm loads are cache hits
+        'ITEM_CACHE_FRESH_SECONDS': '3600',
+    })
+    # Providers without client credentials are not enabled, so their routes would 404
+    for provider in ('HUBSPOT', 'AIRTABLE', 'NOTION'):
+        env.setdefault(f'{provider}_CLIENT_ID', 'benchmark')
+        env.setdefault(f'{provider}_CLIENT_SECRET', 'benchmark')
+    if not respect_rate_limits:
+        # Measure the loaders, not the published upstream limits
+        for name in ('HUBSPOT_RATE_LIMIT', 'HUBSPOT_RATE_BURST', 'HUBSPOT_SEARCH_RATE_LIMIT',
+                     'AIRTABLE_REQUESTS_PER_SECOND', 'AIRTABLE_TOKEN_RATE_LIMIT', 'NOTION_RATE_LIMIT', 'NOTION_RATE_BURST'):
+            env[name] = '100000'
+    return env
+
+
+async def _load(client: httpx.AsyncClient, app_url: str, provider: str, account: str, no_cache: bool, params: dict = None):
+    params = dict(params or {})
+    if no_cache:
+        params['no_cache'] = 'true'
+    started = time.perf_counter()
+    response = await client.post(
+        f'{app_url}/integrations/{provider}/load',
+        params=params,
+        data={'credentials': json.dumps({'access_token': f'benchmark-{account}'})},
+    )
+    elapsed = time.perf_counter() - started
+    items = len(response.json()) if response.status_code == 200 else 0
+    return elapsed, response.status_code == 200, items
+
+
+async def _scenario(client, app_url, provider, users: int, requests: int, no_cache: bool, run_id: str, params: dict = None):
+    async def user(index: int):
+        return [await _load(client, app_url, provider, f'{run_id}-{provider}-{index}', no_cache, params) for _ in range(requests)]
+
+    started = time.perf_counter()
+    results = [result for per_user in await asyncio.gather(*(user(i) for i in range(users))) for result in per_user]
+    wall = time.perf_counter() - started
+    latencies = sorted(elapsed for elapsed, ok, _ in results if ok)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, ok, _ in results if not ok),
+        'items': max((items for _, _, items in results), default=0),
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p95_ms': _percentile(latencies, 95) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'rps': len(results) / wall if wall else float('nan'),
+    }
+
+
+async def run(args) -> list[dict]:
+    mock_url = f'http://127.0.0.1:{args.mock_port}'
+    mock_args = ['-m', 'benchmarks.mock_servers', '--port', str(args.mock_port)]
+    for name in MOCK_SETTINGS:
+        mock_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    processes = [_start(mock_args)]
+    backend = None
+    try:
+        await _wait_until_up(f'{mock_url}/docs', processes[0])
+        app_url = args.app_url
+        if app_url is None:
+            app_url = f'http://127.0.0.1:{args.app_port}'
+            backend = _start(
+                ['-m', 'uvicorn', 'main:app', '--port', str(args.app_port), '--log-level', 'warning'],
+                env=_backend_env(mock_url, args.respect_rate_limits),
+            )
+            processes.append(backend)
+        await _wait_until_up(f'{app_url}/', backend)
+
+        # Unique accounts per run so earlier snapshots do not turn cold loads warm
+        run_id = str(int(time.time()))
+        limits = httpx.Limits(max_connections=max(args.users, 1) * 2)
+        rows = []
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            for provider in args.providers:
+                params = None
+                if provider == 'hubspot' and args.hubspot_hierarchy:
+                    params = {'hierarchy': 'true'}
+                elif provider == 'notion' and args.notion_depth:
+                    params = {'depth': args.notion_depth}
+                scenarios = [
+                    ('cold', 1, True),
+                    ('warm', 1, False),
+                    ('concurrent', args.users, True),
+                ]
+                for name, users, no_cache in scenarios:
+                    if name == 'warm':
+                        # Prime the snapshot for the account the warm loads use
+                        await _load(client, app_url, provider, f'{run_id}-{provider}-0', no_cache=True, params=params)
+                    result = await _scenario(client, app_url, provider, users, args.requests, no_cache, run_id, params)
+                    result.update(provider=provider, scenario=name, users=users)
+                    result['peak_rss_mb'] = _peak_rss_mb(backend.pid) if backend else None
+                    rows.append(result)
+        return rows
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def _print_table(rows: list[dict]):
+    print(f"{'provider':<9} {'scenario':<11} {'users':>5} {'reqs':>5} {'errors':>6} {'items':>7} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'peak RSS':>9}")
+    for row in rows:
+        rss = f"{row['peak_rss_mb']:.0f} MiB" if row['peak_rss_mb'] is not None else 'n/a'
+        print(f"{row['provider']:<9} {row['scenario']:<11} {row['users']:>5} {row['requests']:>5} {row['errors']:>6} "
+              f"{row['items']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+              f"{row['rps']:>8.2f} {rss:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--providers', nargs='+', choices=PROVIDERS, default=list(PROVIDERS))
+    parser.add_argument('--users', type=int, default=10, help='concurrent accounts in the concurrent scenario')
+    parser.add_argument('--requests', type=int, default=5, help='loads per user in each scenario')
+    parser.add_argument('--hubspot-hierarchy', action='store_true',
+                        help='load HubSpot with ?hierarchy=true (company associations)')
+    parser.add_argument('--notion-depth', type=int, default=None,
+                        help='load Notion with ?depth=N (block-tree expansion)')
+    parser.add_argument('--respect-rate-limits', action='store_true',
+                        help='keep the default upstream rate limits instead of lifting them')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--mock-port', type=int, default=8900)
+    parser.add_argument('--app-port', type=int, default=8901)
+    parser.add_argument('--app-url', default=None, help='benchmark an already running backend')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f'Mock upstream: {args.items:,} items, page size {args.max_page_size}, '
+              f'{args.latency_ms:g} ms latency, {args.rate_429:.0%} 429s\n')
+        _print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
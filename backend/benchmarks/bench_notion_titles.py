@@ -0,0 +1,153 @@
+"""
+Micro-benchmark: Notion item name extraction.
+
+Builds synthetic /v1/search results (workspace pages, database rows with many
+typed properties, databases, untitled pages, mentions) and compares
+create_integration_item_metadata_object against the previous implementation
+that ran _recursive_dict_search over ``properties`` and then the whole object.
+Fails if any produced name differs. Run from backend/:
+
+    python -m benchmarks.bench_notion_titles [--results 10000]
+"""
+import argparse
+import random
+import time
+
+from integrations.notion import _extract_name, _recursive_dict_search, create_integration_item_metadata_object
+
+USER = {'object': 'user', 'id': 'user-1'}
+
+
+def legacy_name(response_json: dict) -> str:
+    """Name as computed before the typed extractor, kept here only as a baseline."""
+    name = _recursive_dict_search(response_json['properties'], 'content')
+    name = _recursive_dict_search(response_json, 'content') if name is None else name
+    name = 'multi_select' if name is None else name
+    return response_json['object'] + ' ' + name
+
+
+def _text(content: str) -> dict:
+    return {
+        'type': 'text',
+        'text': {'content': content, 'link': None},
+        'annotations': {'bold': False, 'italic': False, 'strikethrough': False,
+                        'underline': False, 'code': False, 'color': 'default'},
+        'plain_text': content,
+        'href': None,
+    }
+
+
+def _mention(page_id: str) -> dict:
+    return {
+        'type': 'mention',
+        'mention': {'type': 'page', 'page': {'id': page_id}},
+        'annotations': {'bold': False, 'italic': False, 'color': 'default'},
+        'plain_text': 'Untitled',
+        'href': f'https://www.notion.so/{page_id}',
+    }
+
+
+def _row_properties(i: int, rng: random.Random) -> dict:
+    properties = {
+        'Status': {'id': 's', 'type': 'status', 'status': {'id': '1', 'name': 'In progress', 'color': 'blue'}},
+        'Tags': {'id': 't', 'type': 'multi_select', 'multi_select': [
+            {'id': str(n), 'name': f'tag {n}', 'color': 'gray'} for n in range(rng.randint(0, 4))
+        ]},
+        'Owner': {'id': 'o', 'type': 'people', 'people': [dict(USER, name='Ada', type='person', person={'email': 'a@example.com'})]},
+        'Due': {'id': 'd', 'type': 'date', 'date': {'start': '2024-05-01', 'end': None, 'time_zone': None}},
+        'Priority': {'id': 'p', 'type': 'select', 'select': {'id': '2', 'name': 'High', 'color': 'red'}},
+        'Estimate': {'id': 'e', 'type': 'number', 'number': rng.randint(1, 13)},
+        'Link': {'id': 'l', 'type': 'url', 'url': 'https://example.com'},
+        'Done': {'id': 'c', 'type': 'checkbox', 'checkbox': False},
+        'Related': {'id': 'r', 'type': 'relation', 'relation': [{'id': f'page-{i - 1}'}], 'has_more': False},
+        'Score': {'id': 'f', 'type': 'formula', 'formula': {'type': 'number', 'number': 3}},
+        'Created by': {'id': 'cb', 'type': 'created_by', 'created_by': USER},
+        'Notes': {'id': 'n', 'type': 'rich_text', 'rich_text': [_text(f'note {i}')] if rng.random() < 0.3 else []},
+        'Rollup': {'id': 'ro', 'type': 'rollup', 'rollup': {'type': 'array', 'function': 'show_original', 'array': [
+            {'type': 'title', 'title': [_text(f'parent {i}')]}
+        ] if rng.random() < 0.2 else []}},
+        'Name': {'id': 'title', 'type': 'title', 'title': [_text(f'Task {i}')] if rng.random() < 0.95 else []},
+    }
+    # The API does not guarantee property order; the title is often last
+    names = list(properties)
+    rng.shuffle(names)
+    return {name: properties[name] for name in names}
+
+
+def _base(i: int, object_type: str) -> dict:
+    return {
+        'object': object_type,
+        'id': f'{object_type}-{i}',
+        'created_time': '2024-01-01T00:00:00.000Z',
+        'last_edited_time': '2024-02-01T00:00:00.000Z',
+        'created_by': USER,
+        'last_edited_by': USER,
+        'cover': None,
+        'icon': {'type': 'emoji', 'emoji': '📄'},
+        'archived': False,
+        'url': f'https://www.notion.so/{object_type}-{i}',
+    }
+
+
+def build_results(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.35:
+            result = _base(i, 'page')
+            title = [_text(f'Page {i}')] if rng.random() < 0.9 else [_mention(f'page-{i - 1}')]
+            result['parent'] = {'type': 'workspace', 'workspace': True}
+            result['properties'] = {'title': {'id': 'title', 'type': 'title', 'title': title}}
+        elif kind < 0.9:
+            result = _base(i, 'page')
+            result['parent'] = {'type': 'database_id', 'database_id': f'database-{i % 50}'}
+            result['properties'] = _row_properties(i, rng)
+        else:
+            result = _base(i, 'database')
+            result['parent'] = {'type': 'page_id', 'page_id': f'page-{i - 1}'}
+            result['title'] = [_text(f'Database {i}')] if rng.random() < 0.9 else []
+            result['description'] = [_text('Tracked work')] if rng.random() < 0.5 else []
+            result['properties'] = {
+                'Name': {'id': 'title', 'name': 'Name', 'type': 'title', 'title': {}},
+                'Tags': {'id': 't', 'name': 'Tags', 'type': 'multi_select', 'multi_select': {'options': [
+                    {'id': '1', 'name': 'a', 'color': 'red'}, {'id': '2', 'name': 'b', 'color': 'blue'},
+                ]}},
+                'Notes': {'id': 'n', 'name': 'Notes', 'type': 'rich_text', 'rich_text': {}},
+            }
+            result['is_inline'] = False
+        results.append(result)
+    return results
+
+
+def _best_of(func, results, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        names = [func(result) for result in results]
+        best = min(best, time.perf_counter() - started)
+    return best, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = build_results(args.results, args.seed)
+    legacy, legacy_names = _best_of(legacy_name, results)
+    current, _ = _best_of(_extract_name, results)
+    names = [create_integration_item_metadata_object(result).name for result in results]
+    mismatches = [(old, new) for old, new in zip(legacy_names, names) if old != new]
+
+    print(f'Name extraction for {args.results:,} results (best of 3)')
+    print(f'  _recursive_dict_search : {legacy * 1000:8.1f} ms')
+    print(f'  _extract_name          : {current * 1000:8.1f} ms  ({legacy / current:.1f}x faster)')
+    print(f'Identical item names     : {len(names) - len(mismatches):,} / {len(names):,}')
+    if mismatches:
+        raise SystemExit(f'Name mismatch, e.g. {mismatches[0]!r}')
+
+
+if __name__ == '__main__':
+    main()
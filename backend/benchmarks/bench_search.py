@@ -0,0 +1,148 @@
+"""
+Micro-benchmark: cross-integration name search.
+
+Builds search segments from synthetic items split over several segments (as
+if searching that many accounts at once), then reports the build time,
+stored (compressed) size, decode time after a restart and query latency
+percentiles for prefix queries of different lengths, two-word queries and
+type-filtered queries. Results are checked against a linear scan for a sample
+of queries. The vocabulary is small, so every word matches a few percent of
+all items: a worst case for two-word queries, which intersect the matches of
+both words. Runs in-process and needs no Redis. Run from backend/:
+
+    python -m benchmarks.bench_search [--items 1000000] [--segments 4] [--queries 2000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from search_index import Segment, SegmentBuilder, search_segments, tokenize
+
+FIRST = ['Ada', 'Alan', 'Grace', 'Linus', 'Margaret', 'Ken', 'Barbara', 'Dennis', 'Frances', 'John',
+         'Katherine', 'Edsger', 'Radia', 'Tim', 'Sophie', 'Guido', 'Anita', 'Donald', 'Hedy', 'Niklaus']
+LAST = ['Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Hamilton', 'Thompson', 'Liskov', 'Ritchie', 'Allen',
+        'McCarthy', 'Johnson', 'Dijkstra', 'Perlman', 'Berners-Lee', 'Wilson', 'van Rossum', 'Borg', 'Knuth',
+        'Lamarr', 'Wirth']
+WORDS = ['Acme', 'Global', 'Quarterly', 'Roadmap', 'Planning', 'Design', 'Review', 'Launch', 'Budget', 'Hiring',
+         'Onboarding', 'Security', 'Migration', 'Customer', 'Research', 'Notes', 'Sprint', 'Retro', 'Partner',
+         'Renewal', 'Enterprise', 'Support', 'Analytics', 'Platform', 'Infrastructure', 'Marketing', 'Sales']
+TYPES = ['contact', 'company', 'deal', 'page', 'database', 'block', 'Table', 'Record']
+
+
+def _name(rng: random.Random, n: int) -> str:
+    kind = n % 3
+    if kind == 0:
+        return f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+    if kind == 1:
+        return f'{rng.choice(WORDS)} {rng.choice(WORDS)} {n % 9973}'
+    return f'{rng.choice(WORDS)}-{rng.choice(WORDS)} {rng.choice(WORDS)} Q{n % 4 + 1} {2020 + n % 6}'
+
+
+def synthetic_rows(items: int, segments: int, seed: int = 1) -> list[list[dict]]:
+    rng = random.Random(seed)
+    per_segment = items // segments
+    return [
+        [
+            {'id': f'item-{n}', 'name': _name(rng, n), 'type': TYPES[n % len(TYPES)]}
+            for n in range(number * per_segment, (number + 1) * per_segment)
+        ]
+        for number in range(segments)
+    ]
+
+
+def build_segments(rows_by_segment: list[list[dict]]) -> list[Segment]:
+    segments = []
+    for number, rows in enumerate(rows_by_segment):
+        builder = SegmentBuilder()
+        for row in rows:
+            builder.add(row['id'], row['name'], row['type'])
+        segments.append(builder.build(f'provider{number}', 'account'))
+    return segments
+
+
+def _scan(rows_by_segment, tokens: list[str], item_type, limit: int) -> list[str]:
+    """Reference ranking by scoring every item."""
+    keyed = []
+    for rows in rows_by_segment:
+        for row in rows:
+            if item_type is not None and row['type'] != item_type:
+                continue
+            words = tokenize(row['name'])
+            if not words or not all(any(word.startswith(token) for word in words) for token in tokens):
+                continue
+            if words[0].startswith(tokens[0]):
+                key = (0, words[0])
+            else:
+                matched = [word for word in words[1:] if word.startswith(tokens[0])]
+                if not matched:
+                    continue
+                key = (1, min(matched))
+            keyed.append((key + (row['name'].casefold(), row['id']), row['id']))
+    keyed.sort()
+    return [item_id for _, item_id in keyed[:limit]]
+
+
+def _queries(rng: random.Random, count: int) -> dict[str, list[tuple[str, str]]]:
+    vocabulary = sorted({word for name in FIRST + LAST + WORDS for word in tokenize(name)})
+    queries = {}
+    for length in (1, 2, 3, 5):
+        queries[f'prefix, {length} char{"s" if length > 1 else ""}'] = [
+            (rng.choice(vocabulary)[:length], None) for _ in range(count)
+        ]
+    queries['two words'] = [
+        (f'{rng.choice(vocabulary)} {rng.choice(vocabulary)[:2]}', None) for _ in range(count)
+    ]
+    queries['prefix + type filter'] = [
+        (rng.choice(vocabulary)[:3], rng.choice(TYPES)) for _ in range(count)
+    ]
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1_000_000)
+    parser.add_argument('--segments', type=int, default=4, help='accounts the items are split over')
+    parser.add_argument('--queries', type=int, default=2000, help='queries per scenario')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--checks', type=int, default=20, help='queries per scenario compared with a linear scan')
+    args = parser.parse_args()
+
+    rows_by_segment = synthetic_rows(args.items, args.segments)
+    started = time.perf_counter()
+    built = build_segments(rows_by_segment)
+    build_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    blobs = [segment.encode() for segment in built]
+    encode_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    segments = [Segment.decode(blob) for blob in blobs]
+    decode_seconds = time.perf_counter() - started
+
+    print(f'{args.items:,} items in {args.segments} segments')
+    print(f'build (split names, sort, postings): {build_seconds:.2f} s')
+    print(f'encode: {encode_seconds:.2f} s, stored size {sum(map(len, blobs)) / 2 ** 20:.1f} MiB')
+    print(f'decode (first query after a restart): {decode_seconds:.2f} s\n')
+
+    rng = random.Random(7)
+    print(f"{'scenario':<24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'checked':>8}")
+    for scenario, queries in _queries(rng, args.queries).items():
+        timings = []
+        for text, item_type in queries:
+            tokens = tokenize(text)
+            query_started = time.perf_counter()
+            search_segments(segments, tokens, item_type, limit=args.limit)
+            timings.append((time.perf_counter() - query_started) * 1000)
+        for text, item_type in queries[:args.checks]:
+            tokens = tokenize(text)
+            got = [item['id'] for item in search_segments(segments, tokens, item_type, limit=args.limit)]
+            if got != _scan(rows_by_segment, tokens, item_type, args.limit):
+                raise SystemExit(f'Result mismatch for {text!r} (type {item_type})')
+        timings.sort()
+        percentile = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+        print(f'{scenario:<24} {statistics.median(timings):>8.3f} {percentile(0.95):>8.3f} '
+              f'{percentile(0.99):>8.3f} {timings[-1]:>8.3f} {args.checks:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Cold start: time to import the app in a fresh interpreter.
+
+Compares the lazy provider registry (``import main``) against importing every
+integration module up front as main.py used to. Each run is a new process so
+nothing is cached in ``sys.modules``. Run from backend/:
+
+    python -m benchmarks.bench_startup [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import time
+started = time.perf_counter()
+{imports}
+print(time.perf_counter() - started)
+'''
+
+SCENARIOS = {
+    'lazy registry (import main)': 'import main',
+    'eager (main + all integrations)': 'import main, integrations.airtable, integrations.notion, integrations.hubspot',
+}
+
+
+def _run(imports: str) -> tuple[float, float]:
+    """(import seconds, whole-process seconds) for one fresh interpreter."""
+    env = dict(os.environ)
+    for provider in ('HUBSPOT', 'NOTION', 'AIRTABLE'):
+        env.setdefault(f'{provider}_CLIENT_ID', 'benchmark')
+        env.setdefault(f'{provider}_CLIENT_SECRET', 'benchmark')
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE.format(imports=imports)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    wall = time.perf_counter() - started
+    return float(output.strip().splitlines()[-1]), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'Median of {args.runs} fresh interpreters')
+    print(f"  {'scenario':<34} {'import ms':>10} {'process ms':>11}")
+    for label, imports in SCENARIOS.items():
+        runs = [_run(imports) for _ in range(args.runs)]
+        import_ms = statistics.median(run[0] for run in runs) * 1000
+        wall_ms = statistics.median(run[1] for run in runs) * 1000
+        print(f'  {label:<34} {import_ms:>10.1f} {wall_ms:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+Local stand-in for the HubSpot, Airtable and Notion APIs used by /load.
+
+One app serves all three (their paths do not overlap), with deterministic
+synthetic data, a configurable page-size cap, per-request latency and a
+fraction of requests answered with 429 + Retry-After. Every access token
+belongs to its own account, except that tokens starting with ``expired-`` are
+rejected by the token info endpoints. Point the backend at it with
+HUBSPOT_API_BASE_URL / AIRTABLE_API_BASE_URL / NOTION_API_BASE_URL.
+Run from backend/:
+
+    python -m benchmarks.mock_servers [--port 8900] [--items 1000] [--latency-ms 20] [--rate-429 0.02]
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+HUBSPOT_OBJECT_NAME_PROPERTY = {'contacts': 'firstname', 'companies': 'name', 'deals': 'dealname'}
+
+
+class MockSettings:
+    items = 1000              # HubSpot records per object type, Notion pages, Airtable bases
+    tables_per_base = 5
+    records_per_table = 200
+    fields_per_table = 10     # besides the primary "Name" field
+    blocks_per_page = 5       # Notion blocks per page; the first is a toggle with as many nested blocks
+    max_page_size = 100
+    latency_ms = 0.0
+    rate_429 = 0.0            # fraction of requests answered with 429
+    retry_after = 0.1         # seconds sent in Retry-After with a 429
+    seed = 0
+
+
+settings = MockSettings()
+MOCK_SETTINGS = (
+    'items', 'tables_per_base', 'records_per_table', 'fields_per_table', 'blocks_per_page',
+    'max_page_size', 'latency_ms', 'rate_429', 'retry_after', 'seed',
+)
+app = FastAPI()
+_random = random.Random(settings.seed)
+
+
+def _timestamp(i: int) -> str:
+    return f'2024-{1 + i % 12:02d}-{1 + i % 28:02d}T{i % 24:02d}:00:00.000Z'
+
+
+def _page_bounds(after, requested_size) -> tuple[int, int]:
+    start = int(after or 0)
+    size = min(int(requested_size or settings.max_page_size), settings.max_page_size)
+    return start, min(settings.items, start + size)
+
+
+async def _upstream_delay():
+    """Simulated latency, or a throttled response for a fraction of requests."""
+    if settings.latency_ms:
+        await asyncio.sleep(settings.latency_ms / 1000)
+    if settings.rate_429 and _random.random() < settings.rate_429:
+        return JSONResponse(
+            {'status': 'error', 'category': 'RATE_LIMITS', 'message': 'Rate limit exceeded (mock)'},
+            status_code=429,
+            headers={'Retry-After': str(settings.retry_after)},
+        )
+    return None
+
+
+def _account_number(access_token: str):
+    """A stable account id for a token, or None for a rejected one."""
+    if not access_token or access_token.startswith('expired-'):
+        return None
+    return zlib.crc32(access_token.encode('utf-8'))
+
+
+def _bearer_token(request: Request) -> str:
+    return request.headers.get('authorization', '').removeprefix('Bearer ')
+
+
+def _invalid_token() -> JSONResponse:
+    return JSONResponse({'status': 'error', 'message': 'Invalid access token (mock)'}, status_code=401)
+
+
+@app.get('/oauth/v1/access-tokens/{access_token}')
+async def hubspot_token_info(access_token: str):
+    hub_id = _account_number(access_token)
+    if hub_id is None:
+        return JSONResponse({'status': 'error', 'message': 'Token not found (mock)'}, status_code=404)
+    return {'token': access_token, 'hub_id': hub_id, 'scopes': ['crm.objects.contacts.read'], 'token_type': 'access'}
+
+
+@app.get('/v1/users/me')
+async def notion_bot_user(request: Request):
+    number = _account_number(_bearer_token(request))
+    if number is None:
+        return _invalid_token()
+    return {'object': 'user', 'id': f'bot-{number}', 'type': 'bot', 'bot': {'workspace_name': f'Workspace {number}'}}
+
+
+@app.get('/v0/meta/whoami')
+async def airtable_whoami(request: Request):
+    number = _account_number(_bearer_token(request))
+    if number is None:
+        return _invalid_token()
+    return {'id': f'usr{number}'}
+
+
+def _hubspot_record(object_type: str, i: int) -> dict:
+    return {
+        'id': str(i),
+        'properties': {
+            HUBSPOT_OBJECT_NAME_PROPERTY[object_type]: f'{object_type} {i}',
+            'email': f'user{i}@example.com',
+            'createdate': _timestamp(i),
+            'lastmodifieddate': _timestamp(i + 1),
+            'hs_lastmodifieddate': _timestamp(i + 1),
+        },
+        'createdAt': _timestamp(i),
+        'updatedAt': _timestamp(i + 1),
+        'archived': False,
+    }
+
+
+def _hubspot_page(object_type: str, after, limit) -> dict:
+    start, end = _page_bounds(after, limit)
+    body = {'results': [_hubspot_record(object_type, i) for i in range(start, end)]}
+    if end < settings.items:
+        body['paging'] = {'next': {'after': str(end)}}
+    return body
+
+
+@app.get('/crm/v3/objects/{object_type}')
+async def hubspot_list(object_type: str, request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    return _hubspot_page(object_type, request.query_params.get('after'), request.query_params.get('limit'))
+
+
+@app.post('/crm/v3/objects/{object_type}/search')
+async def hubspot_search(object_type: str, request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    body = await request.json()
+    page = _hubspot_page(object_type, body.get('after'), body.get('limit'))
+    page['total'] = settings.items
+    return page
+
+
+@app.post('/crm/v4/associations/{object_type}/companies/batch/read')
+async def hubspot_company_associations(object_type: str, request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    body = await request.json()
+    # Record i belongs to company i // 3; every tenth record has no company
+    results = [
+        {'from': {'id': record['id']}, 'to': [{
+            'toObjectId': int(record['id']) // 3,
+            'associationTypes': [{'category': 'HUBSPOT_DEFINED', 'typeId': 1 if object_type == 'contacts' else 5, 'label': 'Primary'}],
+        }]}
+        for record in body.get('inputs', []) if int(record['id']) % 10
+    ]
+    return {'status': 'COMPLETE', 'results': results}
+
+
+@app.get('/v0/meta/bases')
+async def airtable_bases(request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    start, end = _page_bounds(request.query_params.get('offset'), None)
+    body = {'bases': [{'id': f'app{i:014d}', 'name': f'Base {i}', 'permissionLevel': 'create'} for i in range(start, end)]}
+    if end < settings.items:
+        body['offset'] = str(end)
+    return body
+
+
+@app.get('/v0/meta/bases/{base_id}/tables')
+async def airtable_tables(base_id: str):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    return {'tables': [
+        {'id': f'tbl{base_id[3:]}{t}', 'name': f'Table {t}', 'primaryFieldId': 'fld0', 'fields': _airtable_fields()}
+        for t in range(settings.tables_per_base)
+    ]}
+
+
+def _airtable_fields() -> list[dict]:
+    return [{'id': 'fld0', 'name': 'Name', 'type': 'singleLineText'}] + [
+        {'id': f'fld{f}', 'name': f'Notes {f}', 'type': 'multilineText'} for f in range(1, settings.fields_per_table + 1)
+    ]
+
+
+@app.get('/v0/{base_id}/{table_id}')
+async def airtable_records(base_id: str, table_id: str, request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    query = request.query_params
+    start = int(query.get('offset') or 0)
+    end = min(settings.records_per_table, start + min(int(query.get('pageSize') or 100), 100))
+    by_id = query.get('returnFieldsByFieldId') == 'true'
+    requested = set(query.getlist('fields[]'))
+    fields = [field for field in _airtable_fields() if not requested or {field['id'], field['name']} & requested]
+    records = [{
+        'id': f'rec{table_id[3:]}{i:06d}',
+        'createdTime': _timestamp(i),
+        'fields': {
+            field['id'] if by_id else field['name']:
+                f'{table_id} record {i}' if field['id'] == 'fld0' else f'Note {i} for {field["name"]}: ' + 'lorem ipsum ' * 8
+            for field in fields
+        },
+    } for i in range(start, end)]
+    body = {'records': records}
+    if end < settings.records_per_table:
+        body['offset'] = str(end)
+    return body
+
+
+def _notion_page(i: int) -> dict:
+    # Every fourth page is nested under an earlier one, as in a real workspace
+    parent = {'type': 'page_id', 'page_id': f'page-{i - 1}'} if i % 4 else {'type': 'workspace', 'workspace': True}
+    title = f'Page {i}'
+    return {
+        'object': 'page',
+        'id': f'page-{i}',
+        'created_time': _timestamp(i),
+        'last_edited_time': _timestamp(i + 1),
+        'parent': parent,
+        'archived': False,
+        'properties': {
+            'title': {
+                'id': 'title',
+                'type': 'title',
+                'title': [{
+                    'type': 'text',
+                    'text': {'content': title, 'link': None},
+                    'annotations': {'bold': False, 'italic': False, 'color': 'default'},
+                    'plain_text': title,
+                    'href': None,
+                }],
+            },
+        },
+        'url': f'https://www.notion.so/page-{i}',
+    }
+
+
+@app.post('/v1/search')
+async def notion_search(request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    body = await request.json()
+    start, end = _page_bounds(body.get('start_cursor'), body.get('page_size'))
+    has_more = end < settings.items
+    return {
+        'object': 'list',
+        'results': [_notion_page(i) for i in range(start, end)],
+        'has_more': has_more,
+        'next_cursor': str(end) if has_more else None,
+    }
+
+
+def _notion_block(block_id: str, block_type: str, i: int, has_children: bool = False, title: str = None) -> dict:
+    content = {'title': title} if title is not None else {'rich_text': [{
+        'type': 'text', 'text': {'content': f'{block_type} {block_id}', 'link': None}, 'plain_text': f'{block_type} {block_id}',
+    }]}
+    return {
+        'object': 'block',
+        'id': block_id,
+        'created_time': _timestamp(i),
+        'last_edited_time': _timestamp(i + 1),
+        'has_children': has_children,
+        'type': block_type,
+        block_type: content,
+    }
+
+
+def _notion_children(block_id: str) -> list[dict]:
+    if block_id.startswith('page-'):
+        i = int(block_id[5:])
+        children = [
+            _notion_block(f'blk-{i}-{n}', 'toggle' if n == 0 else 'paragraph', i, has_children=n == 0)
+            for n in range(settings.blocks_per_page)
+        ]
+        if (i + 1) % 4 and i + 1 < settings.items:
+            # Page i + 1 is nested under this one (see _notion_page)
+            children.append(_notion_block(f'page-{i + 1}', 'child_page', i + 1, has_children=True, title=f'Page {i + 1}'))
+        return children
+    if block_id.startswith('blk-') and block_id.count('-') == 2:
+        i = int(block_id.split('-')[1])
+        return [_notion_block(f'{block_id}-{n}', 'paragraph', i) for n in range(settings.blocks_per_page)]
+    return []
+
+
+@app.get('/v1/blocks/{block_id}/children')
+async def notion_block_children(block_id: str, request: Request):
+    throttled = await _upstream_delay()
+    if throttled:
+        return throttled
+    children = _notion_children(block_id)
+    start = int(request.query_params.get('start_cursor') or 0)
+    end = min(len(children), start + min(int(request.query_params.get('page_size') or 100), settings.max_page_size))
+    has_more = end < len(children)
+    return {
+        'object': 'list',
+        'results': children[start:end],
+        'has_more': has_more,
+        'next_cursor': str(end) if has_more else None,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--items', type=int, default=settings.items,
+                        help='HubSpot records per object type, Notion pages and Airtable bases')
+    parser.add_argument('--tables-per-base', type=int, default=settings.tables_per_base)
+    parser.add_argument('--records-per-table', type=int, default=settings.records_per_table)
+    parser.add_argument('--fields-per-table', type=int, default=settings.fields_per_table)
+    parser.add_argument('--blocks-per-page', type=int, default=settings.blocks_per_page)
+    parser.add_argument('--max-page-size', type=int, default=settings.max_page_size)
+    parser.add_argument('--latency-ms', type=float, default=settings.latency_ms, help='added to every upstream request')
+    parser.add_argument('--rate-429', type=float, default=settings.rate_429, help='fraction of requests throttled')
+    parser.add_argument('--retry-after', type=float, default=settings.retry_after)
+    parser.add_argument('--seed', type=int, default=settings.seed)
+
+
+def configure(args: argparse.Namespace):
+    global _random
+    for name in MOCK_SETTINGS:
+        setattr(settings, name, getattr(args, name))
+    _random = random.Random(settings.seed)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
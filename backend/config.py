@@ -13,22 +13,106 @@ class Config:
     # HubSpot Configuration
     HUBSPOT_CLIENT_ID = os.getenv('HUBSPOT_CLIENT_ID')
     HUBSPOT_CLIENT_SECRET = os.getenv('HUBSPOT_CLIENT_SECRET')
+    HUBSPOT_PAGE_SIZE = int(os.getenv('HUBSPOT_PAGE_SIZE', 100))
+    HUBSPOT_FETCH_CONCURRENCY = int(os.getenv('HUBSPOT_FETCH_CONCURRENCY', 3))
+    HUBSPOT_SYNC_STATE_TTL = int(os.getenv('HUBSPOT_SYNC_STATE_TTL', 30 * 24 * 3600))
+    HUBSPOT_ASSOCIATION_BATCH_SIZE = int(os.getenv('HUBSPOT_ASSOCIATION_BATCH_SIZE', 1000))
     
     # Notion Configuration (optional)
     NOTION_CLIENT_ID = os.getenv('NOTION_CLIENT_ID')
     NOTION_CLIENT_SECRET = os.getenv('NOTION_CLIENT_SECRET')
+    NOTION_PAGE_SIZE = int(os.getenv('NOTION_PAGE_SIZE', 100))
+    NOTION_SYNC_STATE_TTL = int(os.getenv('NOTION_SYNC_STATE_TTL', 30 * 24 * 3600))
+    NOTION_BLOCK_MAX_DEPTH = int(os.getenv('NOTION_BLOCK_MAX_DEPTH', 5))
+    NOTION_BLOCK_CONCURRENCY = int(os.getenv('NOTION_BLOCK_CONCURRENCY', 3))
+    NOTION_BLOCK_MAX_CALLS = int(os.getenv('NOTION_BLOCK_MAX_CALLS', 500))
+    NOTION_BLOCK_TIME_BUDGET = float(os.getenv('NOTION_BLOCK_TIME_BUDGET', 60))
     
     # Airtable Configuration (optional)
     AIRTABLE_CLIENT_ID = os.getenv('AIRTABLE_CLIENT_ID')
     AIRTABLE_CLIENT_SECRET = os.getenv('AIRTABLE_CLIENT_SECRET')
+    AIRTABLE_REQUESTS_PER_SECOND = int(os.getenv('AIRTABLE_REQUESTS_PER_SECOND', 5))
+    AIRTABLE_FETCH_CONCURRENCY = int(os.getenv('AIRTABLE_FETCH_CONCURRENCY', 10))
+    AIRTABLE_RECORD_PAGE_SIZE = int(os.getenv('AIRTABLE_RECORD_PAGE_SIZE', 100))
+    AIRTABLE_RECORD_FETCH_CONCURRENCY = int(os.getenv('AIRTABLE_RECORD_FETCH_CONCURRENCY', 10))
+    
+    # Upstream API base URLs (override to point the integrations at local stand-ins, e.g. for benchmarks)
+    HUBSPOT_API_BASE_URL = os.getenv('HUBSPOT_API_BASE_URL', 'https://api.hubapi.com').rstrip('/')
+    AIRTABLE_API_BASE_URL = os.getenv('AIRTABLE_API_BASE_URL', 'https://api.airtable.com').rstrip('/')
+    NOTION_API_BASE_URL = os.getenv('NOTION_API_BASE_URL', 'https://api.notion.com').rstrip('/')
     
     # Redis Configuration
     REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     REDIS_DB = int(os.getenv('REDIS_DB', 0))
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+    REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+
+    # Pages requested ahead of the one being converted to items (0 = fetch on demand)
+    PAGINATION_PREFETCH = int(os.getenv('PAGINATION_PREFETCH', 1))
+
+    # Outbound HTTP client (shared connection pool for all integrations)
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30))
+    HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+    HTTP_HTTP2 = os.getenv('HTTP_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+    # Upstream rate limits (requests per second / burst size), shared across workers via Redis
+    HUBSPOT_RATE_LIMIT = float(os.getenv('HUBSPOT_RATE_LIMIT', 10))
+    HUBSPOT_RATE_BURST = float(os.getenv('HUBSPOT_RATE_BURST', 100))
+    HUBSPOT_SEARCH_RATE_LIMIT = float(os.getenv('HUBSPOT_SEARCH_RATE_LIMIT', 4))
+    AIRTABLE_TOKEN_RATE_LIMIT = float(os.getenv('AIRTABLE_TOKEN_RATE_LIMIT', 50))
+    NOTION_RATE_LIMIT = float(os.getenv('NOTION_RATE_LIMIT', 3))
+    NOTION_RATE_BURST = float(os.getenv('NOTION_RATE_BURST', 5))
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', 5))
+    RATE_LIMIT_BASE_BACKOFF = float(os.getenv('RATE_LIMIT_BASE_BACKOFF', 1))
+    RATE_LIMIT_MAX_BACKOFF = float(os.getenv('RATE_LIMIT_MAX_BACKOFF', 30))
+    
+    # OAuth token manager
+    TOKEN_STORE_TTL = int(os.getenv('TOKEN_STORE_TTL', 30 * 24 * 3600))
+    TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+    TOKEN_REFRESH_LOCK_TTL = int(os.getenv('TOKEN_REFRESH_LOCK_TTL', 30))
+    ACCOUNT_VERIFICATION_TTL = int(os.getenv('ACCOUNT_VERIFICATION_TTL', 300))
+    
+    # /load snapshot cache
+    ITEM_CACHE_TTL = int(os.getenv('ITEM_CACHE_TTL', 3600))
+    ITEM_CACHE_FRESH_SECONDS = int(os.getenv('ITEM_CACHE_FRESH_SECONDS', 60))
+    ITEM_CACHE_REFRESH_LOCK_TTL = int(os.getenv('ITEM_CACHE_REFRESH_LOCK_TTL', 300))
+    ITEM_INDEX_MAX_SNAPSHOTS = int(os.getenv('ITEM_INDEX_MAX_SNAPSHOTS', 16))
+    
+    # Cross-integration name search (/search)
+    SEARCH_INDEX_TTL = int(os.getenv('SEARCH_INDEX_TTL', 30 * 24 * 3600))
+    SEARCH_INDEX_MAX_ACCOUNTS = int(os.getenv('SEARCH_INDEX_MAX_ACCOUNTS', 100))
+    
+    # Background sync jobs (concurrent jobs per provider, per uvicorn worker)
+    HUBSPOT_SYNC_JOB_WORKERS = int(os.getenv('HUBSPOT_SYNC_JOB_WORKERS', 2))
+    AIRTABLE_SYNC_JOB_WORKERS = int(os.getenv('AIRTABLE_SYNC_JOB_WORKERS', 2))
+    NOTION_SYNC_JOB_WORKERS = int(os.getenv('NOTION_SYNC_JOB_WORKERS', 2))
+    SYNC_JOB_BATCH_SIZE = int(os.getenv('SYNC_JOB_BATCH_SIZE', 500))
+    SYNC_JOB_TTL = int(os.getenv('SYNC_JOB_TTL', 24 * 3600))
+    SYNC_JOB_LEASE = int(os.getenv('SYNC_JOB_LEASE', 60))
+    
+    # Batch /load across accounts (per worker, shared by concurrent batch requests)
+    BATCH_LOAD_CONCURRENCY = int(os.getenv('BATCH_LOAD_CONCURRENCY', 20))
+    HUBSPOT_BATCH_LOAD_CONCURRENCY = int(os.getenv('HUBSPOT_BATCH_LOAD_CONCURRENCY', 8))
+    AIRTABLE_BATCH_LOAD_CONCURRENCY = int(os.getenv('AIRTABLE_BATCH_LOAD_CONCURRENCY', 8))
+    NOTION_BATCH_LOAD_CONCURRENCY = int(os.getenv('NOTION_BATCH_LOAD_CONCURRENCY', 8))
+    BATCH_LOAD_MAX_ACCOUNTS = int(os.getenv('BATCH_LOAD_MAX_ACCOUNTS', 1000))
+    
+    # Diagnostics: ?profile=true on /load requires the X-Admin-Token header to match ADMIN_TOKEN
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
     
     # Application Configuration
     ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
+    # Comma-separated provider names (e.g. "hubspot,notion"); unset enables every provider with credentials
+    ENABLED_PROVIDERS = (
+        {name.strip().lower() for name in os.getenv('ENABLED_PROVIDERS').split(',') if name.strip()}
+        if os.getenv('ENABLED_PROVIDERS') else None
+    )
     
     @classmethod
     def validate_hubspot_credentials(cls):
@@ -0,0 +1,66 @@
+"""
+Shared async HTTP client used by every integration.
+
+A single pooled ``httpx.AsyncClient`` is created when the app starts and closed
+when it shuts down (see the lifespan hook in ``main.py``). Integrations call
+``get_http_client()`` instead of opening their own client per request.
+"""
+import httpx
+from fastapi import HTTPException
+from config import config
+
+_http_client = None
+
+
+class UpstreamError(HTTPException):
+    """An upstream API request failed: answered with 401 if the provider rejected the token, otherwise 502."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(status_code=401 if status_code == 401 else 502, detail=message)
+        self.upstream_status = status_code
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client():
+    """Build a pooled AsyncClient from the application settings."""
+    http2 = config.HTTP_HTTP2 and _http2_available()
+    if config.HTTP_HTTP2 and not http2:
+        print("⚠️  HTTP_HTTP2 is enabled but the 'h2' package is not installed; falling back to HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+    )
+
+
+async def init_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = create_http_client()
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_http_client():
+    """Return the app-wide client, creating it lazily outside the lifespan (scripts, tests)."""
+    global _http_client
+    if _http_client is None:
+        _http_client = create_http_client()
+    return _http_client
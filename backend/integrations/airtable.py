@@ -5,16 +5,26 @@ import json
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
-import httpx
 import asyncio
 import base64
 import hashlib
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
 
-import requests
-from integrations.integration_item import IntegrationItem
+from integrations.integration_item import IntegrationItem, serialize_many
 from config import config
+from http_client import UpstreamError, get_http_client
+from token_manager import TokenRefreshError, authorized_request, register_token_refresher, store_tokens
+from accounts import AccountVerificationError, register_account_verifier, verified_account
+from tracing import span
+from paginator import paginate
 
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
+from redis_client import (
+    add_key_value_redis,
+    add_key_values_redis,
+    consume_value_redis,
+    consume_oauth_state_redis,
+)
 
 # Use environment variables if available
 CLIENT_ID = config.AIRTABLE_CLIENT_ID 
@@ -39,10 +49,10 @@ async def authorize_airtable(user_id, org_id):
     code_challenge = base64.urlsafe_b64encode(m.digest()).decode('utf-8').replace('=', '')
 
     auth_url = f'{authorization_url}&state={encoded_state}&code_challenge={code_challenge}&code_challenge_method=S256&scope={scope}'
-    await asyncio.gather(
-        add_key_value_redis(f'airtable_state:{org_id}:{user_id}', json.dumps(state_data), expire=600),
-        add_key_value_redis(f'airtable_verifier:{org_id}:{user_id}', code_verifier, expire=600),
-    )
+    await add_key_values_redis({
+        f'airtable_state:{org_id}:{user_id}': json.dumps(state_data),
+        f'airtable_verifier:{org_id}:{user_id}': code_verifier,
+    }, expire=600)
 
     return auth_url
 
@@ -57,35 +67,36 @@ async def oauth2callback_airtable(request: Request):
     user_id = state_data.get('user_id')
     org_id = state_data.get('org_id')
 
-    saved_state, code_verifier = await asyncio.gather(
-        get_value_redis(f'airtable_state:{org_id}:{user_id}'),
-        get_value_redis(f'airtable_verifier:{org_id}:{user_id}'),
+    consumed = await consume_oauth_state_redis(
+        f'airtable_state:{org_id}:{user_id}', original_state, f'airtable_verifier:{org_id}:{user_id}',
     )
-
-    if not saved_state or original_state != json.loads(saved_state).get('state'):
+    if consumed is None:
         raise HTTPException(status_code=400, detail='State does not match.')
+    code_verifier, = consumed
+    if code_verifier is None:
+        raise HTTPException(status_code=400, detail='Missing code verifier.')
 
-    async with httpx.AsyncClient() as client:
-        response, _, _ = await asyncio.gather(
-            client.post(
-                'https://airtable.com/oauth2/v1/token',
-                data={
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': REDIRECT_URI,
-                    'client_id': CLIENT_ID,
-                    'code_verifier': code_verifier.decode('utf-8'),
-                },
-                headers={
-                    'Authorization': f'Basic {encoded_client_id_secret}',
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                }
-            ),
-            delete_key_redis(f'airtable_state:{org_id}:{user_id}'),
-            delete_key_redis(f'airtable_verifier:{org_id}:{user_id}'),
-        )
+    response = await get_http_client().post(
+        'https://airtable.com/oauth2/v1/token',
+        data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': REDIRECT_URI,
+            'client_id': CLIENT_ID,
+            'code_verifier': code_verifier.decode('utf-8'),
+        },
+        headers={
+            'Authorization': f'Basic {encoded_client_id_secret}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+    )
 
-    await add_key_value_redis(f'airtable_credentials:{org_id}:{user_id}', json.dumps(response.json()), expire=600)
+    credentials = json.dumps(response.json())
+    account = await verified_account('airtable', credentials)
+    await asyncio.gather(
+        add_key_value_redis(f'airtable_credentials:{org_id}:{user_id}', credentials, expire=600),
+        store_tokens('airtable', account, response.json()),
+    )
     
     close_window_script = """
     <html>
@@ -97,18 +108,51 @@ async def oauth2callback_airtable(request: Request):
     return HTMLResponse(content=close_window_script)
 
 async def get_airtable_credentials(user_id, org_id):
-    credentials = await get_value_redis(f'airtable_credentials:{org_id}:{user_id}')
+    credentials = await consume_value_redis(f'airtable_credentials:{org_id}:{user_id}')
     if not credentials:
         raise HTTPException(status_code=400, detail='No credentials found.')
     credentials = json.loads(credentials)
-    await delete_key_redis(f'airtable_credentials:{org_id}:{user_id}')
 
     return credentials
 
+async def refresh_airtable_token(refresh_token: str) -> dict:
+    """Exchanges a refresh token for a new Airtable token response"""
+    response = await get_http_client().post(
+        'https://airtable.com/oauth2/v1/token',
+        data={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': CLIENT_ID,
+        },
+        headers={
+            'Authorization': f'Basic {encoded_client_id_secret}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+    )
+    if response.status_code != 200:
+        raise TokenRefreshError(f'{response.status_code} - {response.text}')
+    return response.json()
+
+register_token_refresher('airtable', refresh_airtable_token)
+
+async def verify_airtable_account(access_token: str):
+    """The Airtable user id an access token belongs to; None if it is not valid"""
+    response = await get_http_client().get(
+        f'{config.AIRTABLE_API_BASE_URL}/v0/meta/whoami',
+        headers={'Authorization': f'Bearer {access_token}'},
+    )
+    if response.status_code == 401:
+        return None
+    if response.status_code != 200:
+        raise AccountVerificationError(f'Airtable whoami failed: {response.status_code} - {response.text}')
+    return f"user_id-{response.json()['id']}"
+
+register_account_verifier('airtable', verify_airtable_account)
+
 def create_integration_item_metadata_object(
-    response_json: str, item_type: str, parent_id=None, parent_name=None
+    response_json: str, item_type: str, parent_id=None, parent_name=None, parent_type='Base'
 ) -> IntegrationItem:
-    parent_id = None if parent_id is None else parent_id + '_Base'
+    parent_id = None if parent_id is None else parent_id + '_' + parent_type
     integration_item_metadata = IntegrationItem(
         id=response_json.get('id', None) + '_' + item_type,
         name=response_json.get('name', None),
@@ -120,53 +164,196 @@ def create_integration_item_metadata_object(
     return integration_item_metadata
 
 
-def fetch_items(
-    access_token: str, url: str, aggregated_response: list, offset=None
-) -> dict:
-    """Fetching the list of bases"""
-    params = {'offset': offset} if offset is not None else {}
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(url, headers=headers, params=params)
+def _cell_text(value) -> Optional[str]:
+    """Display text of a record's name cell (text, number, select list, collaborator, ...)"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return value.get('name') or value.get('email') or value.get('filename')
+    if isinstance(value, list):
+        return ', '.join(filter(None, (_cell_text(element) for element in value))) or None
+    return str(value)
 
-    if response.status_code == 200:
-        results = response.json().get('bases', {})
-        offset = response.json().get('offset', None)
 
-        for item in results:
-            aggregated_response.append(item)
+def create_record_item(record: dict, table: dict, name_field_id: str) -> IntegrationItem:
+    return IntegrationItem(
+        id=record['id'] + '_Record',
+        name=_cell_text(record.get('fields', {}).get(name_field_id)) or record['id'],
+        type='Record',
+        creation_time=record.get('createdTime'),
+        parent_id=table['id'] + '_Table',
+        parent_path_or_name=table.get('name'),
+    )
 
-        if offset is not None:
-            fetch_items(access_token, url, aggregated_response, offset)
-        else:
-            return
 
+def _record_projection(table: dict, fields: Optional[list[str]]) -> list[str]:
+    """Field ids to request for ``table``; the first one names the records.
 
-async def get_items_airtable(credentials) -> list[IntegrationItem]:
-    credentials = json.loads(credentials)
-    url = 'https://api.airtable.com/v0/meta/bases'
-    list_of_integration_item_metadata = []
-    list_of_responses = []
-
-    fetch_items(credentials.get('access_token'), url, list_of_responses)
-    for response in list_of_responses:
-        list_of_integration_item_metadata.append(
-            create_integration_item_metadata_object(response, 'Base')
+    ``fields`` may mix field names and ids. Fields a table does not have are
+    skipped (one projection is shared by every table), and the table's primary
+    field is used when none of them match.
+    """
+    field_ids = {field['name']: field['id'] for field in table.get('fields', [])}
+    known = set(field_ids.values())
+    projection = []
+    for field in fields or ():
+        field_id = field if field in known else field_ids.get(field)
+        if field_id is not None and field_id not in projection:
+            projection.append(field_id)
+    return projection or [table['primaryFieldId']]
+
+
+_DONE = object()
+
+
+class AirtableFetchError(UpstreamError):
+    """A bases, tables or records request returned a non-200 response."""
+
+
+def fetch_base_pages(credentials: dict, url: str, account: str) -> AsyncIterator[list]:
+    """Pages of bases, following the offset cursor (the next page is prefetched)"""
+    async def fetch_page(offset):
+        params = {'offset': offset} if offset is not None else {}
+        response = await authorized_request(
+            'airtable', account, credentials, [('airtable', account)], 'GET', url, params=params,
         )
-        tables_response = requests.get(
-            f'https://api.airtable.com/v0/meta/bases/{response.get("id")}/tables',
-            headers={'Authorization': f'Bearer {credentials.get("access_token")}'},
+        if response.status_code != 200:
+            raise AirtableFetchError(f'Failed to fetch Airtable bases: {response.status_code} - {response.text}', response.status_code)
+
+        with span('decode'):
+            return response.json()
+
+    return paginate(fetch_page, 'offset', items_key='bases')
+
+
+def fetch_record_pages(
+    credentials: dict, base_id: str, table_id: str, account: str, projection: list[str], page_size: int
+) -> AsyncIterator[list]:
+    """Pages of a table's records with only the ``projection`` fields, keyed by field id"""
+    url = f'{config.AIRTABLE_API_BASE_URL}/v0/{base_id}/{table_id}'
+    params = [('pageSize', page_size), ('returnFieldsByFieldId', 'true')]
+    params.extend(('fields[]', field_id) for field_id in projection)
+
+    async def fetch_page(offset):
+        response = await authorized_request(
+            'airtable',
+            account,
+            credentials,
+            [('airtable', account), ('airtable_base', f'{account}:{base_id}')],
+            'GET',
+            url,
+            endpoint='/v0/{baseId}/{tableId}',
+            params=params if offset is None else params + [('offset', offset)],
+        )
+        if response.status_code != 200:
+            raise AirtableFetchError(f'Failed to fetch records of {base_id}/{table_id}: {response.status_code} - {response.text}', response.status_code)
+
+        with span('decode'):
+            return response.json()
+
+    return paginate(fetch_page, 'offset', items_key='records')
+
+
+async def fetch_tables(credentials: dict, base: dict, account: str, semaphore: asyncio.Semaphore) -> list[dict]:
+    """Fetches the table schemas of a single base"""
+    base_id = base.get('id')
+    async with semaphore:
+        response = await authorized_request(
+            'airtable',
+            account,
+            credentials,
+            [('airtable', account), ('airtable_base', f'{account}:{base_id}')],
+            'GET',
+            f'{config.AIRTABLE_API_BASE_URL}/v0/meta/bases/{base_id}/tables',
+            endpoint='/v0/meta/bases/{baseId}/tables',
+        )
+    if response.status_code != 200:
+        raise AirtableFetchError(
+            f'Failed to fetch tables for base {base_id}: {response.status_code} - {response.text}', response.status_code,
         )
-        if tables_response.status_code == 200:
-            tables_response = tables_response.json()
-            for table in tables_response['tables']:
-                list_of_integration_item_metadata.append(
-                    create_integration_item_metadata_object(
-                        table,
-                        'Table',
-                        response.get('id', None),
-                        response.get('name', None),
-                    )
-                )
-
-    print(f'list_of_integration_item_metadata: {list_of_integration_item_metadata}')
-    return list_of_integration_item_metadata
+
+    with span('decode'):
+        return response.json().get('tables', [])
+
+
+async def iter_items_airtable(credentials, records=False, fields=None, page_size=None) -> AsyncIterator[IntegrationItem]:
+    """Yields Base items page by page and each base's Table items as its schema request completes.
+
+    With ``records`` every table's records follow as Record items parented to
+    their table. Up to AIRTABLE_RECORD_FETCH_CONCURRENCY tables are paged at a
+    time (within the per-base rate limit), each requesting ``page_size``
+    records with only the ``fields`` projection (default: the primary field),
+    whose first field names the records. A failed upstream request raises
+    AirtableFetchError.
+    """
+    account = await verified_account('airtable', credentials)
+    credentials = json.loads(credentials)
+    url = f'{config.AIRTABLE_API_BASE_URL}/v0/meta/bases'
+    page_size = page_size or config.AIRTABLE_RECORD_PAGE_SIZE
+
+    schema_slots = asyncio.Semaphore(config.AIRTABLE_FETCH_CONCURRENCY)
+    record_slots = asyncio.Semaphore(config.AIRTABLE_RECORD_FETCH_CONCURRENCY)
+    # Pages of items from all tasks; bounded so slow clients apply back-pressure upstream
+    pages = asyncio.Queue(maxsize=2 * config.AIRTABLE_RECORD_FETCH_CONCURRENCY + 2)
+
+    async def load_records(base: dict, table: dict):
+        projection = _record_projection(table, fields)
+        async with record_slots:
+            async with aclosing(fetch_record_pages(
+                credentials, base['id'], table['id'], account, projection, page_size,
+            )) as record_pages:
+                async for results in record_pages:
+                    with span('transform'):
+                        items = [create_record_item(record, table, projection[0]) for record in results]
+                    await pages.put(items)
+
+    async def load_base(base: dict):
+        tables = await fetch_tables(credentials, base, account, schema_slots)
+        with span('transform'):
+            items = [
+                create_integration_item_metadata_object(table, 'Table', base.get('id', None), base.get('name', None))
+                for table in tables
+            ]
+        await pages.put(items)
+        if records:
+            await asyncio.gather(*(load_records(base, table) for table in tables))
+
+    async def load_all():
+        tasks = []
+        try:
+            async for bases in fetch_base_pages(credentials, url, account):
+                with span('transform'):
+                    items = [create_integration_item_metadata_object(base, 'Base') for base in bases]
+                await pages.put(items)
+                # Table schemas are fetched while later pages of bases are still arriving
+                tasks.extend(asyncio.create_task(load_base(base)) for base in bases)
+            await asyncio.gather(*tasks)
+            await pages.put(_DONE)
+        except Exception as e:
+            await pages.put(e)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    loader = asyncio.create_task(load_all())
+    try:
+        while True:
+            page = await pages.get()
+            if page is _DONE:
+                return
+            if isinstance(page, Exception):
+                raise page
+            for item in page:
+                yield item
+    finally:
+        loader.cancel()
+        await asyncio.gather(loader, return_exceptions=True)
+
+
+async def get_items_airtable(credentials, records=False, fields=None, page_size=None) -> list[dict]:
+    list_of_integration_item_metadata = [
+        item async for item in iter_items_airtable(credentials, records=records, fields=fields, page_size=page_size)
+    ]
+
+    print(f'Airtable integration items (count): {len(list_of_integration_item_metadata)}')
+    return serialize_many(list_of_integration_item_metadata)
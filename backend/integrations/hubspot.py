@@ -4,24 +4,59 @@ import json
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
-import httpx
 import asyncio
 import base64
-import requests
-from integrations.integration_item import IntegrationItem
+from datetime import datetime
+from contextlib import aclosing
+from typing import AsyncIterator
+from integrations.integration_item import IntegrationItem, serialize_many
 from config import config
+from http_client import UpstreamError, get_http_client
+from token_manager import TokenRefreshError, authorized_request, register_token_refresher, store_tokens
+from accounts import AccountVerificationError, register_account_verifier, verified_account
+from tracing import span
+from paginator import paginate
+from streaming import merge_async_iterators
 from urllib.parse import urlencode
 
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
+from redis_client import (
+    add_key_value_redis,
+    consume_value_redis,
+    consume_oauth_state_redis,
+    get_hash_redis,
+    get_hash_field_redis,
+    set_hash_fields_redis,
+    replace_hash_redis,
+)
 
-# Validate and get HubSpot credentials from environment variables
-config.validate_hubspot_credentials()
+# Checked by the provider registry before the HubSpot routes are registered
 CLIENT_ID = config.HUBSPOT_CLIENT_ID
 CLIENT_SECRET = config.HUBSPOT_CLIENT_SECRET
 
 REDIRECT_URI = 'http://localhost:8000/integrations/hubspot/oauth2callback'
 SCOPES = 'crm.objects.contacts.read crm.objects.companies.read crm.objects.deals.read'
 
+CRM_OBJECTS_URL = f'{config.HUBSPOT_API_BASE_URL}/crm/v3/objects'
+CRM_ASSOCIATIONS_URL = f'{config.HUBSPOT_API_BASE_URL}/crm/v4/associations'
+# (object type, item type, last-modified property used by the search API)
+HUBSPOT_OBJECTS = [
+    ('contacts', 'contact', 'lastmodifieddate'),
+    ('companies', 'company', 'hs_lastmodifieddate'),
+    ('deals', 'deal', 'hs_lastmodifieddate'),
+]
+ITEM_PROPERTIES = ['firstname', 'lastname', 'email', 'name', 'dealname', 'createdate', 'lastmodifieddate']
+HUBSPOT_SEARCH_PAGE_SIZE = 200
+# The CRM search API refuses to page past this many results for one query
+HUBSPOT_SEARCH_RESULT_WINDOW = 10000
+SYNC_CURSOR_FIELD = '_cursor'
+# Object types whose records are parented to a company in hierarchy mode, with the
+# HUBSPOT_DEFINED association type id of their primary company
+COMPANY_CHILD_ASSOCIATION_TYPES = {'contacts': 1, 'deals': 5}
+
+
+class HubSpotFetchError(UpstreamError):
+    """A CRM list, search or association request returned a non-200 response."""
+
 async def authorize_hubspot(user_id, org_id):
     state_data = {
         'state': secrets.token_urlsafe(32),
@@ -61,28 +96,23 @@ async def oauth2callback_hubspot(request: Request):
     user_id = state_data.get('user_id')
     org_id = state_data.get('org_id')
     
-    saved_state = await get_value_redis(f'hubspot_state:{org_id}:{user_id}')
-    
-    if not saved_state or original_state != json.loads(saved_state).get('state'):
+    if await consume_oauth_state_redis(f'hubspot_state:{org_id}:{user_id}', original_state) is None:
         raise HTTPException(status_code=400, detail='State does not match.')
     
-    async with httpx.AsyncClient() as client:
-        response, _ = await asyncio.gather(
-            client.post(
-                'https://api.hubapi.com/oauth/v1/token',
-                data={
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': REDIRECT_URI,
-                    'client_id': CLIENT_ID,
-                    'client_secret': CLIENT_SECRET,
-                },
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                }
-            ),
-            delete_key_redis(f'hubspot_state:{org_id}:{user_id}'),
-        )
+    client = get_http_client()
+    response = await client.post(
+        f'{config.HUBSPOT_API_BASE_URL}/oauth/v1/token',
+        data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': REDIRECT_URI,
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+        },
+        headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+    )
     
     if response.status_code != 200:
         raise HTTPException(status_code=400, detail='Failed to exchange code for token.')
@@ -105,10 +135,9 @@ async def oauth2callback_hubspot(request: Request):
     # Optional: call HubSpot access token info endpoint to enrich with hub_id and scopes
     try:
         if tokens.get('access_token'):
-            async with httpx.AsyncClient() as client_info:
-                info_resp = await client_info.get(
-                    f"https://api.hubapi.com/oauth/v1/access-tokens/{tokens['access_token']}"
-                )
+            info_resp = await client.get(
+                f"{config.HUBSPOT_API_BASE_URL}/oauth/v1/access-tokens/{tokens['access_token']}"
+            )
             if info_resp.status_code == 200:
                 info = info_resp.json()
                 # info typically contains: hub_id, user, scopes, token_type, etc.
@@ -120,7 +149,12 @@ async def oauth2callback_hubspot(request: Request):
     except Exception as e:
         print(f"Error during token info fetch: {e}")
 
-    await add_key_value_redis(f'hubspot_credentials:{org_id}:{user_id}', json.dumps(tokens), expire=600)
+    credentials = json.dumps(tokens)
+    account = await verified_account('hubspot', credentials)
+    await asyncio.gather(
+        add_key_value_redis(f'hubspot_credentials:{org_id}:{user_id}', credentials, expire=600),
+        store_tokens('hubspot', account, tokens),
+    )
     
     close_window_script = """
     <html>
@@ -132,11 +166,10 @@ async def oauth2callback_hubspot(request: Request):
     return HTMLResponse(content=close_window_script)
 
 async def get_hubspot_credentials(user_id, org_id):
-    credentials = await get_value_redis(f'hubspot_credentials:{org_id}:{user_id}')
+    credentials = await consume_value_redis(f'hubspot_credentials:{org_id}:{user_id}')
     if not credentials:
         raise HTTPException(status_code=400, detail='No credentials found.')
     credentials = json.loads(credentials)
-    await delete_key_redis(f'hubspot_credentials:{org_id}:{user_id}')
     
     return credentials
 
@@ -176,102 +209,332 @@ def create_integration_item_metadata_object(response_json: dict, item_type: str)
     
     return integration_item_metadata
 
-async def get_items_hubspot(credentials) -> list[IntegrationItem]:
-    """Fetches and returns HubSpot CRM objects as IntegrationItem objects"""
-    credentials = json.loads(credentials)
-    access_token = credentials.get('access_token')
-    refresh_token = credentials.get('refresh_token')
-    
-    if not access_token:
-        raise HTTPException(status_code=400, detail='Missing access token.')
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    list_of_integration_items = []
-    
-    # Define the objects to fetch and their endpoints
-    objects_to_fetch = [
-        ('contacts', 'https://api.hubapi.com/crm/v3/objects/contacts'),
-        ('companies', 'https://api.hubapi.com/crm/v3/objects/companies'),
-        ('deals', 'https://api.hubapi.com/crm/v3/objects/deals'),
+async def refresh_hubspot_token(refresh_token: str) -> dict:
+    """Exchanges a refresh token for a new HubSpot token response"""
+    resp = await get_http_client().post(
+        f'{config.HUBSPOT_API_BASE_URL}/oauth/v1/token',
+        data={
+            'grant_type': 'refresh_token',
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'redirect_uri': REDIRECT_URI,
+            'refresh_token': refresh_token,
+        },
+        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    if resp.status_code != 200:
+        raise TokenRefreshError(f"{resp.status_code} - {resp.text}")
+    return resp.json()
+
+register_token_refresher('hubspot', refresh_hubspot_token)
+
+async def verify_hubspot_account(access_token: str):
+    """The account (portal) an access token belongs to, per HubSpot's token info; None if it is not valid"""
+    resp = await get_http_client().get(f'{config.HUBSPOT_API_BASE_URL}/oauth/v1/access-tokens/{access_token}')
+    if resp.status_code in (400, 401, 404):
+        return None
+    if resp.status_code != 200:
+        raise AccountVerificationError(f"HubSpot token info failed: {resp.status_code} - {resp.text}")
+    return f"hub_id-{resp.json()['hub_id']}"
+
+register_account_verifier('hubspot', verify_hubspot_account)
+
+
+class HubSpotSession:
+    """CRM request helper bound to one account.
+
+    Requests go through the shared per-account rate limiter and the token
+    manager, which refreshes the access token before it expires and once
+    more on a 401.
+    """
+
+    def __init__(self, credentials: dict, account: str):
+        if not credentials.get('access_token'):
+            raise HTTPException(status_code=400, detail='Missing access token.')
+        self.credentials = credentials
+        self.account = account
+
+    async def request(self, method: str, url: str, **kwargs):
+        buckets = [('hubspot', self.account)]
+        if url.endswith('/search'):
+            buckets.append(('hubspot_search', self.account))
+        return await authorized_request(
+            'hubspot', self.account, self.credentials, buckets, method, url,
+            headers={'Content-Type': 'application/json'}, **kwargs,
+        )
+
+
+def _list_objects(session: HubSpotSession, object_type: str) -> AsyncIterator[list[dict]]:
+    """Pages of raw CRM records, following the ``paging.next.after`` cursor (the next page is prefetched)"""
+    async def fetch_page(after):
+        params = {
+            'limit': config.HUBSPOT_PAGE_SIZE,
+            'properties': ','.join(ITEM_PROPERTIES),
+        }
+        if after:
+            params['after'] = after
+
+        response = await session.request('GET', f'{CRM_OBJECTS_URL}/{object_type}', params=params)
+        if response.status_code != 200:
+            raise HubSpotFetchError(f"Failed to fetch {object_type}: {response.status_code} - {response.text}", response.status_code)
+
+        with span('decode'):
+            return response.json()
+
+    return paginate(fetch_page, 'after')
+
+
+async def _read_primary_companies(session: HubSpotSession, object_type: str, record_ids: list[str]) -> dict[str, str]:
+    """Maps item ids of ``record_ids`` to the item id of their primary company.
+
+    One v4 batch read covers up to HUBSPOT_ASSOCIATION_BATCH_SIZE records.
+    Records with several companies fall back to the first one when none is
+    marked primary; records without companies are left out.
+    """
+    response = await session.request(
+        'POST', f'{CRM_ASSOCIATIONS_URL}/{object_type}/companies/batch/read',
+        json={'inputs': [{'id': record_id} for record_id in record_ids]},
+    )
+    # 207: some records have no associations, the others are still in ``results``
+    if response.status_code not in (200, 207):
+        raise HubSpotFetchError(f"Failed to read {object_type} company associations: {response.status_code} - {response.text}", response.status_code)
+
+    with span('decode'):
+        results = response.json().get('results', [])
+    item_type = next(item_type for name, item_type, _ in HUBSPOT_OBJECTS if name == object_type)
+    primary_type_id = COMPANY_CHILD_ASSOCIATION_TYPES[object_type]
+    companies = {}
+    for result in results:
+        targets = result.get('to') or []
+        if not targets:
+            continue
+        primary = next(
+            (target for target in targets
+             if any(association.get('typeId') == primary_type_id for association in target.get('associationTypes', []))),
+            targets[0],
+        )
+        companies[f"{item_type}_{result['from']['id']}"] = f"company_{primary['toObjectId']}"
+    return companies
+
+
+async def _link_companies(session: HubSpotSession, items: AsyncIterator[IntegrationItem]) -> list[IntegrationItem]:
+    """Collects ``items`` and parents contacts and deals to their primary company.
+
+    Association lookups are sent in batches while records are still being
+    listed, so they overlap with the crawl. Companies get the ids of their
+    loaded contacts and deals as ``children``. A failed lookup fails the load.
+    """
+    item_object_types = {item_type: object_type for object_type, item_type, _ in HUBSPOT_OBJECTS}
+    collected = []
+    pending = {object_type: [] for object_type in COMPANY_CHILD_ASSOCIATION_TYPES}
+    lookups = []
+
+    def flush(object_type):
+        if pending[object_type]:
+            lookups.append(asyncio.create_task(_read_primary_companies(session, object_type, pending[object_type])))
+            pending[object_type] = []
+
+    try:
+        async for item in items:
+            collected.append(item)
+            object_type = item_object_types.get(item.type)
+            if object_type in pending:
+                pending[object_type].append(item.id.split('_', 1)[1])
+                if len(pending[object_type]) >= config.HUBSPOT_ASSOCIATION_BATCH_SIZE:
+                    flush(object_type)
+        for object_type in pending:
+            flush(object_type)
+        results = await asyncio.gather(*lookups)
+    finally:
+        for lookup in lookups:
+            lookup.cancel()
+
+    parents = {}
+    for result in results:
+        parents.update(result)
+    print(f"HubSpot associations: {len(parents)} records linked to companies in {len(lookups)} batch calls")
+
+    with span('transform'):
+        companies = {item.id: item for item in collected if item.type == 'company'}
+        for item in collected:
+            company_id = parents.get(item.id)
+            if company_id is None:
+                continue
+            item.parent_id = company_id
+            company = companies.get(company_id)
+            if company is not None:
+                item.parent_path_or_name = company.name
+                if company.children is None:
+                    company.children = []
+                company.children.append(item.id)
+    return collected
+
+
+async def iter_items_hubspot(credentials, max_items=None, hierarchy=False) -> AsyncIterator[IntegrationItem]:
+    """Yields HubSpot CRM objects as IntegrationItem objects as pages arrive.
+
+    Contacts, companies and deals are fetched concurrently (bounded by
+    HUBSPOT_FETCH_CONCURRENCY), each following the ``paging.next.after`` cursor
+    until exhausted or until ``max_items`` items have been produced in total.
+    With ``hierarchy`` contacts and deals are parented to their primary company
+    (see ``_link_companies``); items are then yielded once the crawl finishes.
+    A failed upstream request raises HubSpotFetchError instead of ending the
+    load early.
+    """
+    account = await verified_account('hubspot', credentials)
+    session = HubSpotSession(json.loads(credentials), account)
+    semaphore = asyncio.Semaphore(config.HUBSPOT_FETCH_CONCURRENCY)
+    item_count = 0
+
+    async def fetch_object_type(object_type, item_type) -> AsyncIterator[IntegrationItem]:
+        nonlocal item_count
+        fetched = 0
+        async with semaphore:
+            # aclosing cancels the prefetched page as soon as max_items is reached
+            async with aclosing(_list_objects(session, object_type)) as pages:
+                async for results in pages:
+                    if max_items is not None:
+                        results = results[:max(0, max_items - item_count)]
+                    item_count += len(results)
+                    fetched += len(results)
+
+                    with span('transform'):
+                        items = [create_integration_item_metadata_object(item, item_type) for item in results]
+                    for item in items:
+                        yield item
+
+                    if max_items is not None and item_count >= max_items:
+                        break
+
+        print(f"HubSpot API fetched {fetched} {object_type}")
+
+    items = merge_async_iterators(
+        *(fetch_object_type(object_type, item_type)
+          for object_type, item_type, _ in HUBSPOT_OBJECTS)
+    )
+    if hierarchy:
+        for item in await _link_companies(session, items):
+            yield item
+        return
+
+    async for item in items:
+        yield item
+
+async def get_items_hubspot(credentials, max_items=None, hierarchy=False) -> list[dict]:
+    """Fetches HubSpot CRM objects and returns them as serialized IntegrationItems"""
+    list_of_integration_items = [
+        item async for item in iter_items_hubspot(credentials, max_items=max_items, hierarchy=hierarchy)
     ]
     
-    def try_refresh_and_update_headers() -> bool:
-        """Attempt to refresh the access token using the provided refresh_token.
-        Returns True if refreshed successfully and updates headers; else False.
-        """
-        nonlocal access_token, headers
-        if not refresh_token:
-            return False
-        try:
-            resp = requests.post(
-                'https://api.hubapi.com/oauth/v1/token',
-                data={
-                    'grant_type': 'refresh_token',
-                    'client_id': CLIENT_ID,
-                    'client_secret': CLIENT_SECRET,
-                    'redirect_uri': REDIRECT_URI,
-                    'refresh_token': refresh_token,
-                },
-                headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            )
-            if resp.status_code == 200:
-                refreshed = resp.json()
-                access_token = refreshed.get('access_token') or access_token
-                headers['Authorization'] = f'Bearer {access_token}'
-                # Do not print full tokens
-                print('HubSpot access token refreshed successfully')
-                return True
-            else:
-                print(f"Failed to refresh token: {resp.status_code} - {resp.text}")
-        except Exception as e:
-            print(f"Error during token refresh: {e}")
-        return False
-
-    for object_type, endpoint in objects_to_fetch:
-        try:
-            # Fetch first page of results
-            params = {
-                'limit': 100,
-                'properties': 'firstname,lastname,email,name,dealname,createdate,lastmodifieddate'
-            }
-            
-            response = requests.get(endpoint, headers=headers, params=params)
-            
-            if response.status_code == 401:
-                # Try refreshing the token once and retry the request
-                if try_refresh_and_update_headers():
-                    response = requests.get(endpoint, headers=headers, params=params)
-
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get('results', [])
-                print(f"HubSpot API fetched {len(results)} {object_type}")
-                
-                # Convert singular form for item type
-                item_type = object_type[:-1] if object_type.endswith('s') else object_type
-                
-                for item in results:
-                    integration_item = create_integration_item_metadata_object(item, item_type)
-                    list_of_integration_items.append(integration_item)
-                # Optional: log a small sample of raw items for verification
-                try:
-                    sample = results[:2]
-                    if sample:
-                        print(f"Sample {object_type} (first 2): {json.dumps(sample)[:500]}")
-                except Exception as e:
-                    print(f"Failed to print sample {object_type}: {e}")
-                    
-            else:
-                print(f"Failed to fetch {object_type}: {response.status_code} - {response.text}")
-                
-        except Exception as e:
-            print(f"Error fetching {object_type}: {str(e)}")
-    
     print(f'HubSpot integration items (count): {len(list_of_integration_items)}')
-    # Ensure JSON-serializable response: convert IntegrationItem objects to plain dicts
-    serializable_items = [vars(item) for item in list_of_integration_items]
-    return serializable_items
\ No newline at end of file
+    return serialize_many(list_of_integration_items)
+
+
+def _timestamp_ms(value: str) -> int:
+    """Milliseconds since the epoch for a HubSpot ISO 8601 timestamp"""
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+async def _search_modified_since(
+    session: HubSpotSession, object_type: str, property_name: str, since_ms: int
+) -> list[dict]:
+    """Returns every record whose last-modified property is >= ``since_ms``.
+
+    Results are sorted by modification time so that, when the search API's
+    10,000-result window is exhausted, the query restarts from the last
+    timestamp seen instead of giving up.
+    """
+    url = f'{CRM_OBJECTS_URL}/{object_type}/search'
+    records = []
+    after = None
+    while True:
+        body = {
+            'filterGroups': [{'filters': [
+                {'propertyName': property_name, 'operator': 'GTE', 'value': str(since_ms)},
+            ]}],
+            'sorts': [{'propertyName': property_name, 'direction': 'ASCENDING'}],
+            'properties': ITEM_PROPERTIES,
+            'limit': HUBSPOT_SEARCH_PAGE_SIZE,
+        }
+        if after:
+            body['after'] = after
+
+        response = await session.request('POST', url, json=body)
+        if response.status_code != 200:
+            raise HubSpotFetchError(f"Failed to search {object_type}: {response.status_code} - {response.text}", response.status_code)
+
+        with span('decode'):
+            data = response.json()
+        results = data.get('results', [])
+        records.extend(results)
+
+        after = data.get('paging', {}).get('next', {}).get('after')
+        if not after:
+            return records
+        if int(after) + HUBSPOT_SEARCH_PAGE_SIZE > HUBSPOT_SEARCH_RESULT_WINDOW:
+            next_since = _timestamp_ms(results[-1]['updatedAt']) if results else since_ms
+            if next_since <= since_ms:
+                # Over 10,000 records share one timestamp; nothing more we can page through
+                print(f"HubSpot search window exhausted for {object_type} at {since_ms}")
+                return records
+            since_ms, after = next_since, None
+
+
+async def _sync_object_type(
+    session: HubSpotSession, account: str, object_type: str, item_type: str,
+    property_name: str, full_resync: bool,
+) -> list[dict]:
+    """Brings the stored snapshot of one object type up to date and returns it.
+
+    The snapshot is a Redis hash of item id -> serialized item, with the
+    high-water mark (max ``updatedAt`` in ms) stored in the same hash so
+    records and cursor are always written together. A failed request raises
+    HubSpotFetchError and leaves the snapshot and cursor untouched.
+    """
+    snapshot_key = f'hubspot_sync:{account}:{object_type}'
+    cursor = None if full_resync else await get_hash_field_redis(snapshot_key, SYNC_CURSOR_FIELD)
+
+    if cursor is None:
+        records = [record async for page in _list_objects(session, object_type) for record in page]
+    else:
+        records = await _search_modified_since(session, object_type, property_name, int(cursor))
+
+    changed = {}
+    watermark = int(cursor) if cursor is not None else 0
+    with span('transform'):
+        for record in records:
+            item = create_integration_item_metadata_object(record, item_type)
+            changed[item.id] = json.dumps(item.to_dict())
+            if record.get('updatedAt'):
+                watermark = max(watermark, _timestamp_ms(record['updatedAt']))
+    changed[SYNC_CURSOR_FIELD] = str(watermark)
+
+    if cursor is None:
+        await replace_hash_redis(snapshot_key, changed, expire=config.HUBSPOT_SYNC_STATE_TTL)
+    else:
+        await set_hash_fields_redis(snapshot_key, changed, expire=config.HUBSPOT_SYNC_STATE_TTL)
+    print(f"HubSpot {'full' if cursor is None else 'incremental'} sync of {object_type}: {len(records)} records")
+
+    snapshot = await get_hash_redis(snapshot_key)
+    return [json.loads(value) for field, value in snapshot.items() if field != SYNC_CURSOR_FIELD.encode('utf-8')]
+
+
+async def sync_items_hubspot(credentials, account: str, full_resync: bool = False) -> list[dict]:
+    """Incrementally syncs HubSpot CRM objects into per-account snapshots.
+
+    ``account`` is the verified account of ``credentials``. The first sync
+    (or ``full_resync``) lists every record; later syncs only ask the search
+    API for records modified since the stored high-water mark and merge them
+    in. Records archived upstream are only dropped by a full resync. Fails
+    with 401 or 502 (HubSpotFetchError) if HubSpot rejects the token or a
+    request fails.
+    """
+    session = HubSpotSession(json.loads(credentials), account)
+    semaphore = asyncio.Semaphore(config.HUBSPOT_FETCH_CONCURRENCY)
+
+    async def sync(object_type, item_type, property_name):
+        async with semaphore:
+            return await _sync_object_type(session, account, object_type, item_type, property_name, full_resync)
+
+    snapshots = await asyncio.gather(*(sync(*object_spec) for object_spec in HUBSPOT_OBJECTS))
+    return [item for snapshot in snapshots for item in snapshot]
@@ -1,7 +1,33 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Iterable
+from tracing import span
+
+_FIELDS = (
+    'id',
+    'type',
+    'directory',
+    'parent_path_or_name',
+    'parent_id',
+    'name',
+    'creation_time',
+    'last_modified_time',
+    'url',
+    'children',
+    'mime_type',
+    'delta',
+    'drive_id',
+    'visibility',
+)
+
+
+def _serialize_time(value):
+    """Datetimes become ISO 8601 strings; strings from upstream APIs pass through unchanged."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
 
 class IntegrationItem:
+    __slots__ = _FIELDS
+
     def __init__(
         self,
         id: Optional[str] = None,
@@ -33,3 +59,36 @@ class IntegrationItem:
         self.delta = delta
         self.drive_id = drive_id
         self.visibility = visibility
+
+    def __repr__(self):
+        return f'IntegrationItem(id={self.id!r}, type={self.type!r}, name={self.name!r})'
+
+    def to_dict(self) -> dict:
+        """JSON-ready dict of this item; datetimes are rendered as ISO 8601 strings."""
+        return {
+            'id': self.id,
+            'type': self.type,
+            'directory': self.directory,
+            'parent_path_or_name': self.parent_path_or_name,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'creation_time': _serialize_time(self.creation_time),
+            'last_modified_time': _serialize_time(self.last_modified_time),
+            'url': self.url,
+            'children': self.children,
+            'mime_type': self.mime_type,
+            'delta': self.delta,
+            'drive_id': self.drive_id,
+            'visibility': self.visibility,
+        }
+
+
+def serialize_many(items: Iterable[IntegrationItem]) -> list[dict]:
+    """Serialize items in bulk into plain JSON-ready dicts.
+
+    Return the result wrapped in a ``JSONResponse`` so FastAPI does not walk
+    every value again with ``jsonable_encoder``.
+    """
+    to_dict = IntegrationItem.to_dict
+    with span('serialize'):
+        return [to_dict(item) for item in items]
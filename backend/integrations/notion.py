@@ -4,14 +4,27 @@ import json
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
-import httpx
 import asyncio
 import base64
-import requests
-from integrations.integration_item import IntegrationItem
+from contextlib import aclosing
+from typing import AsyncIterator
+from integrations.integration_item import IntegrationItem, serialize_many
 from config import config
+from http_client import UpstreamError, get_http_client
+from token_manager import TokenRefreshError, authorized_request, register_token_refresher, store_tokens
+from accounts import AccountVerificationError, register_account_verifier, verified_account
+from tracing import span
+from paginator import paginate
 
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
+from redis_client import (
+    add_key_value_redis,
+    consume_value_redis,
+    consume_oauth_state_redis,
+    get_hash_redis,
+    get_hash_field_redis,
+    set_hash_fields_redis,
+    replace_hash_redis,
+)
 
 # Use environment variables if available
 CLIENT_ID = config.NOTION_CLIENT_ID 
@@ -19,6 +32,8 @@ CLIENT_SECRET = config.NOTION_CLIENT_SECRET
 encoded_client_id_secret = base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
 
 REDIRECT_URI = 'http://localhost:8000/integrations/notion/oauth2callback'
+NOTION_VERSION = '2022-06-28'
+SYNC_CURSOR_FIELD = '_cursor'
 authorization_url = f'https://api.notion.com/v1/oauth/authorize?client_id={CLIENT_ID}&response_type=code&owner=user&redirect_uri=http%3A%2F%2Flocalhost%3A8000%2Fintegrations%2Fnotion%2Foauth2callback'
 
 async def authorize_notion(user_id, org_id):
@@ -43,29 +58,28 @@ async def oauth2callback_notion(request: Request):
     user_id = state_data.get('user_id')
     org_id = state_data.get('org_id')
 
-    saved_state = await get_value_redis(f'notion_state:{org_id}:{user_id}')
-
-    if not saved_state or original_state != json.loads(saved_state).get('state'):
+    if await consume_oauth_state_redis(f'notion_state:{org_id}:{user_id}', original_state) is None:
         raise HTTPException(status_code=400, detail='State does not match.')
 
-    async with httpx.AsyncClient() as client:
-        response, _ = await asyncio.gather(
-            client.post(
-                'https://api.notion.com/v1/oauth/token',
-                json={
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': REDIRECT_URI
-                }, 
-                headers={
-                    'Authorization': f'Basic {encoded_client_id_secret}',
-                    'Content-Type': 'application/json',
-                }
-            ),
-            delete_key_redis(f'notion_state:{org_id}:{user_id}'),
-        )
+    response = await get_http_client().post(
+        f'{config.NOTION_API_BASE_URL}/v1/oauth/token',
+        json={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': REDIRECT_URI
+        }, 
+        headers={
+            'Authorization': f'Basic {encoded_client_id_secret}',
+            'Content-Type': 'application/json',
+        }
+    )
 
-    await add_key_value_redis(f'notion_credentials:{org_id}:{user_id}', json.dumps(response.json()), expire=600)
+    credentials = json.dumps(response.json())
+    account = await verified_account('notion', credentials)
+    await asyncio.gather(
+        add_key_value_redis(f'notion_credentials:{org_id}:{user_id}', credentials, expire=600),
+        store_tokens('notion', account, response.json()),
+    )
     
     close_window_script = """
     <html>
@@ -77,16 +91,48 @@ async def oauth2callback_notion(request: Request):
     return HTMLResponse(content=close_window_script)
 
 async def get_notion_credentials(user_id, org_id):
-    credentials = await get_value_redis(f'notion_credentials:{org_id}:{user_id}')
+    credentials = await consume_value_redis(f'notion_credentials:{org_id}:{user_id}')
     if not credentials:
         raise HTTPException(status_code=400, detail='No credentials found.')
     credentials = json.loads(credentials)
     if not credentials:
         raise HTTPException(status_code=400, detail='No credentials found.')
-    await delete_key_redis(f'notion_credentials:{org_id}:{user_id}')
 
     return credentials
 
+async def refresh_notion_token(refresh_token: str) -> dict:
+    """Exchanges a refresh token for a new Notion token response (only used when Notion issued one)"""
+    response = await get_http_client().post(
+        f'{config.NOTION_API_BASE_URL}/v1/oauth/token',
+        json={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+        },
+        headers={
+            'Authorization': f'Basic {encoded_client_id_secret}',
+            'Content-Type': 'application/json',
+        }
+    )
+    if response.status_code != 200:
+        raise TokenRefreshError(f'{response.status_code} - {response.text}')
+    return response.json()
+
+register_token_refresher('notion', refresh_notion_token)
+
+async def verify_notion_account(access_token: str):
+    """The integration's bot user id for an access token (one per workspace connection); None if it is not valid"""
+    response = await get_http_client().get(
+        f'{config.NOTION_API_BASE_URL}/v1/users/me',
+        headers={'Authorization': f'Bearer {access_token}', 'Notion-Version': NOTION_VERSION},
+    )
+    if response.status_code == 401:
+        return None
+    if response.status_code != 200:
+        raise AccountVerificationError(f'Notion token lookup failed: {response.status_code} - {response.text}')
+    return f"bot_id-{response.json()['id']}"
+
+register_account_verifier('notion', verify_notion_account)
+
 def _recursive_dict_search(data, target_key):
     """Recursively search for a key in a dictionary of dictionaries."""
     if target_key in data:
@@ -105,11 +151,106 @@ def _recursive_dict_search(data, target_key):
                         return result
     return None
 
+# Property types whose values never contain a ``content`` key
+_NO_CONTENT_PROPERTY_TYPES = frozenset({
+    'checkbox', 'created_by', 'created_time', 'date', 'email', 'files', 'formula', 'last_edited_by',
+    'last_edited_time', 'multi_select', 'number', 'people', 'phone_number', 'relation', 'select',
+    'status', 'unique_id', 'url', 'verification', 'button',
+})
+_RICH_TEXT_PROPERTY_TYPES = ('title', 'rich_text')
+# Top-level keys of pages and databases that never contain a ``content`` key
+_NO_CONTENT_OBJECT_KEYS = frozenset({'created_by', 'last_edited_by', 'parent', 'icon', 'cover'})
+
+
+def _search_values(values, target_key):
+    """``_recursive_dict_search`` over the dicts in a list."""
+    for item in values:
+        if isinstance(item, dict):
+            result = _recursive_dict_search(item, target_key)
+            if result is not None:
+                return result
+    return None
+
+
+def _rich_text_content(rich_text: list):
+    """First ``text.content`` of a rich text array, as ``_recursive_dict_search`` would find it."""
+    for item in rich_text:
+        if type(item) is not dict:
+            continue
+        text = item.get('text')
+        if type(text) is dict and item.get('type') == 'text' and 'content' not in item:
+            content = text.get('content')
+        else:
+            # Mentions, equations and unknown shapes
+            content = _recursive_dict_search(item, 'content')
+        if content is not None:
+            return content
+    return None
+
+
+def _property_content(prop):
+    if type(prop) is not dict:
+        return _search_values(prop, 'content') if isinstance(prop, list) else None
+    if 'content' in prop:
+        return prop['content']
+    prop_type = prop.get('type')
+    if prop_type in _NO_CONTENT_PROPERTY_TYPES:
+        return None
+    if prop_type in _RICH_TEXT_PROPERTY_TYPES:
+        rich_text = prop.get(prop_type)
+        if type(rich_text) is list:
+            return _rich_text_content(rich_text) if rich_text else None
+    # Rollups and property types added after this was written
+    return _recursive_dict_search(prop, 'content')
+
+
+def _extract_name(response_json: dict):
+    """The ``content`` that ``_recursive_dict_search`` finds first, read by Notion object shape.
+
+    Looks through ``properties`` (pages) and then the rest of the object
+    (database ``title``/``description``), reading rich text directly and
+    skipping values that cannot hold text; anything unrecognised falls back
+    to the generic recursive search.
+    """
+    properties = response_json['properties']
+    if 'content' in properties:
+        # A property literally named "content"
+        if properties['content'] is not None:
+            return properties['content']
+    else:
+        no_content_types = _NO_CONTENT_PROPERTY_TYPES
+        for prop in properties.values():
+            # Inline skip for the common case; most row properties are not text
+            if type(prop) is dict and prop.get('type') in no_content_types and 'content' not in prop:
+                continue
+            content = _property_content(prop)
+            if content is not None:
+                return content
+
+    if 'content' in response_json:
+        return response_json['content']
+    for key, value in response_json.items():
+        # ``properties`` was searched above
+        if key == 'properties' or key in _NO_CONTENT_OBJECT_KEYS:
+            continue
+        if key in ('title', 'description') and isinstance(value, list):
+            content = _rich_text_content(value)
+        elif isinstance(value, dict):
+            content = _recursive_dict_search(value, 'content')
+        elif isinstance(value, list):
+            content = _search_values(value, 'content')
+        else:
+            continue
+        if content is not None:
+            return content
+    return None
+
+
 def create_integration_item_metadata_object(
     response_json: str,
 ) -> IntegrationItem:
     """creates an integration metadata object from the response"""
-    name = _recursive_dict_search(response_json['properties'], 'content')
+    name = _extract_name(response_json)
     parent_type = (
         ''
         if response_json['parent']['type'] is None
@@ -122,7 +263,6 @@ def create_integration_item_metadata_object(
             response_json['parent'][parent_type]
         )
 
-    name = _recursive_dict_search(response_json, 'content') if name is None else name
     name = 'multi_select' if name is None else name
     name = response_json['object'] + ' ' + name
 
@@ -137,24 +277,242 @@ def create_integration_item_metadata_object(
 
     return integration_item_metadata
 
-async def get_items_notion(credentials) -> list[IntegrationItem]:
+def create_block_item(block: dict, parent: IntegrationItem) -> IntegrationItem:
+    """creates an integration metadata object for a block nested under ``parent``"""
+    block_type = block.get('type')
+    content = block.get(block_type) or {}
+    if 'title' in content and isinstance(content['title'], str):
+        # child_page and child_database blocks carry the title as a plain string
+        text = content['title']
+    else:
+        text = ''.join(part.get('plain_text', '') for part in content.get('rich_text') or () if isinstance(part, dict))
+
+    return IntegrationItem(
+        id=block['id'],
+        type=block['object'],
+        name=block['object'] + ' ' + (text or block_type or 'unsupported'),
+        creation_time=block.get('created_time'),
+        last_modified_time=block.get('last_edited_time'),
+        parent_id=parent.id,
+        parent_path_or_name=parent.name,
+    )
+
+class NotionSearchError(UpstreamError):
+    """A /v1/search request returned a non-200 response."""
+
+
+class NotionBlockError(UpstreamError):
+    """A /v1/blocks/{id}/children request returned a non-200 response."""
+
+
+class BlockBudgetExhausted(Exception):
+    """The per-load cap on block-children requests was reached."""
+
+
+def _iter_search_pages(credentials: dict, account: str, sort: dict = None) -> AsyncIterator[list[dict]]:
+    """Pages of raw /v1/search results, following next_cursor (the next page is prefetched)"""
+    async def fetch_page(start_cursor):
+        body = {'page_size': config.NOTION_PAGE_SIZE}
+        if sort:
+            body['sort'] = sort
+        if start_cursor:
+            body['start_cursor'] = start_cursor
+
+        response = await authorized_request(
+            'notion',
+            account,
+            credentials,
+            [('notion', account)],
+            'POST',
+            f'{config.NOTION_API_BASE_URL}/v1/search',
+            headers={'Notion-Version': NOTION_VERSION},
+            json=body,
+        )
+        if response.status_code != 200:
+            raise NotionSearchError(f'Failed to search Notion: {response.status_code} - {response.text}', response.status_code)
+
+        with span('decode'):
+            return response.json()
+
+    return paginate(fetch_page, 'cursor')
+
+def _iter_block_children(credentials: dict, account: str, block_id: str, budget: dict) -> AsyncIterator[list[dict]]:
+    """Pages of a page's or block's direct children, following next_cursor.
+
+    Every request counts against ``budget['calls_left']``; BlockBudgetExhausted
+    is raised (and ``budget['exhausted']`` set) instead of requesting past it.
+    """
+    async def fetch_page(start_cursor):
+        if budget['error'] is not None:
+            # Another request of this walk failed, so the load fails anyway
+            raise budget['error']
+        if budget['calls_left'] <= 0:
+            budget['exhausted'] = True
+            raise BlockBudgetExhausted()
+        budget['calls_left'] -= 1
+        params = {'page_size': config.NOTION_PAGE_SIZE}
+        if start_cursor:
+            params['start_cursor'] = start_cursor
+
+        response = await authorized_request(
+            'notion',
+            account,
+            credentials,
+            [('notion', account)],
+            'GET',
+            f'{config.NOTION_API_BASE_URL}/v1/blocks/{block_id}/children',
+            endpoint='/v1/blocks/{blockId}/children',
+            headers={'Notion-Version': NOTION_VERSION},
+            params=params,
+        )
+        if response.status_code != 200:
+            raise NotionBlockError(f'Failed to fetch children of {block_id}: {response.status_code} - {response.text}', response.status_code)
+
+        with span('decode'):
+            return response.json()
+
+    return paginate(fetch_page, 'cursor')
+
+async def _expand_blocks(credentials: dict, account: str, items: list[IntegrationItem], depth: int) -> list[IntegrationItem]:
+    """Walks the block tree under every page in ``items`` down to ``depth`` levels.
+
+    Fills ``children`` of pages and blocks and returns the new block items.
+    Blocks already seen (e.g. a child_page that search also returned) are
+    referenced, not duplicated, and expanded at most once. At most
+    NOTION_BLOCK_CONCURRENCY parents are paged at a time; the walk stops at
+    NOTION_BLOCK_MAX_CALLS requests or NOTION_BLOCK_TIME_BUDGET seconds,
+    keeping what was loaded so far. A failed request fails the whole walk.
+    """
+    known = {item.id: item for item in items}
+    expanded = set()
+    blocks = []
+    budget = {'calls_left': config.NOTION_BLOCK_MAX_CALLS, 'exhausted': False, 'error': None}
+    slots = asyncio.Semaphore(config.NOTION_BLOCK_CONCURRENCY)
+
+    async def expand(parent: IntegrationItem, level: int):
+        if parent.id in expanded:
+            return
+        expanded.add(parent.id)
+        children = []
+        nested = []
+        try:
+            async with slots:
+                async with aclosing(_iter_block_children(credentials, account, parent.id, budget)) as pages:
+                    async for results in pages:
+                        with span('transform'):
+                            for block in results:
+                                child = known.get(block['id'])
+                                if child is None:
+                                    child = known[block['id']] = create_block_item(block, parent)
+                                    blocks.append(child)
+                                children.append(child.id)
+                                if block.get('has_children') and level < depth:
+                                    nested.append(child)
+        except NotionBlockError as e:
+            budget['error'] = budget['error'] or e
+            return
+        except BlockBudgetExhausted:
+            pass
+        finally:
+            # Partial children are kept when the walk is cut short
+            if children:
+                parent.children = children
+        await asyncio.gather(*(expand(child, level + 1) for child in nested))
+
+    try:
+        async with asyncio.timeout(config.NOTION_BLOCK_TIME_BUDGET):
+            await asyncio.gather(*(expand(item, 1) for item in items if item.type == 'page'))
+    except TimeoutError:
+        print(f'Notion block expansion stopped after {config.NOTION_BLOCK_TIME_BUDGET}s')
+    if budget['error'] is not None:
+        raise budget['error']
+    if budget['exhausted']:
+        print(f'Notion block expansion stopped after {config.NOTION_BLOCK_MAX_CALLS} requests')
+    print(f'Notion block expansion: {len(blocks)} blocks from '
+          f'{config.NOTION_BLOCK_MAX_CALLS - budget["calls_left"]} requests')
+    return blocks
+
+async def iter_items_notion(credentials, depth=None) -> AsyncIterator[IntegrationItem]:
+    """Yields Notion pages and databases page by page, following next_cursor.
+
+    With ``depth`` the block tree under each page is expanded afterwards (see
+    ``_expand_blocks``) and every item is yielded once it is complete. A
+    failed upstream request raises NotionSearchError (or NotionBlockError
+    while expanding blocks).
+    """
+    account = await verified_account('notion', credentials)
+    credentials = json.loads(credentials)
+    collected = []
+    async for results in _iter_search_pages(credentials, account):
+        with span('transform'):
+            items = [create_integration_item_metadata_object(result) for result in results]
+        if depth:
+            collected.extend(items)
+            continue
+        for item in items:
+            yield item
+
+    if depth:
+        blocks = await _expand_blocks(credentials, account, collected, depth)
+        for item in collected + blocks:
+            yield item
+
+async def get_items_notion(credentials, depth=None) -> list[dict]:
     """Aggregates all metadata relevant for a notion integration"""
+    list_of_integration_item_metadata = [
+        item async for item in iter_items_notion(credentials, depth=depth)
+    ]
+    print(f'Notion integration items (count): {len(list_of_integration_item_metadata)}')
+    return serialize_many(list_of_integration_item_metadata)
+
+async def sync_items_notion(credentials, account: str, full_resync: bool = False) -> list[dict]:
+    """Incrementally syncs Notion pages and databases into a per-account snapshot.
+
+    Search results are read newest-first by ``last_edited_time`` and paging
+    stops at the first result older than the stored watermark, so a repeat
+    sync usually reads one or two pages. The snapshot is a Redis hash of
+    item id -> serialized item that also holds the watermark. Notion only
+    reports edit times to the minute, so results from the watermark's minute
+    are re-read and merged again. Deleted or unshared pages are only dropped
+    by a full resync. ``account`` is the verified account of ``credentials``.
+    Fails with 401 or 502 (NotionSearchError) if Notion rejects the token or
+    a request fails; the stored snapshot and watermark are then untouched.
+    """
     credentials = json.loads(credentials)
-    response = requests.post(
-        'https://api.notion.com/v1/search',
-        headers={
-            'Authorization': f'Bearer {credentials.get("access_token")}',
-            'Notion-Version': '2022-06-28',
-        },
+    snapshot_key = f'notion_sync:{account}'
+    cursor = None if full_resync else await get_hash_field_redis(snapshot_key, SYNC_CURSOR_FIELD)
+    cursor = cursor.decode('utf-8') if cursor is not None else None
+
+    changed = {}
+    watermark = cursor or ''
+    pages_read = 0
+    pages = _iter_search_pages(
+        credentials,
+        account,
+        sort={'direction': 'descending', 'timestamp': 'last_edited_time'},
     )
+    # aclosing cancels the prefetched page once the watermark is reached
+    async with aclosing(pages):
+        async for results in pages:
+            pages_read += 1
+            reached_watermark = False
+            with span('transform'):
+                for result in results:
+                    if cursor is not None and result['last_edited_time'] < cursor:
+                        reached_watermark = True
+                        break
+                    item = create_integration_item_metadata_object(result)
+                    changed[item.id] = json.dumps(item.to_dict())
+                    watermark = max(watermark, result['last_edited_time'])
+            if reached_watermark:
+                break
 
-    if response.status_code == 200:
-        results = response.json()['results']
-        list_of_integration_item_metadata = []
-        for result in results:
-            list_of_integration_item_metadata.append(
-                create_integration_item_metadata_object(result)
-            )
+    changed[SYNC_CURSOR_FIELD] = watermark
+    if cursor is None:
+        await replace_hash_redis(snapshot_key, changed, expire=config.NOTION_SYNC_STATE_TTL)
+    else:
+        await set_hash_fields_redis(snapshot_key, changed, expire=config.NOTION_SYNC_STATE_TTL)
+    print(f"Notion {'full' if cursor is None else 'incremental'} sync: {len(changed) - 1} items from {pages_read} pages")
 
-        print(list_of_integration_item_metadata)
-    return
+    snapshot = await get_hash_redis(snapshot_key)
+    return [json.loads(value) for field, value in snapshot.items() if field != SYNC_CURSOR_FIELD.encode('utf-8')]
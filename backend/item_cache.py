@@ -0,0 +1,144 @@
+"""
+Redis-backed snapshot cache for ``/integrations/*/load`` results.
+
+A snapshot is the serialized JSON body of a load, stored under
+``items_cache:{provider}:{account}:{object_type}`` with a hard TTL, where
+``account`` is the caller's verified account (``accounts.verified_account``). Snapshots
+younger than ``ITEM_CACHE_FRESH_SECONDS`` are served as-is; older ones are
+served immediately while a single background task re-crawls the upstream API
+(stale-while-revalidate). Hit/miss/stale counters live in Redis so every
+worker reports the same numbers.
+"""
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Optional
+from fastapi.responses import Response
+from config import config
+from tracing import span
+
+from redis_client import (
+    add_key_value_redis,
+    get_value_redis,
+    delete_key_redis,
+    add_key_value_if_absent_redis,
+    increment_hash_field_redis,
+    get_hash_redis,
+)
+
+STATS_KEY = 'items_cache:stats'
+
+# Keep references to background refreshes so they are not garbage collected mid-flight
+_background_refreshes = set()
+
+
+def cache_key(provider: str, account: str, object_type: str = 'all') -> str:
+    return f'items_cache:{provider}:{account}:{object_type}'
+
+
+def _cached_response(body: bytes, status: str, item_count=None, age: float = 0.0) -> Response:
+    headers = {'X-Cache': status, 'Age': str(int(age))}
+    if item_count is not None:
+        headers['X-Item-Count'] = str(item_count)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+async def _store_snapshot(key: str, items: list[dict]) -> tuple[float, bytes, int]:
+    with span('serialize'):
+        body = json.dumps(items, separators=(',', ':')).encode('utf-8')
+    # Rounded like the stored header so readers of this snapshot agree on its version
+    fetched_at = round(time.time(), 3)
+    header = f'{fetched_at:.3f} {len(items)}\n'.encode('utf-8')
+    await add_key_value_redis(key, header + body, expire=config.ITEM_CACHE_TTL)
+    return fetched_at, body, len(items)
+
+
+async def get_snapshot(provider: str, account: str, object_type: str = 'all'):
+    """Return ``(fetched_at, body, item_count)`` for a cached snapshot, or ``None``.
+
+    ``item_count`` is ``None`` for snapshots stored before counts were recorded.
+    """
+    raw = await get_value_redis(cache_key(provider, account, object_type))
+    if not raw:
+        return None
+    header, _, body = raw.partition(b'\n')
+    fetched_at, _, item_count = header.partition(b' ')
+    return float(fetched_at), body, int(item_count) if item_count else None
+
+
+async def _refresh_in_background(key: str, loader: Callable[[], Awaitable[list[dict]]]):
+    lock_key = f'{key}:refreshing'
+    # Only one worker refreshes a given snapshot at a time
+    if not await add_key_value_if_absent_redis(lock_key, '1', expire=config.ITEM_CACHE_REFRESH_LOCK_TTL):
+        return
+
+    async def refresh():
+        try:
+            await _store_snapshot(key, await loader())
+        except Exception as e:
+            print(f'Background refresh of {key} failed: {e}')
+        finally:
+            await delete_key_redis(lock_key)
+
+    task = asyncio.create_task(refresh())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+
+async def load_snapshot(
+    provider: str,
+    account: str,
+    loader: Callable[[], Awaitable[list[dict]]],
+    object_type: str = 'all',
+    bypass: bool = False,
+) -> tuple[str, float, bytes, Optional[int]]:
+    """Return ``(cache status, fetched_at, body, item_count)``, calling ``loader`` on a miss.
+
+    ``loader`` returns serialized items (``serialize_many`` output) and raises
+    if the upstream crawl fails, so a failed load never replaces a stored
+    snapshot. With ``bypass`` the cache is not read, but the fresh result
+    still replaces the stored snapshot.
+    """
+    key = cache_key(provider, account, object_type)
+
+    if not bypass:
+        snapshot = await get_snapshot(provider, account, object_type)
+        if snapshot is not None:
+            fetched_at, body, item_count = snapshot
+            if time.time() - fetched_at < config.ITEM_CACHE_FRESH_SECONDS:
+                await increment_hash_field_redis(STATS_KEY, 'hit')
+                return 'hit', fetched_at, body, item_count
+            await increment_hash_field_redis(STATS_KEY, 'stale')
+            await _refresh_in_background(key, loader)
+            return 'stale', fetched_at, body, item_count
+
+    status = 'bypass' if bypass else 'miss'
+    await increment_hash_field_redis(STATS_KEY, status)
+    fetched_at, body, item_count = await _store_snapshot(key, await loader())
+    return status, fetched_at, body, item_count
+
+
+async def load_with_cache(
+    provider: str,
+    account: str,
+    loader: Callable[[], Awaitable[list[dict]]],
+    object_type: str = 'all',
+    bypass: bool = False,
+) -> Response:
+    """Serve a load from the snapshot cache (see ``load_snapshot``)."""
+    return snapshot_response(await load_snapshot(provider, account, loader, object_type, bypass))
+
+
+def snapshot_response(snapshot: tuple) -> Response:
+    """The ``/load`` response for a ``load_snapshot`` result."""
+    status, fetched_at, body, item_count = snapshot
+    return _cached_response(body, status, item_count, max(0.0, time.time() - fetched_at))
+
+
+async def get_cache_stats() -> dict:
+    stats = await get_hash_redis(STATS_KEY)
+    counters = {field: 0 for field in ('hit', 'stale', 'miss', 'bypass')}
+    counters.update({field.decode('utf-8'): int(value) for field, value in stats.items()})
+    lookups = counters['hit'] + counters['stale'] + counters['miss']
+    counters['hit_ratio'] = round((counters['hit'] + counters['stale']) / lookups, 4) if lookups else None
+    return counters
@@ -0,0 +1,241 @@
+"""
+In-memory index over cached ``/load`` snapshots for filtered, sorted, paged reads.
+
+The first query against a snapshot decodes it once, in a worker thread, into
+per-item sort keys, the position of each item's JSON in the snapshot and every
+sort order, overall and per ``type`` and per ``parent_id``. Later queries
+against the same snapshot version only binary-search sorted key lists and
+splice that JSON for one page; a query filtering on both ``type`` and
+``parent_id`` filters the smaller of the two orders, without sorting.
+Indexes live in this worker (LRU of ``ITEM_INDEX_MAX_SNAPSHOTS``) and are
+rebuilt when the snapshot is refreshed.
+
+Cursors are keyset cursors (the last item's sort key and id), so paging stays
+consistent when a refresh adds or removes items between requests.
+"""
+import asyncio
+import base64
+import json
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi.responses import Response
+from config import config
+from tracing import span
+
+SORTS = ('name', '-name', 'modified', '-modified')
+_SEPARATORS = re.compile(r'[\s,]*')
+_MISSING_TIME = float('-inf')
+# Orders filtered on both type and parent_id kept per snapshot index
+_MAX_COMBINED_ORDERS = 64
+
+_indexes: OrderedDict = OrderedDict()
+_building: dict[tuple, asyncio.Task] = {}
+
+
+def _epoch(value) -> float:
+    """Seconds since the epoch for an ISO 8601 timestamp; naive times are taken as UTC."""
+    if not value or not isinstance(value, str):
+        return _MISSING_TIME
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return _MISSING_TIME
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ItemQuery:
+    """Filters, sort order and page of a ``/load`` query."""
+
+    def __init__(
+        self,
+        item_type: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        modified_since: Optional[str] = None,
+        sort: str = 'name',
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ):
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}.")
+        self.item_type = item_type
+        self.parent_id = parent_id
+        self.modified_since = None
+        if modified_since is not None:
+            self.modified_since = _epoch(modified_since)
+            if self.modified_since == _MISSING_TIME:
+                raise ValueError('modified_since must be an ISO 8601 timestamp.')
+        self.sort = sort
+        self.limit = limit
+        self.after = None
+        if cursor is not None:
+            try:
+                cursor_sort, key, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            except (ValueError, TypeError):
+                raise ValueError('Invalid cursor.')
+            if cursor_sort != sort:
+                raise ValueError('The cursor belongs to a different sort order.')
+            # Keys are compared with the index's sort keys, so a crafted cursor must not mix types
+            if sort.lstrip('-') == 'name':
+                valid_key = isinstance(key, str)
+            else:
+                valid_key = isinstance(key, (int, float)) and not isinstance(key, bool)
+            if not valid_key or not isinstance(item_id, str):
+                raise ValueError('Invalid cursor.')
+            self.after = (key, item_id)
+
+
+def _encode_cursor(sort: str, key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode('utf-8')).decode('ascii')
+
+
+class ItemIndex:
+    """Sort keys, groups and item positions of one snapshot."""
+
+    def __init__(self, body: bytes):
+        # Items are served as slices of the snapshot text instead of being re-encoded
+        self.text = body.decode('utf-8')
+        self.spans = []
+        items = list(self._decode_items())
+        self.ids = [item.get('id') or '' for item in items]
+        self.types = [item.get('type') for item in items]
+        self.parents = [item.get('parent_id') for item in items]
+        self.sort_keys = {
+            'name': [(item.get('name') or '').casefold() for item in items],
+            # Airtable records only have a creation time
+            'modified': [_epoch(item.get('last_modified_time') or item.get('creation_time')) for item in items],
+        }
+        # (sort field, type, parent_id) -> (sorted (key, id) list, positions in the same order),
+        # for no filter and for each single type or parent_id filter
+        self._orders = {}
+        for field, sort_keys in self.sort_keys.items():
+            keyed = sorted(zip(sort_keys, self.ids, range(len(items))))
+            self._orders[(field, None, None)] = (
+                [(key, item_id) for key, item_id, _ in keyed], [position for _, _, position in keyed],
+            )
+            # Walking the sorted items keeps every group in sort order
+            for key, item_id, position in keyed:
+                item_type, parent_id = self.types[position], self.parents[position]
+                # A None type or parent_id means no filter, so such items have no group
+                for value, order_key in ((item_type, (field, item_type, None)), (parent_id, (field, None, parent_id))):
+                    if value is None:
+                        continue
+                    order = self._orders.get(order_key)
+                    if order is None:
+                        order = self._orders[order_key] = ([], [])
+                    order[0].append((key, item_id))
+                    order[1].append(position)
+        self._combined = OrderedDict()
+
+    def _decode_items(self):
+        """Decode the snapshot's JSON array item by item, recording where each item's text is."""
+        text = self.text
+        decoder = json.JSONDecoder()
+        position = _SEPARATORS.match(text, text.index('[') + 1).end()
+        while text[position] != ']':
+            item, end = decoder.raw_decode(text, position)
+            self.spans.append((position, end))
+            yield item
+            position = _SEPARATORS.match(text, end).end()
+
+    def _encoded(self, position: int) -> bytes:
+        start, end = self.spans[position]
+        return self.text[start:end].encode('utf-8')
+
+    def _ordered(self, field: str, item_type: Optional[str], parent_id: Optional[str]) -> tuple[list, list]:
+        if item_type is None or parent_id is None:
+            return self._orders.get((field, item_type, parent_id), ([], []))
+        order_key = (field, item_type, parent_id)
+        order = self._combined.get(order_key)
+        if order is None:
+            by_type = self._orders.get((field, item_type, None), ([], []))
+            by_parent = self._orders.get((field, None, parent_id), ([], []))
+            # Filter the smaller order on the other field; it is already sorted
+            if len(by_type[1]) <= len(by_parent[1]):
+                keys, positions, values, wanted = *by_type, self.parents, parent_id
+            else:
+                keys, positions, values, wanted = *by_parent, self.types, item_type
+            matching = [index for index, position in enumerate(positions) if values[position] == wanted]
+            order = ([keys[index] for index in matching], [positions[index] for index in matching])
+            self._combined[order_key] = order
+            if len(self._combined) > _MAX_COMBINED_ORDERS:
+                self._combined.popitem(last=False)
+        else:
+            self._combined.move_to_end(order_key)
+        return order
+
+    def query(self, query: ItemQuery) -> tuple[list[bytes], Optional[str], Optional[int]]:
+        """Return ``(serialized items, next cursor, total matches if known)`` for one page."""
+        field = query.sort.lstrip('-')
+        descending = query.sort.startswith('-')
+        keys, positions = self._ordered(field, query.item_type, query.parent_id)
+        since = query.modified_since
+        modified = self.sort_keys['modified']
+
+        low, high = 0, len(keys)
+        total = None
+        if since is None:
+            total = len(keys)
+        elif field == 'modified':
+            low = bisect_left(keys, (since,))
+            total = high - low
+        if query.after is not None:
+            if descending:
+                high = min(high, bisect_left(keys, query.after))
+            else:
+                low = max(low, bisect_right(keys, query.after))
+
+        page = []
+        indices = range(high - 1, low - 1, -1) if descending else range(low, high)
+        for index in indices:
+            # With a name sort the time filter cannot narrow the range, so it is checked per item
+            if since is not None and field != 'modified' and modified[positions[index]] < since:
+                continue
+            page.append(index)
+            if len(page) == query.limit:
+                break
+
+        next_cursor = None
+        if len(page) == query.limit and page[-1] != indices[-1]:
+            next_cursor = _encode_cursor(query.sort, keys[page[-1]])
+        return [self._encoded(positions[index]) for index in page], next_cursor, total
+
+
+async def get_index(key: tuple, fetched_at: float, body: bytes) -> ItemIndex:
+    """The index of snapshot ``key`` at version ``fetched_at``, building it once per version."""
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == fetched_at:
+        _indexes.move_to_end(key)
+        return cached[1]
+
+    build_key = (key, fetched_at)
+    task = _building.get(build_key)
+    if task is None:
+        task = _building[build_key] = asyncio.create_task(asyncio.to_thread(ItemIndex, body))
+        task.add_done_callback(lambda _: _building.pop(build_key, None))
+    with span('index'):
+        # Shielded so one client disconnecting does not cancel a build others wait on
+        index = await asyncio.shield(task)
+
+    _indexes[key] = (fetched_at, index)
+    _indexes.move_to_end(key)
+    while len(_indexes) > config.ITEM_INDEX_MAX_SNAPSHOTS:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def query_snapshot(key: tuple, snapshot: tuple, query: ItemQuery) -> Response:
+    """Answer ``query`` from a ``load_snapshot`` result, as one page of a JSON array."""
+    cache_status, fetched_at, body, _ = snapshot
+    index = await get_index(key, fetched_at, body)
+    items, next_cursor, total = index.query(query)
+    headers = {'X-Cache': cache_status, 'X-Item-Count': str(len(items))}
+    if total is not None:
+        headers['X-Total-Count'] = str(total)
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+    return Response(content=b'[' + b','.join(items) + b']', media_type='application/json', headers=headers)
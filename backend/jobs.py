@@ -0,0 +1,226 @@
+"""
+Background sync jobs for large ``/integrations/*/load`` requests.
+
+``enqueue_sync_job`` stores the job in Redis and pushes its id onto a
+per-provider queue, so the HTTP request returns at once. Every uvicorn worker
+runs up to ``<PROVIDER>_SYNC_JOB_WORKERS`` jobs per provider: it pops job ids,
+crawls with the provider's ``iter_items_*`` loader and appends serialized items
+to a Redis list in batches. Job state, progress and results live in Redis, so any
+worker can answer status and result requests.
+
+A running job holds a lease that its worker renews every third of
+``SYNC_JOB_LEASE`` seconds. Jobs cancelled at shutdown are marked failed on the
+way out; a job whose worker died without that (killed process, lost host) is
+reported failed once its lease runs out. Failed jobs are not retried: the
+client's credentials are dropped as soon as a worker picks a job up.
+"""
+import asyncio
+import json
+import secrets
+import time
+from typing import AsyncIterator, Callable
+from fastapi import HTTPException
+from config import config
+from accounts import verified_account
+from providers import Provider
+from search_index import index_stream
+
+from redis_client import (
+    set_hash_fields_redis,
+    get_hash_redis,
+    get_hash_field_redis,
+    delete_hash_fields_redis,
+    increment_hash_field_redis,
+    push_values_redis,
+    get_list_range_redis,
+    pop_value_blocking_redis,
+)
+
+_WORKER_STOPPED = 'The worker stopped before the job finished.'
+
+_job_loaders: dict[str, Callable[..., AsyncIterator]] = {}
+_worker_tasks: list[asyncio.Task] = []
+
+
+def register_job_loader(provider: str, iter_items: Callable[..., AsyncIterator]):
+    """Register the ``iter_items_<provider>(credentials, **options)`` generator jobs should run."""
+    _job_loaders[provider] = iter_items
+
+
+def _job_key(job_id: str) -> str:
+    return f'sync_job:{job_id}'
+
+
+def _queue_key(provider: str) -> str:
+    return f'sync_jobs:queue:{provider}'
+
+
+async def enqueue_sync_job(provider: str, credentials: str, options: dict = None, index: bool = False) -> dict:
+    if provider not in _job_loaders:
+        raise HTTPException(status_code=400, detail=f'Background sync is not available for {provider}.')
+    job_id = secrets.token_urlsafe(16)
+    await set_hash_fields_redis(_job_key(job_id), {
+        'provider': provider,
+        'status': 'queued',
+        'items_fetched': 0,
+        'created_at': time.time(),
+        # Removed as soon as a worker picks the job up
+        'credentials': credentials,
+        'options': json.dumps(options or {}),
+        # Set when the job's items should also go into the account's search index
+        'index': '1' if index else '',
+    }, expire=config.SYNC_JOB_TTL)
+    await push_values_redis(_queue_key(provider), [job_id])
+    return {'job_id': job_id, 'status': 'queued'}
+
+
+async def get_job_status(job_id: str) -> dict:
+    job = await get_hash_redis(_job_key(job_id))
+    if not job:
+        raise HTTPException(status_code=404, detail='Job not found.')
+    job = {field.decode('utf-8'): value.decode('utf-8') for field, value in job.items()}
+    status = {
+        'job_id': job_id,
+        'provider': job.get('provider'),
+        'status': job.get('status'),
+        'items_fetched': int(job.get('items_fetched', 0)),
+        'created_at': float(job['created_at']) if job.get('created_at') else None,
+        'started_at': float(job['started_at']) if job.get('started_at') else None,
+        'finished_at': float(job['finished_at']) if job.get('finished_at') else None,
+    }
+    if status['status'] == 'running' and float(job.get('lease_until') or 0) < time.time():
+        status.update(status='failed', finished_at=float(job.get('lease_until') or 0) or None)
+        job['error'] = _WORKER_STOPPED
+        await set_hash_fields_redis(_job_key(job_id), {
+            'status': 'failed', 'error': _WORKER_STOPPED, 'finished_at': status['finished_at'] or time.time(),
+        })
+    if job.get('error'):
+        status['error'] = job['error']
+    return status
+
+
+async def get_job_items(job_id: str, offset: int = 0, limit: int = 100) -> dict:
+    """One page of a completed job's items."""
+    status = await get_job_status(job_id)
+    if status['status'] != 'completed':
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}; results are available once it completes.")
+    values = await get_list_range_redis(f'{_job_key(job_id)}:items', offset, offset + limit - 1)
+    next_offset = offset + len(values)
+    return {
+        'job_id': job_id,
+        'total': status['items_fetched'],
+        'offset': offset,
+        'next_offset': next_offset if next_offset < status['items_fetched'] else None,
+        'items': [json.loads(value) for value in values],
+    }
+
+
+async def _run_logged(job_id: str):
+    try:
+        await run_sync_job(job_id)
+    except Exception as e:
+        # Redis failures while recording state; the job hash expires with SYNC_JOB_TTL
+        print(f'Sync job {job_id} could not be recorded: {e}')
+
+
+async def _flush(job_id: str, batch: list[str]):
+    await push_values_redis(f'{_job_key(job_id)}:items', batch, expire=config.SYNC_JOB_TTL)
+    await increment_hash_field_redis(_job_key(job_id), 'items_fetched', len(batch))
+
+
+async def _renew_lease(key: str):
+    while True:
+        await asyncio.sleep(config.SYNC_JOB_LEASE / 3)
+        try:
+            await set_hash_fields_redis(key, {'lease_until': time.time() + config.SYNC_JOB_LEASE})
+        except Exception as e:
+            print(f'Could not renew the lease of {key}: {e}')
+
+
+async def run_sync_job(job_id: str):
+    key = _job_key(job_id)
+    provider = (await get_hash_field_redis(key, 'provider') or b'').decode('utf-8')
+    credentials = await get_hash_field_redis(key, 'credentials')
+    options = json.loads(await get_hash_field_redis(key, 'options') or '{}')
+    index = bool(await get_hash_field_redis(key, 'index'))
+    if not provider or credentials is None:
+        print(f'Sync job {job_id} expired before it started')
+        return
+
+    await delete_hash_fields_redis(key, 'credentials')
+    await set_hash_fields_redis(key, {
+        'status': 'running', 'started_at': time.time(), 'lease_until': time.time() + config.SYNC_JOB_LEASE,
+    })
+    credentials = credentials.decode('utf-8')
+    batch = []
+    lease = asyncio.create_task(_renew_lease(key))
+    try:
+        items = _job_loaders[provider](credentials, **options)
+        if index:
+            account = await verified_account(provider, credentials)
+            items = index_stream(provider, account, Provider.snapshot_type(options), items)
+        async for item in items:
+            batch.append(json.dumps(item.to_dict()))
+            if len(batch) >= config.SYNC_JOB_BATCH_SIZE:
+                await _flush(job_id, batch)
+                batch = []
+        if batch:
+            await _flush(job_id, batch)
+        await set_hash_fields_redis(key, {'status': 'completed', 'finished_at': time.time()})
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f'Sync job {job_id} ({provider}) failed: {detail}')
+        await set_hash_fields_redis(key, {'status': 'failed', 'error': detail, 'finished_at': time.time()})
+    except asyncio.CancelledError:
+        print(f'Sync job {job_id} ({provider}) interrupted')
+        await set_hash_fields_redis(key, {'status': 'failed', 'error': _WORKER_STOPPED, 'finished_at': time.time()})
+        raise
+    finally:
+        lease.cancel()
+
+
+def _worker_count(provider: str) -> int:
+    return max(1, getattr(config, f'{provider.upper()}_SYNC_JOB_WORKERS', 1))
+
+
+async def _dispatch_jobs(provider: str):
+    """Pop queued jobs for one provider and run up to ``<PROVIDER>_SYNC_JOB_WORKERS`` at a time.
+
+    A single dispatcher per provider keeps just one Redis connection blocked on the queue.
+    """
+    slots = asyncio.Semaphore(_worker_count(provider))
+    running = set()
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                popped = await pop_value_blocking_redis(_queue_key(provider), timeout=1)
+            except Exception as e:
+                slots.release()
+                print(f'{provider} sync job queue unavailable: {e}')
+                await asyncio.sleep(1)
+                continue
+            if popped is None:
+                slots.release()
+                continue
+            task = asyncio.create_task(_run_logged(popped.decode('utf-8')))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        for task in running:
+            task.cancel()
+        # Let cancelled jobs record that they failed before the worker exits
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def start_job_workers():
+    for provider in _job_loaders:
+        _worker_tasks.append(asyncio.create_task(_dispatch_jobs(provider)))
+
+
+async def stop_job_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
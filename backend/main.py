@@ -1,22 +1,68 @@
-from fastapi import FastAPI, Form, Request
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import json
+import secrets
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Form, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from redis.exceptions import RedisError
 from config import config
+from http_client import init_http_client, close_http_client
+from streaming import wants_ndjson, ndjson_response
+from item_cache import get_cache_stats
+from metrics import render_metrics, sample_lines, instrument_load_response, register_collector
+from tracing import start_request_spans, server_timing_header
+from profiler import SamplingProfiler, ProfilerBusyError
+from jobs import register_job_loader, enqueue_sync_job, get_job_status, get_job_items, start_job_workers, stop_job_workers
+from providers import Provider, enabled_providers
+from batch_load import BatchLoadRequest, batch_load_response
+from item_index import ItemQuery, query_snapshot
+from search_index import SearchRequest, index_items, index_stream, search, tokenize
 
-from integrations.airtable import authorize_airtable, get_items_airtable, oauth2callback_airtable, get_airtable_credentials
-from integrations.notion import authorize_notion, get_items_notion, oauth2callback_notion, get_notion_credentials
-from integrations.hubspot import authorize_hubspot, get_hubspot_credentials, get_items_hubspot, oauth2callback_hubspot
-
-# Validate environment on startup
+# Providers without credentials are skipped instead of stopping the app
 print("🔍 Validating environment configuration...")
-try:
-    config.validate_hubspot_credentials()
-    print("✅ HubSpot credentials validated")
-except ValueError as e:
-    print(f"❌ Environment validation failed: {e}")
-    print(f"💡 Please check your .env file and ensure HUBSPOT_CLIENT_ID and HUBSPOT_CLIENT_SECRET are set")
-    raise
+providers = enabled_providers()
+if providers:
+    print(f"✅ Enabled integrations: {', '.join(provider.name for provider in providers)}")
+else:
+    print("❌ No integrations enabled; set the OAuth client credentials in your .env file")
+
+for provider in providers:
+    register_job_loader(provider.name, provider.entry_point('iter_items'))
+
+startup_seconds = None
+
+def _startup_metrics():
+    lines = list(sample_lines(
+        'app_startup_seconds', 'Time from importing main to serving requests.', 'gauge',
+        [({}, startup_seconds)] if startup_seconds is not None else [],
+    ))
+    lines.extend(sample_lines(
+        'provider_import_seconds', 'Time spent importing each integration module on first use.', 'gauge',
+        [({'provider': provider.name}, provider.import_seconds) for provider in providers if provider.import_seconds is not None],
+    ))
+    return lines
+
+register_collector(_startup_metrics)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global startup_seconds
+    await init_http_client()
+    await start_job_workers()
+    startup_seconds = time.perf_counter() - _import_started
+    print(f"🚀 Startup completed in {startup_seconds * 1000:.0f} ms")
+    try:
+        yield
+    finally:
+        await stop_job_workers()
+        await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",  # React app address
@@ -30,59 +76,188 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _is_admin(request: Request) -> bool:
+    token = request.headers.get('x-admin-token')
+    return bool(config.ADMIN_TOKEN and token and secrets.compare_digest(token, config.ADMIN_TOKEN))
+
+async def _profile_request(request: Request, call_next, spans: dict, started: float):
+    """Run the request under the sampling profiler and return collapsed stacks instead of its body."""
+    if not _is_admin(request):
+        return JSONResponse({'detail': 'Profiling requires a valid X-Admin-Token.'}, status_code=403)
+    try:
+        with SamplingProfiler() as profiler:
+            response = await call_next(request)
+            # Drain the body so streaming and serialization are part of the profile
+            async for _ in response.body_iterator:
+                pass
+    except ProfilerBusyError as e:
+        return JSONResponse({'detail': str(e)}, status_code=409)
+    filename = f"profile-{request.url.path.strip('/').replace('/', '-')}-{int(time.time())}.folded"
+    return Response(
+        profiler.collapsed(),
+        media_type='text/plain; charset=utf-8',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Server-Timing': server_timing_header(spans, time.perf_counter() - started),
+            'X-Profiled-Status': str(response.status_code),
+        },
+    )
+
+@app.middleware('http')
+async def instrument_load_requests(request: Request, call_next):
+    """Server-Timing and metrics for /load routes, plus ?profile=true for admins."""
+    if not request.url.path.endswith('/load'):
+        return await call_next(request)
+    started = time.perf_counter()
+    spans = start_request_spans()
+    if request.query_params.get('profile', '').lower() in ('1', 'true', 'yes'):
+        return await _profile_request(request, call_next, spans, started)
+    response = await call_next(request)
+    # Streamed bodies only include the spans taken before the first item
+    response.headers['Server-Timing'] = server_timing_header(spans, time.perf_counter() - started)
+    route = request.scope.get('route')
+    return instrument_load_response(route.path if route is not None else request.url.path, response, started)
+
 @app.get('/')
 def read_root():
     return {'Ping': 'Pong'}
 
+@app.get('/cache/stats')
+async def cache_stats():
+    return await get_cache_stats()
+
+@app.get('/metrics')
+async def metrics():
+    try:
+        stats = await get_cache_stats()
+        cache_lines = sample_lines('items_cache_lookups_total', 'Snapshot cache lookups (all workers).', 'counter', [
+            ({'result': result}, stats[result]) for result in ('hit', 'stale', 'miss', 'bypass')
+        ])
+    except RedisError as e:
+        print(f'Cache stats unavailable for /metrics: {e}')
+        cache_lines = []
+    return Response(render_metrics(cache_lines), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get('/jobs/{job_id}')
+async def sync_job_status(job_id: str):
+    return await get_job_status(job_id)
 
-# Airtable
-@app.post('/integrations/airtable/authorize')
-async def authorize_airtable_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await authorize_airtable(user_id, org_id)
+@app.get('/jobs/{job_id}/items')
+async def sync_job_items(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    return JSONResponse(await get_job_items(job_id, offset=offset, limit=limit))
 
-@app.get('/integrations/airtable/oauth2callback')
-async def oauth2callback_airtable_integration(request: Request):
-    return await oauth2callback_airtable(request)
+@app.post('/search')
+async def search_items(query: SearchRequest):
+    if not tokenize(query.q):
+        raise HTTPException(status_code=400, detail='q must contain at least one letter or digit.')
+    if not query.accounts:
+        raise HTTPException(status_code=400, detail='accounts must not be empty.')
+    enabled = {provider.name: provider for provider in providers}
+    for index, account in enumerate(query.accounts):
+        if account.provider not in enabled:
+            raise HTTPException(status_code=400, detail=f'accounts[{index}]: {account.provider} is not enabled.')
+    # Only indexes of accounts the provider confirms the caller's tokens for are searched
+    verified = await asyncio.gather(*(
+        enabled[account.provider].verified_account(
+            account.credentials if isinstance(account.credentials, str) else json.dumps(account.credentials)
+        )
+        for account in query.accounts
+    ))
+    accounts = [(account.provider, verified_id) for account, verified_id in zip(query.accounts, verified)]
+    items = await search(accounts, query.q, query.item_type, query.provider, query.limit)
+    return JSONResponse({'query': query.q, 'items': items}, headers={'X-Item-Count': str(len(items))})
 
-@app.post('/integrations/airtable/credentials')
-async def get_airtable_credentials_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await get_airtable_credentials(user_id, org_id)
+@app.post('/integrations/load/batch')
+async def batch_load(batch: BatchLoadRequest):
+    return batch_load_response(batch, {provider.name: provider for provider in providers})
 
-@app.post('/integrations/airtable/load')
-async def get_airtable_items(credentials: str = Form(...)):
-    return await get_items_airtable(credentials)
 
 
-# Notion
-@app.post('/integrations/notion/authorize')
-async def authorize_notion_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await authorize_notion(user_id, org_id)
+def register_provider_routes(app: FastAPI, provider: Provider):
+    """Add the authorize, oauth2callback, credentials and load routes of one provider."""
+    name = provider.name
+    prefix = f'/integrations/{name}'
 
-@app.get('/integrations/notion/oauth2callback')
-async def oauth2callback_notion_integration(request: Request):
-    return await oauth2callback_notion(request)
+    async def authorize(user_id: str = Form(...), org_id: str = Form(...)):
+        return await provider.call('authorize', user_id, org_id)
 
-@app.post('/integrations/notion/credentials')
-async def get_notion_credentials_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await get_notion_credentials(user_id, org_id)
+    async def oauth2callback(request: Request):
+        return await provider.call('oauth2callback', request)
 
-@app.post('/integrations/notion/load')
-async def get_notion_items(credentials: str = Form(...)):
-    return await get_items_notion(credentials)
+    async def get_credentials(user_id: str = Form(...), org_id: str = Form(...)):
+        return await provider.call('credentials', user_id, org_id)
 
-# HubSpot
-@app.post('/integrations/hubspot/authorize')
-async def authorize_hubspot_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await authorize_hubspot(user_id, org_id)
+    async def load(
+        request: Request,
+        credentials: str = Form(...),
+        max_items: Optional[int] = Form(None),
+        index: bool = Form(False),
+        stream: bool = Query(False),
+        no_cache: bool = Query(False),
+        incremental: bool = Query(False),
+        full_resync: bool = Query(False),
+        background: bool = Query(False),
+        hierarchy: bool = Query(False),
+        records: bool = Query(False),
+        fields: Optional[list[str]] = Query(None, alias='fields[]'),
+        page_size: Optional[int] = Query(None, ge=1, le=100),
+        depth: Optional[int] = Query(None),
+        item_type: Optional[str] = Query(None, alias='type'),
+        parent_id: Optional[str] = Query(None),
+        modified_since: Optional[str] = Query(None),
+        sort: Optional[str] = Query(None),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = Query(None),
+    ):
+        try:
+            options = provider.load_options(
+                max_items=max_items, hierarchy=hierarchy, records=records, fields=fields, page_size=page_size,
+                depth=depth,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = None
+        if any(value is not None for value in (item_type, parent_id, modified_since, sort, limit, cursor)):
+            if background or incremental or full_resync or wants_ndjson(request, stream):
+                raise HTTPException(status_code=400, detail='Filtering, sorting and paging apply to cached loads only.')
+            try:
+                query = ItemQuery(item_type, parent_id, modified_since, sort or 'name', limit or 100, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        if background:
+            return JSONResponse(await enqueue_sync_job(name, credentials, options, index), status_code=202)
+        if incremental or full_resync:
+            if provider.sync_items is None:
+                raise HTTPException(status_code=400, detail=f'Incremental sync is not supported for {name}.')
+            if options:
+                # A sync always returns the account's whole item set in its own shape
+                raise HTTPException(
+                    status_code=400,
+                    detail='max_items, hierarchy, records, fields[], page_size and depth apply to full loads only.',
+                )
+            account = await provider.verified_account(credentials)
+            items = await provider.call('sync_items', credentials, account, full_resync=full_resync)
+            if index:
+                # A sync returns the account's whole merged item set (and raises if it failed)
+                index_items(name, account, 'sync', items)
+            return JSONResponse(items, headers={'X-Item-Count': str(len(items))})
+        if wants_ndjson(request, stream):
+            items = provider.call('iter_items', credentials, **options)
+            if index:
+                account = await provider.verified_account(credentials)
+                items = index_stream(name, account, provider.snapshot_type(options), items)
+            return await ndjson_response(items)
+        if query is not None:
+            snapshot = await provider.load_snapshot(credentials, options, bypass=no_cache, index=index)
+            key = (name, await provider.verified_account(credentials), provider.snapshot_type(options))
+            return await query_snapshot(key, snapshot, query)
+        return await provider.load_cached(credentials, options, bypass=no_cache, index=index)
 
-@app.get('/integrations/hubspot/oauth2callback')
-async def oauth2callback_hubspot_integration(request: Request):
-    return await oauth2callback_hubspot(request)
+    app.add_api_route(f'{prefix}/authorize', authorize, methods=['POST'], name=f'authorize_{name}_integration')
+    app.add_api_route(f'{prefix}/oauth2callback', oauth2callback, methods=['GET'], name=f'oauth2callback_{name}_integration')
+    app.add_api_route(f'{prefix}/credentials', get_credentials, methods=['POST'], name=f'get_{name}_credentials_integration')
+    app.add_api_route(f'{prefix}/load', load, methods=['POST'], name=f'get_{name}_items')
 
-@app.post('/integrations/hubspot/credentials')
-async def get_hubspot_credentials_integration(user_id: str = Form(...), org_id: str = Form(...)):
-    return await get_hubspot_credentials(user_id, org_id)
 
-@app.post('/integrations/hubspot/load')
-async def get_hubspot_items_integration(credentials: str = Form(...)):
-    return await get_items_hubspot(credentials)
+for provider in providers:
+    register_provider_routes(app, provider)
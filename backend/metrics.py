@@ -0,0 +1,174 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+A deliberately small counter/histogram registry so the backend needs no extra
+dependency. Values are per process: with several uvicorn workers, scrape each
+worker (or run one worker per container) and aggregate in Prometheus.
+"""
+import time
+from typing import Callable, Iterable
+
+# Prometheus client defaults, extended for full-account crawls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REDIS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+ITEM_COUNT_BUCKETS = (0, 10, 100, 1000, 10000, 100000)
+
+_registry = []
+_collectors: list[Callable[[], Iterable[str]]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # labels -> [per-bucket counts (non-cumulative), sum, count]
+        self._values: dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+def sample_lines(name: str, documentation: str, metric_type: str, samples: Iterable[tuple[dict, float]]) -> Iterable[str]:
+    """Exposition lines for values read at scrape time (connection counts, counters kept in Redis)."""
+    yield f'# HELP {name} {documentation}'
+    yield f'# TYPE {name} {metric_type}'
+    for labels, value in samples:
+        names = tuple(labels)
+        yield f'{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}'
+
+
+def register_collector(collector: Callable[[], Iterable[str]]):
+    """Add a callable returning exposition lines computed at scrape time (connection counts etc.)."""
+    _collectors.append(collector)
+
+
+def render_metrics(extra_lines: Iterable[str] = ()) -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+UPSTREAM_REQUESTS = Counter(
+    'upstream_requests_total', 'Upstream API responses by provider, endpoint, method and status code.',
+    ('provider', 'endpoint', 'method', 'status'),
+)
+UPSTREAM_LATENCY = Histogram(
+    'upstream_request_duration_seconds', 'Upstream API request latency (one attempt, excluding rate-limit waits).',
+    ('provider', 'endpoint'),
+)
+UPSTREAM_RETRIES = Counter(
+    'upstream_retries_total', 'Upstream requests retried after a throttled response.',
+    ('provider', 'endpoint', 'status'),
+)
+UPSTREAM_ERRORS = Counter(
+    'upstream_request_errors_total', 'Upstream requests that failed without a response (timeouts, connection errors).',
+    ('provider', 'endpoint', 'error'),
+)
+LOAD_DURATION = Histogram(
+    'load_request_duration_seconds', 'Time to serve a /load request, until the last byte of the body.',
+    ('route', 'status', 'cache'),
+)
+LOAD_ITEMS = Histogram(
+    'load_request_items', 'Items returned per /load request.', ('route',), buckets=ITEM_COUNT_BUCKETS,
+)
+REDIS_LATENCY = Histogram(
+    'redis_operation_duration_seconds', 'Latency of Redis helper operations, including waiting for a pooled connection.',
+    ('operation',), buckets=REDIS_LATENCY_BUCKETS,
+)
+REDIS_ERRORS = Counter('redis_operation_errors_total', 'Redis helper operations that raised.', ('operation',))
+
+
+def instrument_load_response(route: str, response, started: float):
+    """Record duration and item count of a /load response once its body has been sent.
+
+    Item counts come from the ``X-Item-Count`` header, or from the number of
+    lines for NDJSON streams.
+    """
+    body_iterator = response.body_iterator
+    item_count = response.headers.get('x-item-count')
+    count_lines = item_count is None and response.headers.get('content-type', '').startswith('application/x-ndjson')
+
+    async def observed_body():
+        lines = 0
+        try:
+            async for chunk in body_iterator:
+                if count_lines:
+                    lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+                yield chunk
+        finally:
+            LOAD_DURATION.observe(
+                time.perf_counter() - started,
+                route=route, status=response.status_code, cache=response.headers.get('x-cache', 'none'),
+            )
+            if item_count is not None:
+                LOAD_ITEMS.observe(int(item_count), route=route)
+            elif count_lines:
+                LOAD_ITEMS.observe(lines, route=route)
+
+    response.body_iterator = observed_body()
+    return response
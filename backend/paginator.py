@@ -0,0 +1,98 @@
+"""
+Prefetching async pagination shared by the integrations.
+
+``paginate`` drives a provider's ``fetch_page(cursor)`` in a background task
+and yields each page's items to the caller. The next page is requested as
+soon as the previous response is decoded, so the network wait for page N+1
+overlaps with the caller turning page N into IntegrationItems. At most
+``prefetch`` pages (including the request in flight) run ahead of the
+consumer; closing the iterator early cancels the outstanding request.
+
+Supported cursor styles:
+
+- ``'cursor'``: Notion (``has_more`` + ``next_cursor``)
+- ``'offset'``: Airtable (``offset``)
+- ``'after'``:  HubSpot (``paging.next.after``)
+"""
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from config import config
+
+
+def _next_cursor(data: dict) -> Optional[str]:
+    return data.get('next_cursor') if data.get('has_more') else None
+
+
+def _next_offset(data: dict) -> Optional[str]:
+    return data.get('offset')
+
+
+def _next_after(data: dict) -> Optional[str]:
+    return (data.get('paging') or {}).get('next', {}).get('after')
+
+
+PAGINATION_STYLES = {
+    'cursor': _next_cursor,
+    'offset': _next_offset,
+    'after': _next_after,
+}
+
+_DONE = object()
+
+
+async def paginate(
+    fetch_page: Callable[[Optional[str]], Awaitable[dict]],
+    style: str,
+    items_key: str = 'results',
+    prefetch: int = None,
+) -> AsyncIterator[list]:
+    """Yield ``data[items_key]`` for every page, following the ``style`` cursor.
+
+    ``fetch_page(cursor)`` returns the decoded JSON of one page (``cursor`` is
+    ``None`` for the first) and raises on failure; the error is re-raised here
+    after the pages fetched before it have been yielded. ``prefetch`` defaults
+    to PAGINATION_PREFETCH; 0 fetches strictly on demand.
+    """
+    next_cursor = PAGINATION_STYLES[style]
+    prefetch = config.PAGINATION_PREFETCH if prefetch is None else prefetch
+
+    if prefetch <= 0:
+        cursor = None
+        while True:
+            data = await fetch_page(cursor)
+            yield data.get(items_key) or []
+            cursor = next_cursor(data)
+            if not cursor:
+                return
+
+    pages = asyncio.Queue()
+    ahead = asyncio.Semaphore(prefetch)
+
+    async def produce():
+        cursor = None
+        try:
+            while True:
+                await ahead.acquire()
+                data = await fetch_page(cursor)
+                cursor = next_cursor(data)
+                pages.put_nowait(data.get(items_key) or [])
+                if not cursor:
+                    break
+            pages.put_nowait(_DONE)
+        except Exception as e:
+            pages.put_nowait(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            page = await pages.get()
+            if page is _DONE:
+                return
+            if isinstance(page, Exception):
+                raise page
+            # Let the producer request the next page while this one is processed
+            ahead.release()
+            yield page
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
@@ -0,0 +1,67 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A background thread samples the event-loop thread's Python stack every
+``PROFILE_SAMPLE_INTERVAL`` seconds and aggregates the samples as collapsed
+stacks (``frame;frame;frame count`` per line), the input format of
+flamegraph.pl, speedscope and inferno. Because every request shares the event
+loop, samples taken while other requests run are included too; profile on a
+quiet worker for a clean picture. Only one profile runs per process at a time.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+from config import config
+
+MAX_STACK_DEPTH = 128
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Another request is already being profiled in this process."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    filename = os.path.join(*code.co_filename.split(os.sep)[-2:]) if code.co_filename else '?'
+    # ';' separates frames in the collapsed format
+    return f'{name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = None):
+        self.interval = interval or config.PROFILE_SAMPLE_INTERVAL
+        self.samples = Counter()
+        self._target_thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if not _profile_lock.acquire(blocking=False):
+            raise ProfilerBusyError('A profile is already running in this worker')
+        self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        _profile_lock.release()
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format, most frequent stacks first."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
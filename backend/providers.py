@@ -0,0 +1,207 @@
+"""
+Provider registry: declarative metadata for each integration, imported lazily.
+
+``main.py`` registers the routes of every enabled provider from this metadata
+without importing the provider's module; the module is imported on the first
+request that needs it. A provider is enabled when it is listed in
+``ENABLED_PROVIDERS`` and its OAuth client credentials are configured;
+otherwise it is skipped with a warning instead of stopping the app.
+"""
+import hashlib
+import importlib
+import time
+from typing import Callable, Optional
+from fastapi.responses import Response
+from config import config
+from accounts import verified_account
+from item_cache import load_snapshot, snapshot_response
+from search_index import index_snapshot
+
+
+class Provider:
+    """Where a provider's entry points live and which /load options it supports."""
+
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        validate_credentials: Callable[[], bool],
+        authorize: str,
+        oauth2callback: str,
+        credentials: str,
+        get_items: str,
+        iter_items: str,
+        sync_items: Optional[str] = None,
+        supports_max_items: bool = False,
+        supports_hierarchy: bool = False,
+        supports_records: bool = False,
+        max_depth: Optional[int] = None,
+    ):
+        self.name = name
+        self.module_name = module
+        self.validate_credentials = validate_credentials
+        self.authorize = authorize
+        self.oauth2callback = oauth2callback
+        self.credentials = credentials
+        self.get_items = get_items
+        self.iter_items = iter_items
+        self.sync_items = sync_items
+        self.supports_max_items = supports_max_items
+        self.supports_hierarchy = supports_hierarchy
+        self.supports_records = supports_records
+        # Deepest block tree a load may expand; None if the provider has no depth option
+        self.max_depth = max_depth
+        self.import_seconds = None
+        self._module = None
+
+    def module(self):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self.module_name)
+            self.import_seconds = time.perf_counter() - started
+            print(f'Loaded {self.name} integration in {self.import_seconds * 1000:.0f} ms')
+        return self._module
+
+    def call(self, entry_point: str, *args, **kwargs):
+        """Call one of the provider's entry points (``'authorize'``, ``'iter_items'``, ...) by role."""
+        return getattr(self.module(), getattr(self, entry_point))(*args, **kwargs)
+
+    def entry_point(self, entry_point: str) -> Callable:
+        """A callable that imports the module on first use, for registering with other subsystems."""
+        return lambda *args, **kwargs: self.call(entry_point, *args, **kwargs)
+
+    async def verified_account(self, credentials: str) -> str:
+        """The account ``credentials`` belong to, as confirmed by the provider (see ``accounts.verified_account``)."""
+        # Importing the module registers its account verifier
+        self.module()
+        return await verified_account(self.name, credentials)
+
+    def load_options(
+        self,
+        max_items: Optional[int] = None,
+        hierarchy: bool = False,
+        records: bool = False,
+        fields: Optional[list[str]] = None,
+        page_size: Optional[int] = None,
+        depth: Optional[int] = None,
+    ) -> dict:
+        """Keyword options for the ``get_items``/``iter_items`` entry points; ValueError if one is unsupported."""
+        options = {}
+        if max_items is not None:
+            if not self.supports_max_items:
+                raise ValueError(f'max_items is not supported for {self.name}.')
+            options['max_items'] = max_items
+        if hierarchy:
+            if not self.supports_hierarchy:
+                raise ValueError(f'hierarchy is not supported for {self.name}.')
+            options['hierarchy'] = True
+        if records:
+            if not self.supports_records:
+                raise ValueError(f'records is not supported for {self.name}.')
+            options['records'] = True
+        if fields or page_size is not None:
+            if not records:
+                raise ValueError('fields[] and page_size only apply with records=true.')
+            if fields:
+                options['fields'] = list(fields)
+            if page_size is not None:
+                options['page_size'] = page_size
+        if depth is not None:
+            if self.max_depth is None:
+                raise ValueError(f'depth is not supported for {self.name}.')
+            if not 1 <= depth <= self.max_depth:
+                raise ValueError(f'depth must be between 1 and {self.max_depth}.')
+            options['depth'] = depth
+        return options
+
+    @staticmethod
+    def snapshot_type(options: dict) -> str:
+        """The snapshot cache ``object_type`` for a load with ``options``."""
+        object_type = 'all'
+        if options.get('max_items') is not None:
+            object_type += f"-max{options['max_items']}"
+        if options.get('hierarchy'):
+            object_type += '-hierarchy'
+        if options.get('records'):
+            # Page size does not change the result; the projection names the records
+            object_type += '-records'
+            if options.get('fields'):
+                object_type += '-' + hashlib.sha256('\n'.join(options['fields']).encode('utf-8')).hexdigest()[:16]
+        if options.get('depth'):
+            object_type += f"-depth{options['depth']}"
+        return object_type
+
+    async def load_cached(
+        self, credentials: str, options: dict, bypass: bool = False, index: bool = False,
+    ) -> Response:
+        """Load one account's items through the snapshot cache (see ``item_cache.load_with_cache``)."""
+        return snapshot_response(await self.load_snapshot(credentials, options, bypass, index))
+
+    async def load_snapshot(
+        self, credentials: str, options: dict, bypass: bool = False, index: bool = False,
+    ):
+        """Like ``load_cached``, but returns ``item_cache.load_snapshot``'s tuple instead of a response.
+
+        With ``index``, the snapshot is also added to the verified account's
+        search index in the background if the index does not have this version yet.
+        """
+        account = await self.verified_account(credentials)
+        object_type = self.snapshot_type(options)
+        snapshot = await load_snapshot(
+            self.name, account, lambda: self.call('get_items', credentials, **options),
+            object_type=object_type, bypass=bypass,
+        )
+        if index:
+            _, fetched_at, body, _ = snapshot
+            index_snapshot(self.name, account, object_type, fetched_at, body)
+        return snapshot
+
+
+PROVIDERS = (
+    Provider(
+        'airtable', 'integrations.airtable', config.validate_airtable_credentials,
+        authorize='authorize_airtable',
+        oauth2callback='oauth2callback_airtable',
+        credentials='get_airtable_credentials',
+        get_items='get_items_airtable',
+        iter_items='iter_items_airtable',
+        supports_records=True,
+    ),
+    Provider(
+        'notion', 'integrations.notion', config.validate_notion_credentials,
+        authorize='authorize_notion',
+        oauth2callback='oauth2callback_notion',
+        credentials='get_notion_credentials',
+        get_items='get_items_notion',
+        iter_items='iter_items_notion',
+        sync_items='sync_items_notion',
+        max_depth=config.NOTION_BLOCK_MAX_DEPTH,
+    ),
+    Provider(
+        'hubspot', 'integrations.hubspot', config.validate_hubspot_credentials,
+        authorize='authorize_hubspot',
+        oauth2callback='oauth2callback_hubspot',
+        credentials='get_hubspot_credentials',
+        get_items='get_items_hubspot',
+        iter_items='iter_items_hubspot',
+        sync_items='sync_items_hubspot',
+        supports_max_items=True,
+        supports_hierarchy=True,
+    ),
+)
+
+
+def enabled_providers() -> list[Provider]:
+    """Providers that are listed in ENABLED_PROVIDERS and have credentials configured."""
+    enabled = []
+    for provider in PROVIDERS:
+        if config.ENABLED_PROVIDERS is not None and provider.name not in config.ENABLED_PROVIDERS:
+            print(f'⏭️  {provider.name} disabled (not in ENABLED_PROVIDERS)')
+            continue
+        try:
+            provider.validate_credentials()
+        except ValueError as e:
+            print(f'⚠️  Skipping {provider.name}: {e}')
+            continue
+        enabled.append(provider)
+    return enabled
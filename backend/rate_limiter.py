@@ -0,0 +1,182 @@
+"""
+Redis-backed token-bucket rate limiting for upstream API calls.
+
+Every data call to HubSpot, Airtable and Notion goes through
+``rate_limited_request``. Buckets live in Redis so all uvicorn workers share
+one budget per provider and account; callers name buckets by the account
+``accounts.verified_account`` confirmed, never by ids taken from a client's
+credentials, so one client cannot drain another account's budget. A 429
+blocks the bucket for the ``Retry-After`` period for every worker, and the
+request is retried after a jittered delay.
+"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import httpx
+from config import config
+from http_client import get_http_client
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_LATENCY, UPSTREAM_RETRIES, UPSTREAM_ERRORS
+from tracing import span, record_span
+
+from redis_client import run_script_redis, add_key_value_ms_redis
+
+# Consumes one token from every bucket if all of them have one; otherwise
+# consumes nothing and returns how many milliseconds to wait.
+# KEYS: bucket1, blocked1, bucket2, blocked2, ...   ARGV: rate1, burst1, rate2, burst2, ...
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local n = #KEYS / 2
+local wait = 0
+local tokens = {}
+for i = 1, n do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local blocked = redis.call('PTTL', KEYS[2 * i])
+    if blocked > wait then wait = blocked end
+    local state = redis.call('HMGET', KEYS[2 * i - 1], 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - ts) * rate / 1000)
+    if available < 1 then
+        local needed = math.ceil((1 - available) * 1000 / rate)
+        if needed > wait then wait = needed end
+    end
+    tokens[i] = available
+end
+if wait == 0 then
+    for i = 1, n do
+        local rate = tonumber(ARGV[2 * i - 1])
+        local burst = tonumber(ARGV[2 * i])
+        redis.call('HSET', KEYS[2 * i - 1], 'tokens', tokens[i] - 1, 'ts', now)
+        redis.call('PEXPIRE', KEYS[2 * i - 1], math.ceil(burst * 1000 / rate) + 1000)
+    end
+end
+return wait
+"""
+
+RETRYABLE_STATUS_CODES = (429, 503)
+
+
+def bucket_limits(bucket: str) -> tuple[float, float]:
+    """(requests per second, burst) for a bucket, defaulting to each API's published limits."""
+    limits = {
+        # HubSpot: 100 requests per 10 seconds per account (OAuth apps)
+        'hubspot': (config.HUBSPOT_RATE_LIMIT, config.HUBSPOT_RATE_BURST),
+        # HubSpot CRM search: 5 requests per second per account
+        'hubspot_search': (config.HUBSPOT_SEARCH_RATE_LIMIT, config.HUBSPOT_SEARCH_RATE_LIMIT),
+        # Airtable: 5 requests per second per base, 50 per second per access token
+        'airtable_base': (config.AIRTABLE_REQUESTS_PER_SECOND, config.AIRTABLE_REQUESTS_PER_SECOND),
+        'airtable': (config.AIRTABLE_TOKEN_RATE_LIMIT, config.AIRTABLE_TOKEN_RATE_LIMIT),
+        # Notion: an average of 3 requests per second per integration, short bursts allowed
+        'notion': (config.NOTION_RATE_LIMIT, config.NOTION_RATE_BURST),
+    }
+    return limits[bucket]
+
+
+def _bucket_keys(bucket: str, account: str) -> tuple[str, str]:
+    return f'ratelimit:{bucket}:{account}', f'ratelimit:{bucket}:{account}:blocked'
+
+
+async def acquire(buckets: list[tuple[str, str]]):
+    """Wait until one token is available in every ``(bucket, account)`` bucket, then take it.
+
+    Fails open: if Redis is unreachable the request proceeds unthrottled.
+    """
+    keys, args = [], []
+    for bucket, account in buckets:
+        keys.extend(_bucket_keys(bucket, account))
+        args.extend(bucket_limits(bucket))
+
+    while True:
+        try:
+            wait_ms = await run_script_redis(TOKEN_BUCKET_SCRIPT, keys, args)
+        except Exception as e:
+            print(f'Rate limiter unavailable, proceeding without it: {e}')
+            return
+        if not wait_ms:
+            return
+        # Jitter so workers waiting on the same bucket do not wake in lockstep
+        await asyncio.sleep(wait_ms / 1000 * random.uniform(1.0, 1.2))
+
+
+def _retry_after_seconds(response) -> float | None:
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(response, attempt: int) -> float:
+    """Seconds to wait before retrying a throttled response.
+
+    Honors ``Retry-After`` (plus up to 20% jitter); otherwise uses capped
+    exponential backoff with full jitter.
+    """
+    retry_after = _retry_after_seconds(response)
+    if retry_after is not None:
+        return retry_after * random.uniform(1.0, 1.2)
+    ceiling = min(config.RATE_LIMIT_MAX_BACKOFF, config.RATE_LIMIT_BASE_BACKOFF * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+async def _block(bucket: str, account: str, seconds: float):
+    """Make every worker hold off this bucket after a 429."""
+    _, blocked_key = _bucket_keys(bucket, account)
+    try:
+        await add_key_value_ms_redis(blocked_key, '1', max(1, int(seconds * 1000)))
+    except Exception as e:
+        print(f'Failed to record rate limit block for {bucket}: {e}')
+
+
+async def rate_limited_request(buckets: list[tuple[str, str]], method: str, url: str, endpoint: str = None, **kwargs):
+    """Send a request through the shared client once every bucket has a token.
+
+    ``buckets`` are ordered from the broadest to the most specific limit; a
+    throttled response (429, or 503 with Retry-After) blocks the most specific
+    one for every worker and is retried up to RATE_LIMIT_MAX_RETRIES times.
+    The last response is returned either way.
+
+    ``endpoint`` labels the request in /metrics; pass a template for URLs that
+    embed ids (it defaults to the URL path).
+    """
+    client = get_http_client()
+    provider = buckets[0][0].split('_')[0]
+    endpoint = endpoint or urlsplit(url).path
+    attempt = 0
+    while True:
+        with span('ratelimit'):
+            await acquire(buckets)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            UPSTREAM_ERRORS.inc(provider=provider, endpoint=endpoint, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_LATENCY.observe(elapsed, provider=provider, endpoint=endpoint)
+            record_span('upstream', elapsed)
+        UPSTREAM_REQUESTS.inc(provider=provider, endpoint=endpoint, method=method, status=response.status_code)
+        throttled = response.status_code == 429 or (
+            response.status_code in RETRYABLE_STATUS_CODES and 'retry-after' in response.headers
+        )
+        if not throttled or attempt >= config.RATE_LIMIT_MAX_RETRIES:
+            return response
+
+        delay = retry_delay(response, attempt)
+        print(f'{buckets[-1][0]} throttled ({response.status_code}); retrying in {delay:.2f}s')
+        UPSTREAM_RETRIES.inc(provider=provider, endpoint=endpoint, status=response.status_code)
+        await _block(*buckets[-1], delay)
+        with span('retry_wait'):
+            await asyncio.sleep(delay)
+        attempt += 1
@@ -1,18 +1,218 @@
+import functools
 import os
+import time
 import redis.asyncio as redis
 from kombu.utils.url import safequote
 from config import config
+from metrics import REDIS_LATENCY, REDIS_ERRORS, register_collector, sample_lines
+from tracing import record_span
 
 redis_host = safequote(config.REDIS_HOST)
-redis_client = redis.Redis(host=redis_host, port=config.REDIS_PORT, db=config.REDIS_DB)
 
+
+class _CountingPool(redis.BlockingConnectionPool):
+    """Counts connections checked out and callers waiting for one, for /metrics.
+
+    Counted around the public ``get_connection``/``release`` instead of reading
+    the pool's private connection lists.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.checked_out = set()
+
+    async def get_connection(self, *args, **kwargs):
+        self.waiting += 1
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        finally:
+            self.waiting -= 1
+        self.checked_out.add(id(connection))
+        return connection
+
+    async def release(self, connection):
+        # Also called for connections that failed their check inside get_connection
+        self.checked_out.discard(id(connection))
+        await super().release(connection)
+
+
+# Blocking pool: when every connection is busy, callers wait up to
+# REDIS_POOL_TIMEOUT for one instead of failing immediately.
+redis_pool = _CountingPool(
+    host=redis_host,
+    port=config.REDIS_PORT,
+    db=config.REDIS_DB,
+    max_connections=config.REDIS_MAX_CONNECTIONS,
+    timeout=config.REDIS_POOL_TIMEOUT,
+    socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+def _pool_metrics():
+    return sample_lines('redis_pool_connections', 'Redis connections checked out, callers waiting for one, and the pool size.', 'gauge', [
+        ({'state': 'in_use'}, len(redis_pool.checked_out)),
+        ({'state': 'waiting'}, redis_pool.waiting),
+        ({'state': 'max'}, redis_pool.max_connections),
+    ])
+
+register_collector(_pool_metrics)
+
+
+def _timed(func):
+    """Record latency (including the wait for a pooled connection) and errors per helper.
+
+    Timed helpers must not call each other, or the inner call is counted twice.
+    """
+    operation = func.__name__.removesuffix('_redis')
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            REDIS_ERRORS.inc(operation=operation)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            REDIS_LATENCY.observe(elapsed, operation=operation)
+            record_span('redis', elapsed)
+    return wrapper
+
+# Verifies the OAuth state stored at KEYS[1] against ARGV[1] and, on a match,
+# deletes it and GETDELs every other key, all in one round trip.
+# Returns {'ok', value2, value3, ...} or false.
+CONSUME_OAUTH_STATE_SCRIPT = """
+local saved = redis.call('GET', KEYS[1])
+if not saved then return false end
+local ok, decoded = pcall(cjson.decode, saved)
+if not ok or type(decoded) ~= 'table' or decoded['state'] ~= ARGV[1] then return false end
+redis.call('DEL', KEYS[1])
+local result = {'ok'}
+for i = 2, #KEYS do
+    result[i] = redis.call('GETDEL', KEYS[i])
+end
+return result
+"""
+
+_scripts = {}
+
+async def _run_script(script, keys, args):
+    registered = _scripts.get(script)
+    if registered is None or registered.registered_client is not redis_client:
+        registered = _scripts[script] = redis_client.register_script(script)
+    return await registered(keys=list(keys), args=list(args))
+
+@_timed
 async def add_key_value_redis(key, value, expire=None):
-    await redis_client.set(key, value)
-    if expire:
-        await redis_client.expire(key, expire)
+    """SET with the expiry applied atomically (no window without a TTL)."""
+    await redis_client.set(key, value, ex=expire)
 
+@_timed
+async def add_key_values_redis(mapping, expire=None):
+    """SET several keys, each with the same expiry, in one pipelined round trip."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=expire)
+        await pipe.execute()
+
+@_timed
+async def consume_value_redis(key):
+    """Read a key and delete it in one command (GETDEL)."""
+    return await redis_client.getdel(key)
+
+@_timed
+async def consume_oauth_state_redis(state_key, expected_state, *other_keys):
+    """Verify and consume an OAuth state plus any companion keys in one round trip.
+
+    Returns the values of ``other_keys`` (``None`` for missing ones) if the
+    stored state matches, else ``None``; a mismatched state is left untouched.
+    """
+    # Not through run_script_redis: only the outermost helper is timed
+    result = await _run_script(CONSUME_OAUTH_STATE_SCRIPT, [state_key, *other_keys], [expected_state or ''])
+    if not result:
+        return None
+    return list(result[1:]) + [None] * (len(other_keys) - len(result) + 1)
+
+@_timed
+async def add_key_value_ms_redis(key, value, expire_ms):
+    await redis_client.set(key, value, px=expire_ms)
+
+@_timed
 async def get_value_redis(key):
     return await redis_client.get(key)
 
+@_timed
+async def get_values_redis(*keys):
+    """MGET; ``None`` for missing keys."""
+    return await redis_client.mget(keys)
+
+@_timed
 async def delete_key_redis(key):
     await redis_client.delete(key)
+
+@_timed
+async def add_key_value_if_absent_redis(key, value, expire=None):
+    """SET NX; returns True if the key was set."""
+    return bool(await redis_client.set(key, value, ex=expire, nx=True))
+
+@_timed
+async def increment_hash_field_redis(key, field, amount=1):
+    return await redis_client.hincrby(key, field, amount)
+
+@_timed
+async def get_hash_redis(key):
+    return await redis_client.hgetall(key)
+
+@_timed
+async def get_hash_field_redis(key, field):
+    return await redis_client.hget(key, field)
+
+@_timed
+async def set_hash_fields_redis(key, mapping, expire=None):
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=mapping)
+        if expire:
+            pipe.expire(key, expire)
+        await pipe.execute()
+
+@_timed
+async def delete_hash_fields_redis(key, *fields):
+    await redis_client.hdel(key, *fields)
+
+@_timed
+async def replace_hash_redis(key, mapping, expire=None):
+    """Atomically replace the whole hash with ``mapping``."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=mapping)
+        if expire:
+            pipe.expire(key, expire)
+        await pipe.execute()
+
+@_timed
+async def push_values_redis(key, values, expire=None):
+    """RPUSH ``values`` and refresh the list's expiry in one round trip."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(key, *values)
+        if expire:
+            pipe.expire(key, expire)
+        await pipe.execute()
+
+@_timed
+async def get_list_range_redis(key, start, end):
+    return await redis_client.lrange(key, start, end)
+
+async def pop_value_blocking_redis(key, timeout):
+    """BLPOP one value, waiting up to ``timeout`` seconds (keep it below REDIS_SOCKET_TIMEOUT)."""
+    popped = await redis_client.blpop([key], timeout=timeout)
+    return popped[1] if popped else None
+
+@_timed
+async def run_script_redis(script, keys=(), args=()):
+    """Run a Lua script via EVALSHA, loading it on first use."""
+    return await _run_script(script, keys, args)
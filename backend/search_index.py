@@ -0,0 +1,530 @@
+"""
+Name search across the accounts a caller can prove it holds.
+
+Every verified account (see ``accounts.verified_account``) has its own index.
+Loads made with ``index=true`` feed the items they produce into a
+``SegmentBuilder``; a finished load of one snapshot type becomes one immutable
+segment of the account's index, replacing the segment of the previous load.
+A query names the accounts to search by their credentials, so nobody can read
+or write the index of an account they do not hold a token for. A segment keeps its items sorted by name
+and, for every item type and for all types together, a sorted dictionary of
+the words in item names with two posting lists per word: items whose name
+starts with the word, then items that contain it later on. A prefix query
+binary-searches the dictionary and walks the postings of the matching words
+in order, so results come out ranked (name starts with the prefix, then by
+matching word, then by name) without scoring every match; segments are merged
+lazily until ``limit`` results are found.
+
+Segments are stored zlib-compressed in Redis, postings as packed uint32
+arrays, with a per-account hash of segment versions, so the index survives
+restarts and is shared by all workers. Each worker keeps the decoded segments
+of ``SEARCH_INDEX_MAX_ACCOUNTS`` accounts and reloads a segment only when its
+version changes.
+"""
+import asyncio
+import heapq
+import json
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from typing import AsyncIterator, Iterable, Iterator, Optional, Union
+from pydantic import BaseModel, Field
+from config import config
+from metrics import Counter, Histogram
+from tracing import span
+
+from redis_client import (
+    get_hash_redis,
+    get_hash_field_redis,
+    get_values_redis,
+    run_script_redis,
+)
+
+SEARCH_DURATION = Histogram(
+    'search_query_duration_seconds', 'Time to answer a /search query, including loading changed segments.',
+)
+SEARCH_SEGMENTS_INDEXED = Counter(
+    'search_index_segments_total', 'Search index segments written, by provider.', ('provider',),
+)
+
+_WORD = re.compile(r'\w+')
+# Sorts after every character that can follow a prefix, bounding a prefix's range of words
+_MAX_CHAR = '\U0010ffff'
+_ALL_TYPES = None
+# Ranking a match directly (splitting its name) costs about this many posting steps
+_RANKING_COST = 10
+_FORMAT = 1
+
+# Only writes a segment if it is newer than the stored one
+STORE_SEGMENT_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current and tonumber(current) >= tonumber(ARGV[2]) then return 0 end
+redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# (provider, account) -> {object type: (version, decoded Segment or None if not loaded yet)}
+_indexes: OrderedDict = OrderedDict()
+_decoding: dict[tuple, asyncio.Task] = {}
+# Keep references to background index writes so they are not garbage collected mid-flight
+_background_writes = set()
+
+
+class SearchAccount(BaseModel):
+    provider: str
+    # The same JSON credentials /load takes; the account is whatever the provider verifies them as
+    credentials: Union[str, dict]
+
+
+class SearchRequest(BaseModel):
+    accounts: list[SearchAccount]
+    q: str
+    item_type: Optional[str] = Field(None, alias='type')
+    provider: Optional[str] = None
+    limit: int = Field(20, ge=1, le=100)
+
+
+def tokenize(text: str) -> list[str]:
+    """Case-folded words of ``text``; both names and queries are split this way."""
+    return _WORD.findall((text or '').casefold())
+
+
+def _versions_key(provider: str, account: str) -> str:
+    return f'search_index:{provider}:{account}:segments'
+
+
+def _segment_key(provider: str, account: str, object_type: str) -> str:
+    return f'search_index:{provider}:{account}:segment:{object_type}'
+
+
+def _packed(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpacked(typecode: str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _flatten(words: list[str], postings: dict[str, list[int]]) -> tuple[array, array]:
+    offsets, flat, empty = array('I', [0]), array('I'), ()
+    for word in words:
+        flat.extend(postings.get(word, empty))
+        offsets.append(len(flat))
+    return offsets, flat
+
+
+class _Postings:
+    """Word dictionary and posting lists of one item type (or of all types)."""
+
+    __slots__ = ('words', 'first_offsets', 'first', 'later_offsets', 'later')
+
+    @classmethod
+    def build(cls, first: dict[str, list[int]], later: dict[str, list[int]]) -> '_Postings':
+        postings = cls()
+        postings.words = sorted(first.keys() | later.keys())
+        postings.first_offsets, postings.first = _flatten(postings.words, first)
+        postings.later_offsets, postings.later = _flatten(postings.words, later)
+        return postings
+
+    def word_range(self, prefix: str) -> tuple[int, int]:
+        low = bisect_left(self.words, prefix)
+        return low, bisect_left(self.words, prefix + _MAX_CHAR, low)
+
+    def match_count(self, low: int, high: int) -> int:
+        """Postings (not distinct items) for the words in ``[low, high)``; O(1)."""
+        return (self.first_offsets[high] - self.first_offsets[low]) + (self.later_offsets[high] - self.later_offsets[low])
+
+    def items(self, low: int, high: int, within: Optional[set] = None) -> set:
+        """Ranks of the items with a word in ``[low, high)``, optionally only those ``within`` a set."""
+        first = self.first[self.first_offsets[low]:self.first_offsets[high]]
+        later = self.later[self.later_offsets[low]:self.later_offsets[high]]
+        if within is None:
+            items = set(first)
+            items.update(later)
+            return items
+        return within.intersection(first) | within.intersection(later)
+
+    def matches(self, low: int, high: int) -> Iterator[tuple[int, str, int]]:
+        """``(tier, word, rank)`` for the words in ``[low, high)``, best first; an item can repeat."""
+        for tier, offsets, flat in ((0, self.first_offsets, self.first), (1, self.later_offsets, self.later)):
+            for position in range(low, high):
+                start, end = offsets[position], offsets[position + 1]
+                if start == end:
+                    continue
+                word = self.words[position]
+                for rank in flat[start:end]:
+                    yield tier, word, rank
+
+
+class Segment:
+    """The searchable items of one load of one account."""
+
+    __slots__ = ('provider', 'account', 'ids', 'names', 'types', 'parents', 'postings')
+
+    def __init__(self, provider: str, account: str):
+        self.provider = provider
+        self.account = account
+        self.postings: dict[Optional[str], _Postings] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def item(self, rank: int) -> dict:
+        return {
+            'provider': self.provider,
+            'account': self.account,
+            'id': self.ids[rank],
+            'name': self.names[rank],
+            'type': self.types[rank] or None,
+            'parent_id': self.parents[rank],
+        }
+
+    def _key(self, tier: int, word: str, rank: int) -> tuple:
+        # Comparable across segments: rank order within a segment is (folded name, id)
+        return tier, word, self.names[rank].casefold(), self.ids[rank]
+
+    def search(
+        self, tokens: list[str], item_type: Optional[str] = _ALL_TYPES, limit: int = 20,
+    ) -> Iterator[tuple[tuple, int]]:
+        """Yield ``(sort key, rank)`` for items matching every token as a word prefix, best first.
+
+        Items are ranked by where the first token matches. A single token is
+        answered by walking its postings in order. With several, the items
+        matching all tokens are found by set intersections (smallest first),
+        then either the first token's postings are walked, skipping other
+        items, or the matches are ranked directly, whichever is expected to
+        touch fewer items before ``limit`` results.
+        """
+        postings = self.postings.get(item_type)
+        if postings is None:
+            return
+        ranges = [postings.word_range(token) for token in tokens]
+        if len(tokens) == 1:
+            for tier, word, rank in postings.matches(*ranges[0]):
+                yield self._key(tier, word, rank), rank
+            return
+
+        ordered = sorted(ranges, key=lambda word_range: postings.match_count(*word_range))
+        matching = postings.items(*ordered[0])
+        for word_range in ordered[1:]:
+            if not matching:
+                return
+            matching = postings.items(*word_range, within=matching)
+        if not matching:
+            return
+
+        walk = postings.match_count(*ranges[0])
+        if walk * min(1.0, limit / len(matching)) <= len(matching) * _RANKING_COST:
+            for tier, word, rank in postings.matches(*ranges[0]):
+                if rank in matching:
+                    yield self._key(tier, word, rank), rank
+            return
+        keyed = []
+        for rank in matching:
+            words = tokenize(self.names[rank])
+            if words[0].startswith(tokens[0]):
+                keyed.append((self._key(0, words[0], rank), rank))
+            else:
+                keyed.append((self._key(1, min(word for word in words[1:] if word.startswith(tokens[0])), rank), rank))
+        keyed.sort()
+        yield from keyed
+
+    def encode(self) -> bytes:
+        """Serialize for Redis: a JSON header with the strings, then packed arrays, zlib-compressed."""
+        type_names = list(dict.fromkeys(self.types))
+        codes = {item_type: code for code, item_type in enumerate(type_names)}
+        arrays = [array('I', (codes[item_type] for item_type in self.types))]
+        postings = []
+        for item_type, entry in self.postings.items():
+            postings.append([item_type, entry.words, len(entry.first), len(entry.later)])
+            arrays += [entry.first_offsets, entry.first, entry.later_offsets, entry.later]
+        header = json.dumps({
+            'format': _FORMAT,
+            'provider': self.provider,
+            'account': self.account,
+            'ids': self.ids,
+            'names': self.names,
+            'parents': self.parents,
+            'types': type_names,
+            'postings': postings,
+        }, separators=(',', ':')).encode('utf-8')
+        return zlib.compress(struct.pack('<I', len(header)) + header + b''.join(_packed(values) for values in arrays))
+
+    @classmethod
+    def decode(cls, blob: bytes) -> 'Segment':
+        data = memoryview(zlib.decompress(blob))
+        (header_length,) = struct.unpack_from('<I', data)
+        position = 4 + header_length
+        header = json.loads(bytes(data[4:position]))
+        if header.get('format') != _FORMAT:
+            raise ValueError(f"Unsupported search segment format {header.get('format')}")
+
+        def take(length: int) -> array:
+            nonlocal position
+            end = position + length * 4
+            values = _unpacked('I', data[position:end])
+            position = end
+            return values
+
+        segment = cls(header['provider'], header['account'])
+        segment.ids, segment.names, segment.parents = header['ids'], header['names'], header['parents']
+        type_names = header['types']
+        segment.types = [type_names[code] for code in take(len(segment.ids))]
+        for item_type, words, first_count, later_count in header['postings']:
+            entry = _Postings()
+            entry.words = words
+            entry.first_offsets, entry.first = take(len(words) + 1), take(first_count)
+            entry.later_offsets, entry.later = take(len(words) + 1), take(later_count)
+            segment.postings[item_type] = entry
+        return segment
+
+
+class SegmentBuilder:
+    """Collects the items of one load; names are split into words as items arrive."""
+
+    def __init__(self):
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, item_id, name, item_type, parent_id=None):
+        name = name or ''
+        folded = name.casefold()
+        self._rows.append((folded, item_id or '', name, item_type or '', parent_id, _WORD.findall(folded)))
+
+    def add_dicts(self, items: Iterable[dict]):
+        for item in items:
+            self.add(item.get('id'), item.get('name'), item.get('type'), item.get('parent_id'))
+
+    def build(self, provider: str, account: str) -> Segment:
+        rows = sorted(self._rows, key=lambda row: (row[0], row[1]))
+        segment = Segment(provider, account)
+        segment.ids = [row[1] for row in rows]
+        segment.names = [row[2] for row in rows]
+        segment.types = [row[3] for row in rows]
+        segment.parents = [row[4] for row in rows]
+        # (first-word postings, later-word postings) for all types and per type;
+        # ranks ascend, so every posting list comes out sorted by name
+        lists = {_ALL_TYPES: (defaultdict(list), defaultdict(list))}
+        for rank, row in enumerate(rows):
+            words = row[5]
+            if not words:
+                continue
+            head = words[0]
+            later = [word for word in dict.fromkeys(words[1:]) if word != head]
+            type_lists = lists.get(row[3])
+            if type_lists is None:
+                type_lists = lists[row[3]] = (defaultdict(list), defaultdict(list))
+            for first_lists, later_lists in (lists[_ALL_TYPES], type_lists):
+                first_lists[head].append(rank)
+                for word in later:
+                    later_lists[word].append(rank)
+        for item_type, (first_lists, later_lists) in lists.items():
+            segment.postings[item_type] = _Postings.build(first_lists, later_lists)
+        return segment
+
+
+def _evict():
+    while len(_indexes) > config.SEARCH_INDEX_MAX_ACCOUNTS:
+        _indexes.popitem(last=False)
+
+
+def _remember(provider: str, account: str, object_type: str, version: float, segment: Optional[Segment]):
+    index = (provider, account)
+    segments = _indexes.setdefault(index, {})
+    current = segments.get(object_type)
+    if current is None or current[0] < version or (current[0] == version and current[1] is None):
+        segments[object_type] = (version, segment)
+    _indexes.move_to_end(index)
+    _evict()
+
+
+async def _write_segment(provider: str, account: str, object_type: str, version: float, builder: SegmentBuilder):
+    def build():
+        segment = builder.build(provider, account)
+        return segment, segment.encode()
+
+    segment, blob = await asyncio.to_thread(build)
+    stored = await run_script_redis(
+        STORE_SEGMENT_SCRIPT, [_versions_key(provider, account), _segment_key(provider, account, object_type)],
+        [object_type, repr(version), blob, config.SEARCH_INDEX_TTL],
+    )
+    if stored:
+        SEARCH_SEGMENTS_INDEXED.inc(provider=provider)
+        _remember(provider, account, object_type, version, segment)
+
+
+def _in_background(description: str, coroutine):
+    async def run():
+        try:
+            await coroutine
+        except Exception as e:
+            print(f'Search indexing of {description} failed: {e!r}')
+
+    task = asyncio.create_task(run())
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+
+
+def index_items(provider: str, account: str, object_type: str, items: list[dict]):
+    """Replace the account's segment with ``items`` (serialized), in the background.
+
+    ``items`` must be a complete load; callers only get here once the load succeeded.
+    """
+    builder = SegmentBuilder()
+
+    async def write():
+        await asyncio.to_thread(builder.add_dicts, items)
+        await _write_segment(provider, account, object_type, time.time(), builder)
+
+    _in_background(f'{provider} account {account}', write())
+
+
+def index_snapshot(provider: str, account: str, object_type: str, fetched_at: float, body: bytes):
+    """Index a cached snapshot unless the account's segment already has this version or a newer one."""
+    index = (provider, account)
+    known = _indexes.get(index, {}).get(object_type)
+    if known is not None and known[0] >= fetched_at:
+        return
+
+    async def write():
+        stored = await get_hash_field_redis(_versions_key(provider, account), object_type)
+        if stored is not None and float(stored) >= fetched_at:
+            _remember(provider, account, object_type, float(stored), None)
+            return
+        builder = SegmentBuilder()
+        try:
+            await asyncio.to_thread(lambda: builder.add_dicts(json.loads(body)))
+            await _write_segment(provider, account, object_type, fetched_at, builder)
+        except Exception:
+            # Let the next request serving this snapshot try again
+            if _indexes.get(index, {}).get(object_type) == (fetched_at, None):
+                del _indexes[index][object_type]
+            raise
+
+    # Several requests may serve the same snapshot before the first write lands
+    _remember(provider, account, object_type, fetched_at, None)
+    _in_background(f'{provider} account {account}', write())
+
+
+async def index_stream(provider: str, account: str, object_type: str, items: AsyncIterator) -> AsyncIterator:
+    """Pass ``items`` through, adding each to a new segment that is written once the load completes.
+
+    The segment is only written after ``items`` is exhausted. Loaders raise on
+    upstream errors instead of ending early, so a load that fails or is
+    abandoned by the client leaves the previous segment in place.
+    """
+    builder = SegmentBuilder()
+    try:
+        async for item in items:
+            builder.add(item.id, item.name, item.type, item.parent_id)
+            yield item
+    finally:
+        await items.aclose()
+    _in_background(
+        f'{provider} account {account}',
+        _write_segment(provider, account, object_type, time.time(), builder),
+    )
+
+
+async def _decoded(provider: str, account: str, object_type: str, version: float, blob: bytes) -> Segment:
+    decode_key = (provider, account, object_type, version)
+    task = _decoding.get(decode_key)
+    if task is None:
+        task = _decoding[decode_key] = asyncio.create_task(asyncio.to_thread(Segment.decode, blob))
+        task.add_done_callback(lambda _: _decoding.pop(decode_key, None))
+    # Shielded so one client disconnecting does not cancel a decode others wait on
+    return await asyncio.shield(task)
+
+
+async def _account_segments(provider: str, account: str) -> list[Segment]:
+    """The account's current segments, loading the ones that changed since this worker last saw them."""
+    index = (provider, account)
+    stored = {
+        field.decode('utf-8'): float(value)
+        for field, value in (await get_hash_redis(_versions_key(provider, account))).items()
+    }
+    local = _indexes.get(index, {})
+    stale = [
+        object_type for object_type, version in stored.items()
+        if object_type not in local or local[object_type][0] != version or local[object_type][1] is None
+    ]
+    segments = {object_type: local[object_type] for object_type in stored if object_type not in stale}
+    # Keep the marks of snapshots this worker is still indexing
+    segments.update({
+        object_type: entry for object_type, entry in local.items() if object_type not in stored and entry[1] is None
+    })
+    if stale:
+        with span('search_load'):
+            blobs = await get_values_redis(*[_segment_key(provider, account, object_type) for object_type in stale])
+            loaded = [
+                (object_type, await _decoded(provider, account, object_type, stored[object_type], blob))
+                for object_type, blob in zip(stale, blobs) if blob is not None
+            ]
+        for object_type, segment in loaded:
+            segments[object_type] = (stored[object_type], segment)
+    # Segments removed or expired in Redis are dropped here as well
+    _indexes[index] = segments
+    _indexes.move_to_end(index)
+    _evict()
+    return [segment for _, segment in segments.values() if segment is not None]
+
+
+def _ranked(segment: Segment, position: int, tokens: list[str], item_type: Optional[str], limit: int):
+    for key, rank in segment.search(tokens, item_type, limit):
+        yield key, position, rank
+
+
+def search_segments(
+    segments: list[Segment], tokens: list[str], item_type: Optional[str] = None,
+    provider: Optional[str] = None, limit: int = 20,
+) -> list[dict]:
+    """The best ``limit`` items across ``segments``, each item once."""
+    selected = [segment for segment in segments if provider is None or segment.provider == provider]
+    results, seen = [], set()
+    for _, position, rank in heapq.merge(*(
+        _ranked(segment, position, tokens, item_type, limit) for position, segment in enumerate(selected)
+    )):
+        segment = selected[position]
+        # The same item can match several words, or be in segments of differently scoped loads
+        identity = (segment.provider, segment.account, segment.ids[rank])
+        if identity in seen:
+            continue
+        seen.add(identity)
+        results.append(segment.item(rank))
+        if len(results) == limit:
+            break
+    return results
+
+
+async def search(
+    accounts: Iterable[tuple[str, str]], text: str, item_type: Optional[str] = None,
+    provider: Optional[str] = None, limit: int = 20,
+) -> list[dict]:
+    """Items of the verified ``(provider, account)`` pairs whose name has a word starting with each word of ``text``, best first."""
+    started = time.perf_counter()
+    selected = dict.fromkeys(index for index in accounts if provider is None or index[0] == provider)
+    segments = [
+        segment
+        for account_segments in await asyncio.gather(*(_account_segments(*index) for index in selected))
+        for segment in account_segments
+    ]
+    with span('search'):
+        results = search_segments(segments, tokenize(text), item_type, provider, limit)
+    SEARCH_DURATION.observe(time.perf_counter() - started)
+    return results
@@ -0,0 +1,87 @@
+"""
+Helpers for streaming integration items to the client as they are loaded.
+
+Loaders expose ``iter_items_<provider>`` async generators; the ``/load`` routes
+either collect them into a list (default) or, when the client asks for
+newline-delimited JSON, forward each item as soon as it is produced.
+"""
+import asyncio
+import json
+from typing import AsyncIterator
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+_DONE = object()
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    """True when the client opted into streaming via ``?stream=true`` or the Accept header."""
+    if stream:
+        return True
+    accept = request.headers.get('accept', '')
+    return NDJSON_MEDIA_TYPE in accept or 'application/jsonl' in accept
+
+
+async def merge_async_iterators(*iterators: AsyncIterator) -> AsyncIterator:
+    """Yield items from several async iterators as soon as any of them produces one.
+
+    Each iterator is drained in its own task. If the consumer stops early the
+    remaining tasks are cancelled; an exception in any iterator is re-raised.
+    """
+    queue = asyncio.Queue(maxsize=len(iterators) * 2 or 1)
+
+    async def drain(iterator):
+        try:
+            async for item in iterator:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(_DONE)
+
+    tasks = [asyncio.create_task(drain(iterator)) for iterator in iterators]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _encode_line(item) -> bytes:
+    return (json.dumps(item.to_dict(), separators=(',', ':')) + '\n').encode('utf-8')
+
+
+async def ndjson_response(items: AsyncIterator) -> StreamingResponse:
+    """Wrap an item iterator in a newline-delimited JSON StreamingResponse.
+
+    The first item is pulled before the response starts so that errors raised
+    up front (missing token, bad credentials) still surface as a normal HTTP
+    error instead of a truncated 200 stream.
+    """
+    try:
+        first = await items.__anext__()
+    except StopAsyncIteration:
+        first = _DONE
+
+    async def body():
+        try:
+            if first is _DONE:
+                return
+            yield _encode_line(first)
+            async for item in items:
+                yield _encode_line(item)
+        finally:
+            await items.aclose()
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
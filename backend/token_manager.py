@@ -0,0 +1,179 @@
+"""
+OAuth access-token store with proactive, single-flight refresh.
+
+Tokens are kept in Redis per provider and verified account (see
+``accounts.verified_account``) together with their expiry.
+``get_access_token`` refreshes shortly before a token expires, and
+``refresh_access_token`` coalesces concurrent refreshes for one account into a
+single upstream call: within a worker through a shared task, across workers
+through a Redis lock. Providers plug in by registering a refresher with
+``register_token_refresher``.
+"""
+import asyncio
+import json
+import secrets
+import time
+from typing import Awaitable, Callable
+from redis.exceptions import RedisError
+from config import config
+from accounts import bind_refresh_token
+from rate_limiter import rate_limited_request
+
+from redis_client import (
+    add_key_value_redis,
+    add_key_value_if_absent_redis,
+    get_value_redis,
+    run_script_redis,
+)
+
+# Deletes the lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_refreshers: dict[str, Callable[[str], Awaitable[dict]]] = {}
+_inflight_refreshes: dict[tuple[str, str], asyncio.Task] = {}
+
+
+class TokenRefreshError(Exception):
+    """The provider rejected a refresh, or no refresh token is available."""
+
+
+def register_token_refresher(provider: str, refresher: Callable[[str], Awaitable[dict]]):
+    """Register ``refresher(refresh_token) -> token response`` for a provider."""
+    _refreshers[provider] = refresher
+
+
+def _token_key(provider: str, account: str) -> str:
+    return f'oauth_tokens:{provider}:{account}'
+
+
+def _normalize(tokens: dict, previous: dict = None) -> dict:
+    """Keep the fields we need and turn ``expires_in`` into an absolute ``expires_at``."""
+    previous = previous or {}
+    expires_at = tokens.get('expires_at')
+    if expires_at is None and tokens.get('expires_in'):
+        expires_at = time.time() + float(tokens['expires_in'])
+    return {
+        'access_token': tokens.get('access_token') or previous.get('access_token'),
+        # Providers that do not rotate refresh tokens omit them from refresh responses
+        'refresh_token': tokens.get('refresh_token') or previous.get('refresh_token'),
+        'expires_at': expires_at,
+    }
+
+
+async def store_tokens(provider: str, account: str, tokens: dict, previous: dict = None) -> dict:
+    stored = _normalize(tokens, previous)
+    await add_key_value_redis(_token_key(provider, account), json.dumps(stored), expire=config.TOKEN_STORE_TTL)
+    if tokens.get('refresh_token'):
+        await bind_refresh_token(provider, tokens['refresh_token'], account)
+    return stored
+
+
+async def load_tokens(provider: str, account: str):
+    stored = await get_value_redis(_token_key(provider, account))
+    return json.loads(stored) if stored else None
+
+
+def _expires_soon(tokens: dict) -> bool:
+    expires_at = tokens.get('expires_at')
+    return expires_at is not None and expires_at - time.time() < config.TOKEN_REFRESH_MARGIN
+
+
+async def get_access_token(provider: str, account: str, credentials: dict) -> str:
+    """Current access token for an account, refreshed first if it is about to expire.
+
+    ``account`` must be the verified account of ``credentials``. The first
+    call for an account seeds the store from the client's credentials.
+    If Redis is unreachable the client's token is used as-is.
+    """
+    try:
+        tokens = await load_tokens(provider, account)
+        if tokens is None:
+            tokens = await store_tokens(provider, account, credentials)
+    except RedisError as e:
+        print(f'Token store unavailable, using the provided {provider} token: {e}')
+        return credentials.get('access_token')
+    if _expires_soon(tokens) and tokens.get('refresh_token') and provider in _refreshers:
+        try:
+            return await refresh_access_token(provider, account, tokens['access_token'])
+        except TokenRefreshError as e:
+            # The current token may still work for a little while
+            print(f'Proactive {provider} token refresh failed: {e}')
+    return tokens['access_token']
+
+
+async def refresh_access_token(provider: str, account: str, stale_token: str) -> str:
+    """Return a token newer than ``stale_token``, refreshing it at most once per account.
+
+    Concurrent callers in this worker share one task; other workers wait on
+    the Redis lock and pick up the token the lock holder stored.
+    """
+    key = (provider, account)
+    task = _inflight_refreshes.get(key)
+    if task is None:
+        task = asyncio.create_task(_refresh_with_lock(provider, account, stale_token))
+        _inflight_refreshes[key] = task
+        task.add_done_callback(lambda _: _inflight_refreshes.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _refresh_with_lock(provider: str, account: str, stale_token: str) -> str:
+    lock_key = f'{_token_key(provider, account)}:lock'
+    owner = secrets.token_hex(8)
+    deadline = time.monotonic() + config.TOKEN_REFRESH_LOCK_TTL
+
+    while not await add_key_value_if_absent_redis(lock_key, owner, expire=config.TOKEN_REFRESH_LOCK_TTL):
+        # Another worker is refreshing; use its result as soon as it lands
+        tokens = await load_tokens(provider, account)
+        if tokens and tokens.get('access_token') != stale_token:
+            return tokens['access_token']
+        if time.monotonic() > deadline:
+            raise TokenRefreshError(f'Timed out waiting for another worker to refresh the {provider} token')
+        await asyncio.sleep(0.1)
+
+    try:
+        tokens = await load_tokens(provider, account) or {}
+        if tokens.get('access_token') and tokens['access_token'] != stale_token:
+            # Refreshed by someone else between our 401 and taking the lock
+            return tokens['access_token']
+        if not tokens.get('refresh_token') or provider not in _refreshers:
+            raise TokenRefreshError(f'No refresh token available for {provider}')
+
+        refreshed = await _refreshers[provider](tokens['refresh_token'])
+        stored = await store_tokens(provider, account, refreshed, previous=tokens)
+        # Do not print full tokens
+        print(f'{provider} access token refreshed successfully')
+        return stored['access_token']
+    finally:
+        await run_script_redis(RELEASE_LOCK_SCRIPT, [lock_key], [owner])
+
+
+async def authorized_request(
+    provider: str,
+    account: str,
+    credentials: dict,
+    buckets: list[tuple[str, str]],
+    method: str,
+    url: str,
+    headers: dict = None,
+    **kwargs,
+):
+    """Rate-limited request with a managed bearer token, refreshed and retried once on a 401."""
+    access_token = await get_access_token(provider, account, credentials)
+    response = await rate_limited_request(
+        buckets, method, url, headers={**(headers or {}), 'Authorization': f'Bearer {access_token}'}, **kwargs
+    )
+    if response.status_code == 401 and provider in _refreshers:
+        try:
+            access_token = await refresh_access_token(provider, account, access_token)
+        except (TokenRefreshError, RedisError) as e:
+            print(f'Failed to refresh {provider} token: {e}')
+            return response
+        response = await rate_limited_request(
+            buckets, method, url, headers={**(headers or {}), 'Authorization': f'Bearer {access_token}'}, **kwargs
+        )
+    return response
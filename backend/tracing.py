@@ -0,0 +1,58 @@
+"""
+Per-request span totals for the ``Server-Timing`` header.
+
+``span(name)`` times a phase (upstream HTTP, JSON decoding, item construction,
+serialization, Redis) and adds it to the totals of the request being served.
+Totals live in a context variable, so tasks spawned while serving the request
+(concurrent pagination, merged iterators) add to the same totals; phases that
+overlap are summed and can exceed the request's wall time. Outside a request
+spans cost one context-variable lookup.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# span name -> [total seconds, count]
+_request_spans: ContextVar[Optional[dict]] = ContextVar('request_spans', default=None)
+
+
+def start_request_spans() -> dict:
+    """Start collecting spans for the current request; returns the (shared, mutable) totals."""
+    spans = {}
+    _request_spans.set(spans)
+    return spans
+
+
+def record_span(name: str, seconds: float):
+    spans = _request_spans.get()
+    if spans is None:
+        return
+    total = spans.get(name)
+    if total is None:
+        spans[name] = [seconds, 1]
+    else:
+        total[0] += seconds
+        total[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    if _request_spans.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def server_timing_header(spans: dict, total_seconds: float) -> str:
+    """Render totals as ``name;dur=<ms>;desc="<n> calls"`` entries plus the request total."""
+    entries = [
+        f'{name};dur={seconds * 1000:.1f};desc="{count} calls"'
+        for name, (seconds, count) in spans.items()
+    ]
+    entries.append(f'total;dur={total_seconds * 1000:.1f}')
+    return ', '.join(entries)